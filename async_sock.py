@@ -0,0 +1,276 @@
+import asyncio
+from time import monotonic
+from tcp_sock import TCPSocket
+from socket_filter import FlowFilter
+
+READ_SIZE = 1 << 16  # bytes per chunk yielded by recv_chunks()
+
+
+class AsyncTCPSocket(TCPSocket):
+    """
+    This class represents the asyncio variant of the TCP socket. Instead of blocking in recv_pkt(), it has its link
+    watch the receive socket from the event loop (loop.add_reader for raw sockets) and runs the retransmission and
+    delayed ACK timers as loop timers, so one process can drive many connections at once. The TCP logic itself is
+    TCPSocket's.
+
+    Received data goes into an asyncio.StreamReader, available as the reader attribute once connected: read(),
+    readline(), readexactly() and readuntil() work as on any asyncio stream.
+
+    Connections can share the sockets of a PacketEngine (see packet_engine.py) instead of opening their own, in which
+    case they go through the engine's link.
+    """
+
+    def __init__(self, dst_host: str, engine=None, **kwargs):
+        """
+        Instantiates this AsyncTCPSocket object to the given destination address.
+
+        :param dst_host: the destination address
+        :param engine: the PacketEngine to share, None to open this connection's own sockets
+        :param kwargs: the TCPSocket options
+        """
+
+        self.engine = engine  # before TCPSocket.__init__, which opens the sockets
+        if engine is not None:
+            kwargs["link"] = engine.link
+        super().__init__(dst_host, **kwargs)
+        self.loop = None  # the running event loop, see connect()
+        self.reader = None  # received data
+        self.timer = None  # handle of the earliest pending timer
+        self.idle_deadline = None  # when to re-send an ACK if nothing is outstanding and the server is silent
+        self.handshake = None  # resolved with the handshake's outcome
+        self.fin_answer = None  # resolved once the server answered our FIN
+        self.progress = None  # resolved with the next pkt, wakes send() up
+
+    def open_sockets(self, kernel_filter: bool = True):
+        """
+        Opens the raw sockets of this connection, or registers it with the shared PacketEngine under a port no other
+        connection to the same server uses.
+
+        :param kernel_filter: whether to attach a BPF filter to this connection's own receive socket
+        """
+
+        if self.engine is None:
+            super().open_sockets(kernel_filter)
+            return
+        self.flow = FlowFilter(self.src_host, self.src_port, self.dst_host, self.dst_port)
+        while self.flow.key in self.engine:
+            port = self.src_port
+            self.src_port = self.link.pick_port()
+            self.link.release_port(port)
+            self.flow = FlowFilter(self.src_host, self.src_port, self.dst_host, self.dst_port)
+        self.engine.register(self)
+        self.link.open_shared(self, self.engine)
+        self.instrument()
+
+    async def connect(self) -> bool:
+        """
+        Performs the three-way handshake to establish a TCP connection.
+
+        :return: True if the connection is successful, False otherwise
+        """
+
+        self.loop = asyncio.get_running_loop()
+        self.reader = asyncio.StreamReader()
+        self.handshake = self.loop.create_future()
+        if self.engine is None:
+            self.link.add_reader(self.loop, self.recv_sock, self.on_readable)
+        else:
+            self.engine.listen()
+        self.send_syn()
+        self.after_event()
+        if await self.handshake:
+            return True
+        self.release()
+        return False
+
+    async def send(self, data: str or bytes):
+        """
+        Sends data with a sliding window, returning once everything is acknowledged (see TCPSocket.send()).
+
+        :param data: the data
+        """
+
+        if isinstance(data, str):
+            data = data.encode()
+        data = memoryview(data)
+        offset = 0
+        while (offset < len(data) or self.retransmission_queue) and self.fin_answer is None:
+            offset = self.fill_window(data, offset)
+            self.after_event()
+            self.progress = self.loop.create_future()
+            await self.progress
+
+    async def recv(self) -> bytes:
+        """
+        Receives and returns the server's data until it closes the connection.
+
+        :return: the data
+        """
+
+        return await self.reader.read()
+
+    async def recv_chunks(self):
+        """
+        Receives the server's data until it closes the connection, yielding chunks as they arrive.
+
+        :return: an async generator of in-order data chunks
+        """
+
+        while True:
+            chunk = await self.reader.read(READ_SIZE)
+            if not chunk:
+                break
+            yield chunk
+
+    async def close(self):
+        """
+        Shuts down the connection: sends a FIN, waits for the server's answer and releases the sockets.
+        """
+
+        if self.closed:
+            return
+        if self.fin_answer is None:
+            self.fin_answer = self.loop.create_future()
+            self.send_fin()
+            self.after_event()
+        await self.fin_answer
+
+    def on_readable(self):
+        """
+        Handles a batch of incoming pkts, called by the event loop when the raw socket is readable.
+        """
+
+        try:
+            raw_pkt = self.recv_ring.recv(0)
+        except (BlockingIOError, TimeoutError):  # the readiness was spurious
+            return
+        while True:
+            self.on_raw_pkt(raw_pkt)
+            if not self.recv_ring or self.closed:
+                break
+            raw_pkt = self.recv_ring.recv(0)
+        self.after_event()
+
+    def on_raw_pkt(self, raw_pkt):
+        """
+        Handles an incoming pkt, without re-arming the timer: see after_event().
+
+        :param raw_pkt: the raw IP pkt
+        """
+
+        if self.handshake is None or self.closed:  # not connecting yet, or done
+            return
+        tcp_pkt = self.handle_raw_pkt(raw_pkt)
+        if tcp_pkt:
+            self.idle_deadline = None
+            self.dispatch(tcp_pkt)
+
+    def dispatch(self, tcp_pkt):
+        """
+        Hands an incoming pkt to whatever waits for it: the handshake, the close or the data stream.
+
+        :param tcp_pkt: the TCP pkt
+        """
+
+        if not self.handshake.done():  # the pkt is a view of the receive ring, so it is handled right away
+            self.handshake.set_result(self.establish(tcp_pkt, on_data=self.reader.feed_data))  # the reader copies
+            return
+        if tcp_pkt.rst:  # nothing to wait for, not even the answer to a FIN
+            self.abort(ConnectionResetError("Connection reset by the server"))
+            return
+        if self.fin_answer is not None:
+            if not self.fin_answer.done():
+                self.fin_answer.set_result(None)
+                self.finish_close(tcp_pkt)
+            return
+        if self.process_pkt(tcp_pkt):  # the server is done
+            self.reader.feed_eof()
+            if self.fin_answer is None:
+                self.fin_answer = self.loop.create_future()
+                self.send_fin()
+        if self.progress is not None and not self.progress.done():
+            self.progress.set_result(None)
+
+    def after_event(self):
+        """
+        Re-arms the timer for the earliest deadline.
+        """
+
+        if self.closed:
+            return
+        if self.rtx_deadline is None and self.idle_deadline is None:
+            self.idle_deadline = monotonic() + self.idle_interval()
+        deadline = self.deadline()
+        if self.timer is not None:
+            if self.timer.when() == deadline:
+                return
+            self.timer.cancel()
+        self.timer = self.loop.call_at(deadline, self.on_timer)  # the default loop clock is time.monotonic()
+
+    def on_timer(self):
+        """
+        Fires the expired timer, called by the event loop.
+        """
+
+        self.timer = None
+        deadline = self.deadline()
+        if deadline is not None and deadline <= monotonic():
+            self.idle_deadline = None
+            self.fire_timers()
+        self.after_event()
+
+    def deadline(self) -> float or None:
+        """
+        Returns when the earliest timer fires: the retransmission one, or the idle one while it isn't running, or
+        the delayed ACK one.
+
+        :return: the time, None if no timer is running
+        """
+
+        deadline = self.idle_deadline if self.rtx_deadline is None else self.rtx_deadline
+        if self.ack_deadline is not None:
+            deadline = self.ack_deadline if deadline is None else min(deadline, self.ack_deadline)
+        return deadline
+
+    def give_up(self):
+        """
+        Aborts the connection after the server stopped responding: whoever waits on it gets a ConnectionError.
+        """
+
+        self.abort(ConnectionError("Connection failed"))
+
+    def abort(self, error: Exception):
+        """
+        Releases the connection, failing whoever waits on it with an error.
+
+        :param error: the exception
+        """
+
+        for future in (self.handshake, self.fin_answer, self.progress):
+            if future is not None and not future.done():
+                future.set_exception(error)
+        if self.reader is not None and not self.reader.at_eof():
+            self.reader.set_exception(error)
+        self.release()
+
+    def release(self):
+        """
+        Stops the timer, cancels whatever still waits on the connection and has the link stop watching the receive
+        socket before closing the sockets. With a PacketEngine, the connection is unregistered from it instead, and
+        the shared sockets stay open.
+        """
+
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+        for future in (self.handshake, self.fin_answer, self.progress):
+            if future is not None and not future.done():
+                future.cancel()
+        if self.engine is not None:
+            self.engine.unregister(self)
+            self.closed = True
+            self.link.release_port(self.src_port)
+            return
+        if self.loop is not None:
+            self.link.remove_reader(self.loop, self.recv_sock)
+        super().release()
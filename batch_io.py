@@ -0,0 +1,178 @@
+import ctypes
+import socket
+from collections import deque
+from ip_pkt import MAX_PACKET_SIZE
+
+RING_SLOTS = 32  # datagrams drained per wakeup; GRO can hand raw sockets up to 64 KB each
+
+
+class IOVec(ctypes.Structure):
+    _fields_ = [("iov_base", ctypes.c_void_p), ("iov_len", ctypes.c_size_t)]
+
+
+class MsgHdr(ctypes.Structure):
+    _fields_ = [
+        ("msg_name", ctypes.c_void_p),
+        ("msg_namelen", ctypes.c_uint32),
+        ("msg_iov", ctypes.c_void_p),
+        ("msg_iovlen", ctypes.c_size_t),
+        ("msg_control", ctypes.c_void_p),
+        ("msg_controllen", ctypes.c_size_t),
+        ("msg_flags", ctypes.c_int),
+    ]
+
+
+class MMsgHdr(ctypes.Structure):
+    _fields_ = [("msg_hdr", MsgHdr), ("msg_len", ctypes.c_uint)]
+
+
+def load_libc():
+    """
+    Loads the C library's recvmmsg, which Python's socket module doesn't expose.
+
+    :return: the C library, or None if it doesn't have it (non-Linux platforms)
+    """
+
+    try:
+        libc = ctypes.CDLL(None, use_errno=True)
+        libc.recvmmsg.restype = ctypes.c_int
+        libc.recvmmsg.argtypes = [ctypes.c_int, ctypes.c_void_p, ctypes.c_uint, ctypes.c_int, ctypes.c_void_p]
+        return libc
+    except (OSError, AttributeError, TypeError):
+        return None
+
+
+LIBC = load_libc()
+
+
+class RecvRing:
+    """
+    This class represents a ring of preallocated receive buffers. Each wakeup waits for one datagram, then drains
+    whatever else is queued on the socket without blocking: with a single recvmmsg call where the C library has it,
+    with non-blocking recv_into calls otherwise. Nothing is allocated per datagram but a memoryview.
+
+    The views returned by recv() point into the ring, so they are only valid until the ring is refilled, i.e. until
+    recv() is called again after every datagram of the batch was returned.
+    """
+
+    __slots__ = ("sock", "buffers", "views", "pending", "msgs", "arrays")
+
+    def __init__(self, sock: socket.socket, slots: int = RING_SLOTS, slot_size: int = MAX_PACKET_SIZE):
+        """
+        Instantiates this RecvRing object to the given socket and ring size.
+
+        :param sock: the socket to receive from
+        :param slots: the number of buffers, i.e. the maximum batch size
+        :param slot_size: the size of each buffer, i.e. the maximum datagram size
+        """
+
+        self.sock = sock
+        self.buffers = [bytearray(slot_size) for _ in range(slots)]
+        self.views = [memoryview(buffer) for buffer in self.buffers]
+        self.pending = deque()  # views of the datagrams received but not returned yet
+        self.msgs = None  # recvmmsg headers, set up once and reused
+        self.arrays = None  # ctypes views of the buffers, kept alive for the headers
+        if LIBC is not None:
+            self.arrays = [(ctypes.c_char * slot_size).from_buffer(buffer) for buffer in self.buffers]
+            iovecs = (IOVec * slots)(*[IOVec(ctypes.addressof(array), slot_size) for array in self.arrays])
+            self.msgs = (MMsgHdr * slots)()
+            for i, msg in enumerate(self.msgs):
+                msg.msg_hdr.msg_iov = ctypes.addressof(iovecs) + i * ctypes.sizeof(IOVec)
+                msg.msg_hdr.msg_iovlen = 1
+            self.arrays.append(iovecs)
+
+    def __len__(self) -> int:
+        """
+        Returns the number of datagrams received but not returned yet.
+
+        :return: the number of datagrams
+        """
+
+        return len(self.pending)
+
+    def recv(self, timeout: float) -> memoryview:
+        """
+        Returns the next datagram, receiving a new batch if the current one is used up.
+
+        :param timeout: how long to wait for a new batch, in seconds
+        :return: a view of the datagram
+        """
+
+        if not self.pending:
+            self.fill(timeout)
+        return self.pending.popleft()
+
+    def fill(self, timeout: float):
+        """
+        Waits for a datagram and drains the socket into the ring.
+
+        :param timeout: how long to wait, in seconds
+        """
+
+        self.sock.settimeout(timeout)
+        length = self.sock.recv_into(self.buffers[0])  # raises TimeoutError
+        self.pending.append(self.views[0][:length])
+        if self.msgs is not None:
+            self.drain_mmsg()
+        else:
+            self.drain()
+
+    def drain_mmsg(self):
+        """
+        Receives the queued datagrams into the rest of the ring with one recvmmsg call.
+        """
+
+        start = 1
+        count = LIBC.recvmmsg(
+            self.sock.fileno(),
+            ctypes.addressof(self.msgs) + start * ctypes.sizeof(MMsgHdr),
+            len(self.buffers) - start,
+            socket.MSG_DONTWAIT,
+            None,
+        )
+        for i in range(start, start + max(count, 0)):  # -1 with EAGAIN when nothing else is queued
+            self.pending.append(self.views[i][:self.msgs[i].msg_len])
+
+    def drain(self):
+        """
+        Receives the queued datagrams into the rest of the ring, one recv_into call each.
+        """
+
+        self.sock.settimeout(0)  # a timeout would make recv_into wait for every datagram
+        for i in range(1, len(self.buffers)):
+            try:
+                length = self.sock.recv_into(self.buffers[i])
+            except BlockingIOError:
+                break
+            self.pending.append(self.views[i][:length])
+
+
+class Sender:
+    """
+    This class represents the sending end of a raw socket: each datagram goes out with its own sendmsg call, as soon
+    as it is built, straight from its parts without joining them. Holding datagrams back to send them together only
+    added overhead: batching them into sendmmsg calls was measured slower at every batch size, since copying the
+    datagrams into a ctypes arena costs more in Python than the system calls it saves.
+    """
+
+    __slots__ = ("sock", "addr")
+
+    def __init__(self, sock: socket.socket, addr: tuple):
+        """
+        Instantiates this Sender object to the given socket and IPv4 destination address.
+
+        :param sock: the socket to send with
+        :param addr: the (host, port) destination address
+        """
+
+        self.sock = sock
+        self.addr = addr
+
+    def send(self, bufs: list):
+        """
+        Sends a datagram.
+
+        :param bufs: the datagram's bytes-like parts, in order
+        """
+
+        self.sock.sendmsg(bufs, (), 0, self.addr)  # raw and UDP sockets send a datagram whole or raise
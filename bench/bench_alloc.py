@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+"""
+Measures the memory allocated per segment on a simulated transfer: each received segment is parsed and answered
+with an ACK, built either the original way (TCPPacket + IPPacket objects) or with a pre-built HeaderTemplate.
+
+Usage: python3 bench/bench_alloc.py [segments]
+"""
+import os
+import sys
+import tracemalloc
+from time import perf_counter
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from ip_pkt import IPPacket  # noqa: E402
+from tcp_pkt import TCPPacket, HeaderTemplate  # noqa: E402
+
+SRC_HOST, SRC_PORT = "10.0.0.1", 40000
+DST_HOST, DST_PORT = "10.0.0.2", 80
+MSS = 1460
+
+
+def build_segments(count: int) -> list:
+    """
+    Builds the raw datagrams the server would send us.
+
+    :param count: the number of distinct datagrams
+    :return: the raw datagrams
+    """
+
+    payload = os.urandom(MSS).hex()[:MSS]
+    segments = []
+    for i in range(count):
+        tcp_pkt = TCPPacket(DST_HOST, DST_PORT, SRC_HOST, SRC_PORT, payload)
+        tcp_pkt.seq_num = i * MSS
+        tcp_pkt.ack = True
+        segments.append(bytes(IPPacket(src=DST_HOST, dst=SRC_HOST, data=tcp_pkt.pack()).pack()))
+    return segments
+
+
+def legacy_ack(ack_num: int) -> bytes:
+    """
+    Builds an ACK the original way.
+
+    :param ack_num: the acknowledgment number
+    :return: the encoded IP pkt
+    """
+
+    ack_pkt = TCPPacket(SRC_HOST, SRC_PORT, DST_HOST, DST_PORT)
+    ack_pkt.seq_num = 1
+    ack_pkt.ack_num = ack_num
+    ack_pkt.ack = True
+    return IPPacket(src=SRC_HOST, dst=DST_HOST, data=ack_pkt.pack()).pack()
+
+
+def run(segments: list, total: int, send_ack) -> tuple:
+    """
+    Simulates a transfer of the given number of segments.
+
+    :param segments: the raw datagrams to cycle through
+    :param total: the number of segments to process
+    :param send_ack: builds the ACK for an acknowledgment number
+    :return: the average peak bytes allocated per segment by parsing and by the ACK, and the time per segment in
+             microseconds
+    """
+
+    tracemalloc.start()
+    parse_allocated = 0
+    ack_allocated = 0
+    for i in range(total):
+        tracemalloc.reset_peak()
+        before, _ = tracemalloc.get_traced_memory()
+        ip_pkt = IPPacket.unpack(segments[i % len(segments)])
+        tcp_pkt = TCPPacket.unpack(ip_pkt, ip_pkt.data)
+        ack_num = tcp_pkt.seq_num + len(tcp_pkt.payload)
+        parse_allocated += tracemalloc.get_traced_memory()[1] - before
+        tracemalloc.reset_peak()
+        before, _ = tracemalloc.get_traced_memory()
+        send_ack(ack_num)
+        ack_allocated += tracemalloc.get_traced_memory()[1] - before
+    tracemalloc.stop()
+
+    start = perf_counter()
+    for i in range(total):
+        ip_pkt = IPPacket.unpack(segments[i % len(segments)])
+        tcp_pkt = TCPPacket.unpack(ip_pkt, ip_pkt.data)
+        send_ack(tcp_pkt.seq_num + len(tcp_pkt.payload))
+    elapsed = perf_counter() - start
+    return parse_allocated / total, ack_allocated / total, elapsed / total * 1e6
+
+
+def main():
+    total = int(sys.argv[1]) if len(sys.argv) > 1 else 50000
+    segments = build_segments(64)
+    template = HeaderTemplate(SRC_HOST, SRC_PORT, DST_HOST, DST_PORT)
+    print("%d segments" % total)
+    print("%10s %14s %14s %14s" % ("ACK path", "parse bytes", "ACK bytes", "us/segment"))
+    for name, send_ack in (
+        ("legacy", legacy_ack),
+        ("template", lambda ack_num: template.stamp(1, ack_num, 65535)),
+    ):
+        parse_allocated, ack_allocated, elapsed = run(segments, total, send_ack)
+        print("%10s %14.0f %14.0f %14.2f" % (name, parse_allocated, ack_allocated, elapsed))
+
+
+if __name__ == "__main__":
+    main()
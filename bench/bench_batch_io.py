@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+"""
+Compares one system call per datagram (recv / sendmsg) with the batched RecvRing and the Sender the stack uses, over
+UDP on the loopback interface, which needs no privileges. Raw sockets go through the same system calls. Sender sends
+each datagram with its own sendmsg call, so its send time should match the plain one.
+
+Usage: python3 bench/bench_batch_io.py [datagrams]
+"""
+import os
+import socket
+import sys
+from time import perf_counter
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import batch_io  # noqa: E402
+from batch_io import RecvRing, Sender  # noqa: E402
+
+DATAGRAM = [os.urandom(40), os.urandom(1460)]  # header, payload
+TIMEOUT = 0.5
+REPEAT = 5
+
+
+def plain_io(sender: socket.socket, receiver: socket.socket, addr: tuple) -> tuple:
+    """
+    Returns send and receive functions that use one system call per datagram.
+
+    :param sender: the sending socket
+    :param receiver: the receiving socket
+    :param addr: the destination address
+    :return: the send(count) and recv(count) functions
+    """
+
+    def send(count: int):
+        for _ in range(count):
+            sender.sendmsg(DATAGRAM, (), 0, addr)
+
+    def recv(count: int):
+        receiver.settimeout(TIMEOUT)
+        for _ in range(count):
+            receiver.recv(65535)
+
+    return send, recv
+
+
+def batched_io(sender: socket.socket, receiver: socket.socket, addr: tuple) -> tuple:
+    """
+    Returns send and receive functions that go through a Sender and a RecvRing.
+
+    :param sender: the sending socket
+    :param receiver: the receiving socket
+    :param addr: the destination address
+    :return: the send(count) and recv(count) functions
+    """
+
+    stack_sender = Sender(sender, addr)
+    ring = RecvRing(receiver)
+
+    def send(count: int):
+        for _ in range(count):
+            stack_sender.send(DATAGRAM)
+
+    def recv(count: int):
+        for _ in range(count):
+            ring.recv(TIMEOUT)
+
+    return send, recv
+
+
+def run(count: int, make_io) -> tuple:
+    """
+    Sends the datagrams in bursts the receive buffer can hold, then receives them.
+
+    :param count: the number of datagrams
+    :param make_io: returns the send and receive functions
+    :return: the send and receive times per datagram in microseconds
+    """
+
+    receiver = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    receiver.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 1 << 24)
+    receiver.bind(("127.0.0.1", 0))
+    sender = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    send, recv = make_io(sender, receiver, receiver.getsockname())
+    burst = 256
+    send_time = recv_time = 0.0
+    for _ in range(count // burst):
+        start = perf_counter()
+        send(burst)
+        send_time += perf_counter() - start
+        start = perf_counter()
+        recv(burst)
+        recv_time += perf_counter() - start
+    sender.close()
+    receiver.close()
+    count = count // burst * burst
+    return send_time / count * 1e6, recv_time / count * 1e6
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    print("%d datagrams of %d bytes, recvmmsg %s" % (
+        count, sum(map(len, DATAGRAM)), "available" if batch_io.LIBC else "unavailable"))
+    print("%10s %14s %14s" % ("I/O", "send us/pkt", "recv us/pkt"))
+    for name, make_io in (("plain", plain_io), ("batched", batched_io)):
+        runs = [run(count, make_io) for _ in range(REPEAT)]  # best of, loopback timings are noisy
+        send_us = min(send_us for send_us, _ in runs)
+        recv_us = min(recv_us for _, recv_us in runs)
+        print("%10s %14.2f %14.2f" % (name, send_us, recv_us))
+
+
+if __name__ == "__main__":
+    main()
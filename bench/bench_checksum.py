@@ -0,0 +1,57 @@
+#!/usr/bin/env python3
+"""
+Compares the original word-by-word checksum with utils.calculate_checksum on 64 B - 64 KB buffers.
+
+Usage: python3 bench/bench_checksum.py [iterations]
+"""
+import os
+import struct
+import sys
+from timeit import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from utils import calculate_checksum, update_checksum  # noqa: E402
+
+SIZES = (64, 512, 1460, 4096, 16384, 65535)
+
+
+def legacy_checksum(pkt):
+    """
+    The original checksum engine: unpacks every 16-bit word into a tuple and sums it in Python.
+
+    :param pkt: the packet
+    :return: the checksum
+    """
+
+    checksum = 0
+    words = len(pkt) // 2
+    for chunk in struct.unpack("!%sH" % words, pkt[:words * 2]):
+        checksum += chunk
+    if len(pkt) % 2 != 0:
+        checksum += pkt[-1] << 8
+    checksum = (checksum >> 16) + (checksum & 0xffff)
+    checksum += checksum >> 16
+    return ~checksum & 0xffff
+
+
+def main():
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    print("%8s %14s %14s %14s %10s" % ("size", "legacy (us)", "new (us)", "3 bufs (us)", "speedup"))
+    for size in SIZES:
+        pkt = os.urandom(size)
+        assert legacy_checksum(pkt) == calculate_checksum(pkt)
+        header, payload = memoryview(pkt)[:32], memoryview(pkt)[32:]
+        pseudo_header = os.urandom(12)
+        legacy = timeit(lambda: legacy_checksum(pseudo_header + pkt), number=iterations) / iterations * 1e6
+        new = timeit(lambda: calculate_checksum(pkt), number=iterations) / iterations * 1e6
+        split = timeit(lambda: calculate_checksum(pseudo_header, header, payload), number=iterations) / iterations * 1e6
+        print("%8d %14.2f %14.2f %14.2f %9.1fx" % (size, legacy, new, split, legacy / split))
+
+    checksum = calculate_checksum(os.urandom(1480))
+    incremental = timeit(lambda: update_checksum(checksum, 0x12345678, 0x9abcdef0), number=iterations) / iterations
+    print("RFC 1624 incremental update of a 32-bit field: %.2f us" % (incremental * 1e6))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+"""
+Measures the throughput of data.ChunkedDecoder on a large chunked body fed in socket-sized pieces, and compares it
+with the original whole-file decoder on a small body.
+
+Usage: python3 bench/bench_chunked.py [body size in MB] [chunk size in bytes]
+"""
+import os
+import sys
+from time import perf_counter
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from data import ChunkedDecoder  # noqa: E402
+
+PIECE_SIZE = 65536  # bytes handed to the decoder at a time, not aligned with the chunks
+BLOCK_SIZE = 1 << 20  # decoded bytes per pre-encoded block
+LEGACY_SIZE = 2 << 20  # body size for the comparison with the original decoder
+
+
+def encode_block(chunk_size: int) -> bytes:
+    """
+    Encodes one block of body bytes with the chunked transfer-encoding.
+
+    :param chunk_size: the size of each chunk
+    :return: the encoded block, without the last chunk
+    """
+
+    data = os.urandom(chunk_size)
+    return (b"%x\r\n" % chunk_size + data + b"\r\n") * (BLOCK_SIZE // chunk_size)
+
+
+def legacy_decode(contents: str) -> str:
+    """
+    The original decoder: string slicing and repeated concatenation over the whole body.
+
+    :param contents: the chunked body
+    :return: the decoded body
+    """
+
+    output = ""
+    start = 0
+    while True:
+        new_line_loc = contents.index("\n", start)
+        chunk_size = int(contents[start:new_line_loc], base=16)
+        if chunk_size == 0:
+            break
+        start = new_line_loc + 1
+        output += contents[start:start + chunk_size]
+        start = start + chunk_size + 2
+    return output
+
+
+def main():
+    size_mb = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    chunk_size = int(sys.argv[2]) if len(sys.argv) > 2 else 8192
+    block = encode_block(chunk_size)
+    stream = memoryview(block * 4)  # pieces straddle block boundaries
+    decoded = 0
+
+    def count(data):
+        nonlocal decoded
+        decoded += len(data)
+
+    decoder = ChunkedDecoder(count)
+    start = perf_counter()
+    fed = 0
+    target = size_mb * len(block)
+    while fed < target:
+        offset = fed % len(block)
+        decoder.feed(stream[offset:offset + PIECE_SIZE])
+        fed += PIECE_SIZE
+    decoder.feed(stream[fed % len(block):len(block)])  # finish the block
+    decoder.feed(b"0\r\n\r\n")
+    elapsed = perf_counter() - start
+    assert decoder.done
+    print("%d MB in %d B chunks: %.2f s, %.0f MB/s" % (decoded >> 20, chunk_size, elapsed, decoded / elapsed / 2**20))
+
+    body = (block * (LEGACY_SIZE // BLOCK_SIZE) + b"0\r\n\r\n").decode("latin-1")
+    start = perf_counter()
+    legacy = legacy_decode(body)
+    legacy_elapsed = perf_counter() - start
+    out = bytearray()
+    start = perf_counter()
+    ChunkedDecoder(out.extend).feed(body.encode("latin-1"))
+    new_elapsed = perf_counter() - start
+    assert legacy.encode("latin-1") == out
+    print("%d MB, legacy vs new: %.3f s vs %.3f s" % (LEGACY_SIZE >> 20, legacy_elapsed, new_elapsed))
+
+
+if __name__ == "__main__":
+    main()
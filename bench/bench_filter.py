@@ -0,0 +1,63 @@
+#!/usr/bin/env python3
+"""
+Measures what it costs to throw away a pkt of another flow: parsing and checksumming it before looking at the
+ports, as recv_pkt used to, versus the FlowFilter pre-check.
+
+Usage: python3 bench/bench_filter.py [iterations]
+"""
+import os
+import sys
+from timeit import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from ip_pkt import IPPacket  # noqa: E402
+from tcp_pkt import TCPPacket, HeaderTemplate  # noqa: E402
+from socket_filter import FlowFilter  # noqa: E402
+
+SRC_HOST, SRC_PORT = "10.0.0.1", 40000
+DST_HOST, DST_PORT = "10.0.0.2", 80
+SIZES = (0, 536, 1460, 8192)
+
+
+def other_flow_pkt(size: int) -> bytes:
+    """
+    Builds a pkt from the server to another local port.
+
+    :param size: the payload size
+    :return: the raw IP pkt
+    """
+
+    payload = os.urandom(size)
+    template = HeaderTemplate(DST_HOST, DST_PORT, SRC_HOST, SRC_PORT + 1)
+    return bytes(template.stamp(1, 1, 65535, payload=payload)) + payload
+
+
+def parse_first(raw_pkt) -> bool:
+    """
+    Checks the ports after parsing and checksumming the pkt.
+
+    :param raw_pkt: the raw IP pkt
+    :return: True if the pkt is ours
+    """
+
+    ip_pkt = IPPacket.unpack(raw_pkt)
+    tcp_pkt = TCPPacket.unpack(ip_pkt, ip_pkt.data)
+    return tcp_pkt.dst_port == SRC_PORT
+
+
+def main():
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    flow = FlowFilter(SRC_HOST, SRC_PORT, DST_HOST, DST_PORT)
+    print("%d iterations, times in us per pkt" % iterations)
+    print("%8s %14s %14s" % ("payload", "parse first", "FlowFilter"))
+    for size in SIZES:
+        raw_pkt = memoryview(other_flow_pkt(size))
+        assert not parse_first(raw_pkt) and not flow.matches(raw_pkt)
+        parsed = timeit(lambda: parse_first(raw_pkt), number=iterations)
+        filtered = timeit(lambda: flow.matches(raw_pkt), number=iterations)
+        print("%8d %14.3f %14.3f" % (size, parsed / iterations * 1e6, filtered / iterations * 1e6))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+"""
+Replays captured downloads (rawhttpget --capture, or tcpdump) through the stack at full speed, and reports how fast
+the pkts are parsed, reassembled and saved: a benchmark on real traffic. Each capture must hold one download of
+its URL, which is requested again the same way.
+
+Usage: python3 bench/bench_replay.py [--no-stream] [--repeat N] capture.pcap URL [capture.pcap URL ...]
+"""
+import argparse
+import os
+import sys
+import tempfile
+from time import perf_counter
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from download import download  # noqa: E402
+from pcap import ReplayLink  # noqa: E402
+
+REPEAT = 5
+
+
+def replay(capture: str, url: str, stream: bool, repeat: int) -> tuple:
+    """
+    Replays a capture several times and keeps the fastest run.
+
+    :param capture: the pcap file
+    :param url: the URL it downloaded
+    :param stream: whether to write the body as it arrives, or buffer it for Data.save_file
+    :param repeat: the number of runs
+    :return: the number of server pkts, the body size and the best time in seconds
+    """
+
+    links = [ReplayLink(capture) for _ in range(repeat)]  # reading the capture isn't timed
+    pkts = len(links[0].recorded[0].pkts)
+    elapsed = float("inf")
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as directory:
+        os.chdir(directory)
+        try:
+            for link in links:
+                start = perf_counter()
+                download(url, stream=stream, link=link)
+                elapsed = min(elapsed, perf_counter() - start)
+            size = sum(os.path.getsize(name) for name in os.listdir(directory))
+        finally:
+            os.chdir(cwd)
+    return pkts, size, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replays captured downloads through the stack at full speed.")
+    parser.add_argument("pairs", nargs="+", metavar="capture URL", help="pcap files and the URLs they downloaded")
+    parser.add_argument("--no-stream", dest="stream", action="store_false", help="save the bodies with save_file")
+    parser.add_argument("--repeat", type=int, default=REPEAT, help="runs per capture (default %(default)s)")
+    args = parser.parse_args()
+    if len(args.pairs) % 2:
+        parser.error("each capture needs its URL")
+    print("%24s %8s %10s %10s %12s %10s" % ("capture", "pkts", "MB", "time (s)", "pkts/s", "MB/s"))
+    for capture, url in zip(args.pairs[::2], args.pairs[1::2]):
+        pkts, size, elapsed = replay(capture, url, args.stream, max(args.repeat, 1))
+        print("%24s %8d %10.1f %10.3f %12.0f %10.1f" % (
+            os.path.basename(capture)[-24:], pkts, size / 2**20, elapsed, pkts / elapsed, size / elapsed / 2**20
+        ))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+"""
+Compares the per-connection setup steps of RawLink with the original ones: the source address (hostname -I in a
+subprocess vs. a cached routing lookup), the local port (random ports tried with a throwaway socket vs. the
+PortPool) and the server's address (gethostbyname vs. the cache).
+
+Usage: python3 bench/bench_startup.py [connections] [host]
+"""
+import os
+import socket
+import subprocess
+import sys
+from random import randint
+from time import perf_counter
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from link import PortPool  # noqa: E402
+from utils import get_local_ip_addr, resolve_host  # noqa: E402
+
+MAX_PORT = 65535
+
+
+def legacy_local_addr() -> str:
+    """
+    The original source address lookup: forks hostname -I for every connection.
+
+    :return: the output of hostname -I, which lists every address of the host
+    """
+
+    return subprocess.check_output(["hostname", "-I"]).decode().strip()
+
+
+def legacy_pick_port() -> int:
+    """
+    The original port picker: binds a throwaway socket to random ports until one is free, then closes it, so the
+    port isn't reserved.
+
+    :return: the port
+    """
+
+    test_sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    while True:
+        port = randint(1025, MAX_PORT)
+        try:
+            test_sock.bind(("0.0.0.0", port))
+            break
+        except OSError:
+            pass
+    test_sock.close()
+    return port
+
+
+def per_call(run, count: int) -> float:
+    """
+    Times a setup step.
+
+    :param run: the step
+    :param count: the number of calls
+    :return: the time per call in microseconds
+    """
+
+    start = perf_counter()
+    for _ in range(count):
+        run()
+    return (perf_counter() - start) / count * 1e6
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    host = sys.argv[2] if len(sys.argv) > 2 else "localhost"
+    dst_host = socket.gethostbyname(host)
+    pool = PortPool()
+
+    def take_and_release():
+        pool.release(pool.take())
+
+    print("%d connections, server %s" % (count, host))
+    print("%14s %14s %14s %10s" % ("step", "legacy (us)", "new (us)", "speedup"))
+    for name, legacy, new in (
+        ("source addr", legacy_local_addr, lambda: get_local_ip_addr(dst_host)),
+        ("port", legacy_pick_port, take_and_release),
+        ("resolve", lambda: socket.gethostbyname(host), lambda: resolve_host(host)),
+    ):
+        legacy_time, new_time = per_call(legacy, count), per_call(new, count)
+        print("%14s %14.1f %14.1f %9.2fx" % (name, legacy_time, new_time, legacy_time / new_time))
+
+
+if __name__ == "__main__":
+    main()
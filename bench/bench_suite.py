@@ -0,0 +1,461 @@
+#!/usr/bin/env python3
+"""
+Runs the hot-path benchmarks of the stack and reports them as rates, where higher is better: pkts/s for the IP and
+TCP pkt codecs, the checksum and the reassembly of reordered segments in TCPSocket.recv_chunks, MB/s for
+Data.save_file and the chunked decoder on multi-MB responses, the goodput of whole downloads over a clean and a
+lossy SimLink, pkts/s for the replay of a captured lossy download (see pcap.ReplayLink), and pkts/s for sending
+datagrams through batch_io.Sender, one sendmsg call each, over UDP on the loopback interface.
+
+The downloads run on a sim_link.SimClock: the goodput is the protocol's, in simulated time, so it is the same on
+every machine and only moves when the stack's behavior on the link does.
+
+The results can be written as JSON (--json) and compared with a stored baseline (--baseline): any rate that fell
+by more than the tolerance is a regression, and the exit status is 1. Rates depend on the machine, so the baseline
+must come from the one running the comparison; bench/baseline.json is a reference run, refresh it with
+--json bench/baseline.json after a deliberate change.
+
+Usage: python3 bench/bench_suite.py [--json FILE] [--baseline FILE] [--tolerance FRACTION] [--repeat N] [name ...]
+"""
+import argparse
+import json
+import os
+import platform
+import socket
+import sys
+import tempfile
+from contextlib import contextmanager
+from time import perf_counter
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from batch_io import Sender  # noqa: E402
+from data import Data, ChunkedDecoder  # noqa: E402
+from download import download  # noqa: E402
+from ip_pkt import IPPacket  # noqa: E402
+from pcap import CaptureLink, ReplayLink  # noqa: E402
+from sim_link import SimLink, SimClock  # noqa: E402
+from sim_peer import ScriptedServer  # noqa: E402
+from tcp_pkt import TCPPacket, HeaderTemplate, SEQ_SPACE, ACK  # noqa: E402
+from tcp_sock import TCPSocket  # noqa: E402
+from utils import calculate_checksum  # noqa: E402
+
+SRC_HOST, SRC_PORT = "10.0.0.1", 40000
+DST_HOST, DST_PORT = "10.0.0.2", 80
+MSS = 1460
+PKTS = 20000  # pkts per sample of the pkt benchmarks
+SEGMENTS = 20000  # segments per sample of the reassembly benchmark
+REORDER_EVERY = 16  # one pair of segments in this many arrives swapped
+BODY_SIZE = 16 << 20  # bytes of the synthetic responses
+PIECE_SIZE = 65536  # bytes handed to the chunked decoder at a time
+CHUNK_SIZE = 8192  # bytes per chunk of the chunked bodies
+DOWNLOAD_SIZE = 4 << 20  # bytes per download over the SimLink
+URL = "http://sim/body"
+CLEAN_LINK = dict(bandwidth=50e6, rtt=0.01, buffer=1 << 20, seed=1)
+LOSSY_LINK = dict(CLEAN_LINK, loss=0.01, reorder=0.01)
+REPEAT = 5
+TOLERANCE = 0.25  # a rate this much below the baseline is a regression
+
+
+def best_rate(run, amount: float, repeat: int) -> float:
+    """
+    Times a benchmark several times and keeps the fastest run, the one least disturbed by the rest of the machine.
+
+    :param run: runs the benchmark once
+    :param amount: the pkts or bytes processed per run
+    :param repeat: the number of runs
+    :return: the best rate, in amount per second
+    """
+
+    elapsed = float("inf")
+    for _ in range(repeat):
+        start = perf_counter()
+        run()
+        elapsed = min(elapsed, perf_counter() - start)
+    return amount / elapsed
+
+
+def build_pkt() -> bytes:
+    """
+    Builds a full-sized data pkt from the server.
+
+    :return: the raw IP pkt
+    """
+
+    tcp_pkt = TCPPacket(DST_HOST, DST_PORT, SRC_HOST, SRC_PORT, os.urandom(MSS).hex()[:MSS])
+    tcp_pkt.ack = True
+    return bytes(IPPacket(src=DST_HOST, dst=SRC_HOST, data=tcp_pkt.pack()).pack())
+
+
+def bench_ip_pack(repeat: int) -> float:
+    """
+    Times IPPacket.pack on a full-sized data pkt.
+
+    :param repeat: the number of runs
+    :return: the best rate
+    """
+
+    tcp_data = IPPacket.unpack(build_pkt()).data.tobytes()
+
+    def run():
+        for _ in range(PKTS):
+            IPPacket(src=DST_HOST, dst=SRC_HOST, data=tcp_data).pack()
+
+    return best_rate(run, PKTS, repeat)
+
+
+def bench_ip_unpack(repeat: int) -> float:
+    """
+    Times IPPacket.unpack, checksum verification included.
+
+    :param repeat: the number of runs
+    :return: the best rate
+    """
+
+    raw_pkt = build_pkt()
+
+    def run():
+        for _ in range(PKTS):
+            IPPacket.unpack(raw_pkt)
+
+    return best_rate(run, PKTS, repeat)
+
+
+def bench_tcp_pack(repeat: int) -> float:
+    """
+    Times building and packing a TCPPacket object, the original send path.
+
+    :param repeat: the number of runs
+    :return: the best rate
+    """
+
+    payload = os.urandom(MSS).hex()[:MSS]
+
+    def run():
+        for _ in range(PKTS):
+            tcp_pkt = TCPPacket(DST_HOST, DST_PORT, SRC_HOST, SRC_PORT, payload)
+            tcp_pkt.ack = True
+            tcp_pkt.pack()
+
+    return best_rate(run, PKTS, repeat)
+
+
+def bench_tcp_stamp(repeat: int) -> float:
+    """
+    Times HeaderTemplate.stamp, the send path of TCPSocket.
+
+    :param repeat: the number of runs
+    :return: the best rate
+    """
+
+    template = HeaderTemplate(SRC_HOST, SRC_PORT, DST_HOST, DST_PORT)
+    payload = os.urandom(MSS)
+
+    def run():
+        for i in range(PKTS):
+            template.stamp(i * MSS, 1, 65535, ACK, payload)
+
+    return best_rate(run, PKTS, repeat)
+
+
+def bench_tcp_unpack(repeat: int) -> float:
+    """
+    Times TCPPacket.unpack, checksum verification included.
+
+    :param repeat: the number of runs
+    :return: the best rate
+    """
+
+    ip_pkt = IPPacket.unpack(build_pkt())
+    raw_tcp_pkt = ip_pkt.data
+
+    def run():
+        for _ in range(PKTS):
+            TCPPacket.unpack(ip_pkt, raw_tcp_pkt)
+
+    return best_rate(run, PKTS, repeat)
+
+
+def bench_checksum(repeat: int) -> float:
+    """
+    Times calculate_checksum over a full-sized pkt.
+
+    :param repeat: the number of runs
+    :return: the best rate
+    """
+
+    pkt = build_pkt()
+
+    def run():
+        for _ in range(PKTS):
+            calculate_checksum(pkt)
+
+    return best_rate(run, PKTS, repeat)
+
+
+def bench_reassembly(repeat: int) -> float:
+    """
+    Feeds a connection, established over a SimLink, with data segments straight from memory, some of them
+    reordered, and times TCPSocket.recv_chunks until all the bytes are delivered: parsing, reassembly and ACKs.
+
+    :param repeat: the number of runs
+    :return: the best rate
+    """
+
+    payload = os.urandom(MSS)
+    elapsed = float("inf")
+    for _ in range(repeat):
+        server = ScriptedServer({})
+        link = SimLink(server)
+        tcp_socket = TCPSocket(DST_HOST, link=link)
+        tcp_socket.connect()
+        link.up.loss = 1.0  # our ACKs go nowhere, the server has nothing to send anyway
+        connection = server.connections[tcp_socket.src_port]
+        segments = [
+            bytes(connection.template.stamp(
+                (connection.base + i * MSS) % SEQ_SPACE, connection.rcv_nxt, 65535, ACK, payload
+            )) + payload
+            for i in range(SEGMENTS)
+        ]
+        for i in range(0, SEGMENTS - 1, REORDER_EVERY):
+            segments[i], segments[i + 1] = segments[i + 1], segments[i]
+        tcp_socket.recv_ring.inbox.extend(segments)
+        remaining = SEGMENTS * MSS
+        start = perf_counter()
+        for chunk in tcp_socket.recv_chunks():
+            remaining -= len(chunk)
+            if not remaining:
+                break
+        elapsed = min(elapsed, perf_counter() - start)
+        tcp_socket.release()
+    return SEGMENTS / elapsed
+
+
+def response(chunked: bool) -> bytes:
+    """
+    Builds a multi-MB binary HTTP response.
+
+    :param chunked: whether the body has the chunked encoding instead of a Content-Length
+    :return: the response
+    """
+
+    block = os.urandom(CHUNK_SIZE)
+    if chunked:
+        framing = b"Transfer-Encoding: chunked"
+        body = (b"%x\r\n" % CHUNK_SIZE + block + b"\r\n") * (BODY_SIZE // CHUNK_SIZE) + b"0\r\n\r\n"
+    else:
+        framing = b"Content-Length: %d" % BODY_SIZE
+        body = block * (BODY_SIZE // CHUNK_SIZE)
+    return b"HTTP/1.1 200 OK\r\nContent-Type: text/x-log\r\n" + framing + b"\r\n\r\n" + body
+
+
+def bench_save_file(repeat: int, chunked: bool = False) -> float:
+    """
+    Times Data.save_file on a whole multi-MB response held in memory, as download() without streaming.
+
+    :param repeat: the number of runs
+    :param chunked: whether the body has the chunked encoding
+    :return: the best rate
+    """
+
+    message = response(chunked)
+    with tempfile.TemporaryDirectory() as directory:
+        file_name = os.path.join(directory, "body")
+
+        def run():
+            get_req = Data(DST_HOST, "/body", file_name)
+            get_req.get_content_type(message)
+            get_req.save_file()
+
+        return best_rate(run, BODY_SIZE / 2**20, repeat)
+
+
+def bench_chunked_decode(repeat: int) -> float:
+    """
+    Times the ChunkedDecoder on a multi-MB body fed in socket-sized pieces.
+
+    :param repeat: the number of runs
+    :return: the best rate
+    """
+
+    body = memoryview(response(True).partition(b"\r\n\r\n")[2])
+
+    def run():
+        decoder = ChunkedDecoder(len)
+        for offset in range(0, len(body), PIECE_SIZE):
+            decoder.feed(body[offset:offset + PIECE_SIZE])
+        assert decoder.done
+
+    return best_rate(run, BODY_SIZE / 2**20, repeat)
+
+
+def bench_goodput(repeat: int, **link_settings) -> float:
+    """
+    Times a whole download (handshake, request, streamed body, close) from a ScriptedServer over a SimLink, on a
+    SimClock. The run is deterministic, so it isn't repeated.
+
+    :param repeat: ignored
+    :param link_settings: the SimLink arguments
+    :return: the rate in simulated time
+    """
+
+    files = {"/body": os.urandom(DOWNLOAD_SIZE)}
+    clock = SimClock()
+    with temp_dir(), clock.installed():
+        start = clock.now
+        download(URL, link=SimLink(ScriptedServer(files), **link_settings))
+        return DOWNLOAD_SIZE / 2**20 / (clock.now - start)
+
+
+def bench_replay(repeat: int) -> float:
+    """
+    Captures a download over the lossy SimLink, then times its replay through the stack at full speed: the same
+    parsing, reassembly and HTTP work on the same pkts, without the network.
+
+    :param repeat: the number of runs
+    :return: the best rate
+    """
+
+    files = {"/body": os.urandom(DOWNLOAD_SIZE)}
+    with temp_dir():
+        with SimClock().installed():  # the same pkts on every machine
+            link = CaptureLink(SimLink(ScriptedServer(files), **LOSSY_LINK), "body.pcap")
+            download(URL, link=link)
+        link.writer.close()
+        links = [ReplayLink("body.pcap") for _ in range(repeat)]  # reading the capture isn't timed
+        replays = iter(links)
+
+        def run():
+            download(URL, link=next(replays))
+
+        return best_rate(run, len(links[0].recorded[0].pkts), repeat)
+
+
+def bench_send(repeat: int) -> float:
+    """
+    Times sending full-sized datagrams through a batch_io.Sender over UDP on the loopback interface, as the stack
+    sends its pkts.
+
+    :param repeat: the number of runs
+    :return: the best rate
+    """
+
+    datagram = [os.urandom(40), os.urandom(MSS)]  # header, payload
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as receiver, \
+            socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+        receiver.bind(("127.0.0.1", 0))  # never read, the kernel drops what doesn't fit
+        sender = Sender(sock, receiver.getsockname())
+
+        def run():
+            for _ in range(PKTS):
+                sender.send(datagram)
+
+        return best_rate(run, PKTS, repeat)
+
+
+@contextmanager
+def temp_dir():
+    """
+    Runs the enclosed code in a temporary directory, where downloads can write their files.
+    """
+
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as directory:
+        os.chdir(directory)
+        try:
+            yield
+        finally:
+            os.chdir(cwd)
+
+
+BENCHMARKS = {  # name -> (unit, function of the repeat count)
+    "ip_pack": ("pkts/s", bench_ip_pack),
+    "ip_unpack": ("pkts/s", bench_ip_unpack),
+    "tcp_pack": ("pkts/s", bench_tcp_pack),
+    "tcp_stamp": ("pkts/s", bench_tcp_stamp),
+    "tcp_unpack": ("pkts/s", bench_tcp_unpack),
+    "checksum": ("pkts/s", bench_checksum),
+    "reassembly": ("pkts/s", bench_reassembly),
+    "save_file": ("MB/s", bench_save_file),
+    "save_file_chunked": ("MB/s", lambda repeat: bench_save_file(repeat, chunked=True)),
+    "chunked_decode": ("MB/s", bench_chunked_decode),
+    "goodput_clean": ("MB/s", lambda repeat: bench_goodput(repeat, **CLEAN_LINK)),
+    "goodput_lossy": ("MB/s", lambda repeat: bench_goodput(repeat, **LOSSY_LINK)),
+    "replay": ("pkts/s", bench_replay),
+    "send": ("pkts/s", bench_send),
+}
+
+
+def compare(results: dict, baseline: dict, tolerance: float, out=sys.stdout) -> list:
+    """
+    Prints the results next to the baseline.
+
+    :param results: name -> {"value", "unit"}
+    :param baseline: name -> {"value", "unit"}, from an earlier run
+    :param tolerance: the fraction a rate may fall below the baseline
+    :param out: the file to print to
+    :return: the names of the regressed benchmarks
+    """
+
+    regressions = []
+    print("%18s %8s %14s %14s %9s" % ("benchmark", "unit", "baseline", "current", "change"), file=out)
+    for name, result in results.items():
+        if name not in baseline:
+            print("%18s %8s %14s %14.1f" % (name, result["unit"], "-", result["value"]), file=out)
+            continue
+        change = result["value"] / baseline[name]["value"] - 1
+        regressed = change < -tolerance
+        if regressed:
+            regressions.append(name)
+        print("%18s %8s %14.1f %14.1f %+8.1f%%%s" % (
+            name, result["unit"], baseline[name]["value"], result["value"], change * 100,
+            "  REGRESSION" if regressed else "",
+        ), file=out)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks the hot paths of the stack.")
+    parser.add_argument("names", nargs="*", metavar="name", help="benchmarks to run: " + ", ".join(BENCHMARKS))
+    parser.add_argument("--json", metavar="FILE", help="write the results as JSON to FILE, - for stdout")
+    parser.add_argument("--baseline", metavar="FILE", help="compare the results with an earlier --json run")
+    parser.add_argument("--tolerance", type=float, default=TOLERANCE, help="fraction a rate may fall below the "
+                                                                           "baseline (default %(default)s)")
+    parser.add_argument("--repeat", type=int, default=REPEAT, help="runs per benchmark (default %(default)s)")
+    args = parser.parse_args()
+    unknown = [name for name in args.names if name not in BENCHMARKS]
+    if unknown:
+        print("Unknown benchmark: " + ", ".join(unknown), file=sys.stderr)
+        sys.exit(1)
+    baseline = None
+    if args.baseline:
+        try:
+            with open(args.baseline) as fd:
+                baseline = json.load(fd)["results"]
+        except (OSError, ValueError, KeyError) as error:
+            print("Unreadable baseline: %s" % error, file=sys.stderr)
+            sys.exit(1)
+
+    out = sys.stderr if args.json == "-" else sys.stdout  # keep stdout for the JSON
+    results = {}
+    for name in args.names or BENCHMARKS:
+        unit, run = BENCHMARKS[name]
+        results[name] = {"value": round(run(args.repeat), 1), "unit": unit}
+        if baseline is None:
+            print("%18s %14.1f %s" % (name, results[name]["value"], unit), file=out)
+
+    if args.json:
+        report = {"python": platform.python_version(), "machine": platform.machine(), "results": results}
+        if args.json == "-":
+            json.dump(report, sys.stdout, indent=2)
+            print()
+        else:
+            with open(args.json, "w") as fd:
+                json.dump(report, fd, indent=2)
+                fd.write("\n")
+    if baseline is not None and compare(results, baseline, args.tolerance, out):
+        print("Regression beyond %.0f%% of the baseline" % (args.tolerance * 100), file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,228 @@
+from time import monotonic
+from tcp_pkt import SEQ_SPACE
+
+INITIAL_WINDOW = 4380  # bytes, RFC 3390 initial window is min(4 * MSS, max(2 * MSS, 4380))
+DUP_ACK_THRESHOLD = 3  # duplicate ACKs that trigger a fast retransmit
+CUBIC_C = 0.4  # CUBIC scaling constant
+CUBIC_BETA = 0.7  # CUBIC multiplicative decrease factor
+
+
+class Reno:
+    """
+    This class represents Reno congestion control (RFC 5681): slow start, congestion avoidance with byte counting
+    (RFC 3465), fast retransmit after 3 duplicate ACKs and fast recovery. It is also the interface every congestion
+    controller implements: the TCPSocket reports ACKs, duplicate ACKs and timeouts, and reads cwnd (in bytes).
+    """
+
+    def __init__(self, mss: int):
+        """
+        Instantiates this Reno object to the given maximum segment size.
+
+        :param mss: the maximum segment size in bytes
+        """
+
+        self.mss = mss
+        self.cwnd = min(4 * mss, max(2 * mss, INITIAL_WINDOW))  # congestion window in bytes
+        self.ssthresh = SEQ_SPACE  # slow start threshold in bytes, arbitrarily high at first
+        self.bytes_acked = 0  # bytes acknowledged since cwnd last grew in congestion avoidance
+        self.dup_acks = 0
+        self.in_recovery = False
+        self.recover = None  # next seq_num to send when fast recovery or the last timeout started
+        self.rtt = None  # smoothed RTT in seconds, kept up to date by the TCPSocket when it measures it
+
+    def on_ack(self, acked: int, ack_num: int, flight_size: int) -> bool:
+        """
+        Processes an ACK that acknowledges new data.
+
+        :param acked: the number of newly acknowledged bytes
+        :param ack_num: the acknowledgment number
+        :param flight_size: the bytes that were in flight before this ACK
+        :return: True if the first unacknowledged segment must be retransmitted (partial ACK), False otherwise
+        """
+
+        self.dup_acks = 0
+        if self.in_recovery:
+            return self.on_recovery_ack(acked, ack_num, flight_size)
+        if self.cwnd < self.ssthresh:  # slow start
+            self.cwnd += min(acked, self.mss)
+        else:
+            self.increase(acked)
+        return False
+
+    def on_recovery_ack(self, acked: int, ack_num: int, flight_size: int) -> bool:
+        """
+        Processes an ACK that acknowledges new data during fast recovery. Reno leaves fast recovery on the first one.
+
+        :param acked: the number of newly acknowledged bytes
+        :param ack_num: the acknowledgment number
+        :param flight_size: the bytes that were in flight before this ACK
+        :return: True if the first unacknowledged segment must be retransmitted, False otherwise
+        """
+
+        self.exit_recovery(flight_size - acked)
+        return False
+
+    def exit_recovery(self, flight_size: int):
+        """
+        Leaves fast recovery, deflating the window.
+
+        :param flight_size: the bytes still in flight
+        """
+
+        self.in_recovery = False
+        self.cwnd = min(self.ssthresh, max(flight_size, self.mss) + self.mss)  # RFC 6582, step 3
+        self.bytes_acked = 0
+
+    def increase(self, acked: int):
+        """
+        Grows the window in congestion avoidance: by one MSS per window of acknowledged bytes.
+
+        :param acked: the number of newly acknowledged bytes
+        """
+
+        self.bytes_acked += acked
+        if self.bytes_acked >= self.cwnd:
+            self.bytes_acked -= self.cwnd
+            self.cwnd += self.mss
+
+    def on_dup_ack(self, ack_num: int, snd_nxt: int, flight_size: int) -> bool:
+        """
+        Processes a duplicate ACK.
+
+        :param ack_num: the acknowledgment number
+        :param snd_nxt: the next seq_num to be sent
+        :param flight_size: the bytes in flight
+        :return: True if the first unacknowledged segment must be fast retransmitted, False otherwise
+        """
+
+        self.dup_acks += 1
+        if self.in_recovery:  # each duplicate ACK means a segment left the network
+            self.cwnd += self.mss
+            return False
+        if self.dup_acks != DUP_ACK_THRESHOLD:
+            return False
+        if self.recover is not None and (ack_num - self.recover) % SEQ_SPACE >= SEQ_SPACE // 2:
+            return False  # the ACK doesn't cover the last recovery point: losses already dealt with, RFC 6582 4.1
+        self.ssthresh = self.loss_ssthresh(flight_size)
+        self.cwnd = self.ssthresh + DUP_ACK_THRESHOLD * self.mss
+        self.in_recovery = True
+        self.recover = snd_nxt
+        return True
+
+    def on_timeout(self, snd_nxt: int, flight_size: int):
+        """
+        Processes a retransmission timeout: back to slow start with a one-segment window. The slow start threshold is
+        only lowered for a new loss: a timeout before the last recovery point is acknowledged is part of the loss
+        already dealt with (RFC 5681 section 3.1), and lowering it again would leave slow start after a few segments.
+
+        :param snd_nxt: the next seq_num to be sent
+        :param flight_size: the bytes in flight
+        """
+
+        snd_una = (snd_nxt - flight_size) % SEQ_SPACE
+        if self.recover is None or (snd_una - self.recover) % SEQ_SPACE < SEQ_SPACE // 2:
+            self.ssthresh = self.loss_ssthresh(flight_size)
+        self.cwnd = self.mss
+        self.bytes_acked = 0
+        self.dup_acks = 0
+        self.in_recovery = False
+        self.recover = snd_nxt
+
+    def loss_ssthresh(self, flight_size: int) -> int:
+        """
+        Returns the slow start threshold after a loss.
+
+        :param flight_size: the bytes in flight
+        :return: the slow start threshold in bytes
+        """
+
+        return max(flight_size // 2, 2 * self.mss)
+
+
+class NewReno(Reno):
+    """
+    This class represents NewReno congestion control (RFC 6582): Reno whose fast recovery lasts until everything
+    that was in flight when it started is acknowledged, retransmitting one segment per partial ACK.
+    """
+
+    def on_recovery_ack(self, acked: int, ack_num: int, flight_size: int) -> bool:
+        """
+        Processes an ACK that acknowledges new data during fast recovery.
+
+        :param acked: the number of newly acknowledged bytes
+        :param ack_num: the acknowledgment number
+        :param flight_size: the bytes that were in flight before this ACK
+        :return: True if the first unacknowledged segment must be retransmitted (partial ACK), False otherwise
+        """
+
+        if (ack_num - self.recover) % SEQ_SPACE < SEQ_SPACE // 2:  # full ACK
+            self.exit_recovery(flight_size - acked)
+            return False
+        self.cwnd = max(self.cwnd - acked, 0) + self.mss  # partial ACK: deflate by the acknowledged bytes
+        return True
+
+
+class Cubic(NewReno):
+    """
+    This class represents CUBIC congestion control (RFC 9438): NewReno loss recovery, but the window grows along a
+    cubic function of the time since the last loss and shrinks by a factor of 0.7 instead of 0.5.
+    """
+
+    def __init__(self, mss: int):
+        """
+        Instantiates this Cubic object to the given maximum segment size.
+
+        :param mss: the maximum segment size in bytes
+        """
+
+        super().__init__(mss)
+        self.w_max = 0.0  # window before the last reduction, in segments
+        self.k = 0.0  # seconds it takes to grow back to w_max
+        self.epoch_start = None  # start of the current congestion avoidance epoch
+        self.w_est = 0.0  # Reno-friendly window estimate, in segments
+
+    def increase(self, acked: int):
+        """
+        Grows the window in congestion avoidance towards the cubic function's value one RTT from now.
+
+        :param acked: the number of newly acknowledged bytes
+        """
+
+        now = monotonic()
+        cwnd = self.cwnd / self.mss
+        if self.epoch_start is None:
+            self.epoch_start = now
+            if cwnd < self.w_max:
+                self.k = ((self.w_max - cwnd) / CUBIC_C) ** (1 / 3)
+            else:  # no loss yet, or the window already grew back
+                self.k = 0.0
+                self.w_max = cwnd
+            self.w_est = cwnd
+        rtt = self.rtt or 0.0
+        t = now - self.epoch_start + rtt
+        target = CUBIC_C * (t - self.k) ** 3 + self.w_max
+        target = min(max(target, cwnd), 1.5 * cwnd)  # RFC 9438 section 4.2
+        segments_acked = acked / self.mss
+        self.w_est += 3 * (1 - CUBIC_BETA) / (1 + CUBIC_BETA) * segments_acked / cwnd
+        if self.w_est > target:  # Reno-friendly region
+            target = self.w_est
+        self.cwnd = max(self.cwnd, int((cwnd + (target - cwnd) / cwnd * segments_acked) * self.mss))
+
+    def loss_ssthresh(self, flight_size: int) -> int:
+        """
+        Returns the slow start threshold after a loss, remembering the window the loss happened at.
+
+        :param flight_size: the bytes in flight
+        :return: the slow start threshold in bytes
+        """
+
+        cwnd = self.cwnd / self.mss
+        if cwnd < self.w_max:  # fast convergence: release bandwidth to newer flows
+            self.w_max = cwnd * (1 + CUBIC_BETA) / 2
+        else:
+            self.w_max = cwnd
+        self.epoch_start = None
+        return max(int(self.cwnd * CUBIC_BETA), 2 * self.mss)
+
+
+CONTROLLERS = {"reno": Reno, "newreno": NewReno, "cubic": Cubic}
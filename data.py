@@ -1,22 +1,48 @@
+import os
+import re
 import sys
 
+WRITE_BUFFER_SIZE = 1 << 20  # bytes buffered before hitting the disk in streaming mode
+CHECKPOINT_INTERVAL = 1 << 22  # body bytes between two journal checkpoints in streaming mode
+MAX_LINE_SIZE = 8192  # longest chunk-size or trailer line accepted
+MAX_HEADER_SIZE = 1 << 16  # longest status line and headers accepted in streaming mode
+LINE_END = re.compile(b"\n")
+HEX_DIGITS = b"0123456789ABCDEFabcdef"  # all a chunk size may hold, int() would also take a sign, 0x or underscores
+CONTENT_RANGE = re.compile(r"bytes (\d+)-(\d+)/(\d+|\*)")
+CONTENT_LENGTH = re.compile(r"[0-9]+")  # int() would also take a sign, spaces or underscores
+# chunked decoder states
+CHUNK_SIZE = 0  # reading a chunk-size line
+CHUNK_DATA = 1  # reading chunk data
+CHUNK_DATA_END = 2  # reading the line break after chunk data
+TRAILER = 3  # reading trailer lines
+DONE = 4  # read the blank line ending the body
+
 
 class Data:
     """
     This class represents the data contained in a TCP pkt.
     """
 
-    def __init__(self, host: str, path: str):
+    def __init__(
+        self, host: str, path: str, file_name: str = None, byte_range: tuple = None, if_range: str = None, journal=None
+    ):
         """
         Instantiates this Data object to the given host and path.
 
         :param host: the URL host
         :param path: the URL path
+        :param file_name: the local file to save the response to, deduced from the path by default
+        :param byte_range: the (first, last) byte positions to request, last included and None for the end of the
+        file; None for the whole file
+        :param if_range: the validator the byte range is conditional on: if the file changed, the server sends all
+        of it instead
+        :param journal: the Journal to record the progress in, see checkpoint(); None to keep none
         """
 
+        self.file_name = file_name
         self.path = path
         self.host = host
-        self.http = "HTTP/1.0"
+        self.http = "HTTP/1.1"
         self.newline = '\r\n'
         self.request = ""
         self.message = None
@@ -25,18 +51,38 @@ class Data:
         self.status = 0
         self.content_type = ""
         self.chunked = False
+        self.headers = {}  # lower-cased header name -> value
+        self.head = bytearray()  # response bytes received before the end of the headers, in streaming mode
+        self.file = None  # the target file, once the headers are parsed in streaming mode
+        self.decoder = None  # decodes a chunked body in streaming mode
+        self.remaining = None  # body bytes still expected in streaming mode, if the response has a Content-Length
+        self.received = 0  # response bytes consumed in streaming mode
+        self.persistent = False  # the server keeps the connection open after the response
+        self.byte_range = byte_range
+        self.content_range = None  # (first, last, total length or None if unknown) of a partial (206) response
+        self.if_range = if_range
+        self.journal = journal
+        self.written = 0  # body bytes written in streaming mode
+        self.checkpointed = 0  # body bytes written at the last checkpoint
+        self.malformed = False  # the body broke its framing, in streaming mode: resuming would get the same bytes
 
-    def build_get_message(self) -> str:
+    def build_get_message(self, keep_alive: bool = False) -> str:
         """
         Returns an HTTP GET request.
 
+        :param keep_alive: whether to ask the server to keep the connection open for more requests
         :return: the HTTP GET request
         """
 
         self.request = "GET" + " " + self.path + " " + self.http + self.newline \
                        + "Host:" + " " + self.host + self.newline \
-                       + "Connection: Keep-Alive" + self.newline \
-                       + self.newline + self.newline
+                       + "Connection:" + " " + ("keep-alive" if keep_alive else "close") + self.newline
+        if self.byte_range is not None:
+            first, last = self.byte_range
+            self.request += "Range: bytes=" + str(first) + "-" + ("" if last is None else str(last)) + self.newline
+            if self.if_range is not None:
+                self.request += "If-Range:" + " " + self.if_range + self.newline
+        self.request += self.newline
         return self.request
 
     def get_html(self):
@@ -75,10 +121,15 @@ class Data:
 
     def check_status(self):
         """
-        Checks if the message's HTTP status code is 200 (OK) and terminates the program if it isn't.
+        Checks if the message's HTTP status code is 200 (OK), or 206 (Partial Content) when a byte range was
+        requested, and terminates the program if it isn't.
         """
 
-        if self.status != 200:
+        if self.byte_range is not None and self.status == 206:
+            return
+        if self.status != 200 or (self.byte_range is not None and self.byte_range[0] > 0 and self.if_range is None):
+            # a 200 answers a range request with the whole file, which only fits a range starting at 0, or a
+            # conditional one: the file changed and is downloaded again
             print("Invalid HTTP status code received: " + str(self.status), file=sys.stderr)
             sys.exit(1)
 
@@ -95,47 +146,432 @@ class Data:
             self.message = msg.decode()
             self.content_type = "text"
 
-            if b'Transfer-Encoding: chunked' in msg:
-                self.chunked = True
-
-    @staticmethod
-    def decode_chunked_encoding(filename):
-        with open(filename, "r") as fd:
-            contents = fd.read()
-
-        output = ""
-        start = 0
-        while True:
-            new_line_loc = contents.index("\n", start)
-            chunk_size = int(contents[start:new_line_loc], base=16)
-            start = new_line_loc + 1  # +1 for new line
-            output += contents[start:start + chunk_size]
-            start = start + chunk_size + 1 # +1 for the new line
-            
-            if start == len(contents) - 1:
-                break
-
-        with open(filename, "w") as fd:
-            fd.write(output)
+        if b'Transfer-Encoding: chunked' in msg:
+            self.chunked = True
 
-    def save_file(self):
+    def get_file_name(self) -> str:
         """
-        Saves the HTTP message in a file located in the local directory.
+        Returns the name of the local file the response is saved to, deduced from the URL path.
+
+        :return: the file name
         """
 
+        if self.file_name is not None:
+            return self.file_name
         file_name = self.path.split("/")[-1]
         if file_name in ("/", ""):  # if there's no path
             file_name = "index.html"  # call the file with a default name
+        return file_name
+
+    def parse_headers(self, head: bytes):
+        """
+        Parses the status line and headers of an HTTP response and terminates the program if the status isn't 200,
+        or the Content-Length or Content-Range is invalid.
+
+        :param head: the response up to, but excluding, the blank line ending the headers
+        """
+
+        self.message = head
+        self.get_binary_status()
+        self.check_status()
+        for line in head.split(b"\r\n")[1:]:
+            name, _, value = line.partition(b":")
+            # header fields are ISO-8859-1 at most (RFC 9110 section 5.5), which can't fail to decode
+            self.headers[name.strip().lower().decode("latin-1")] = value.strip().decode("latin-1")
+        # the codings are listed in the order they were applied, chunked can only be the last (RFC 9112 section 6.1)
+        codings = self.headers.get("transfer-encoding", "").lower().split(",")
+        self.chunked = codings[-1].strip() == "chunked"
+        self.content_length = self.headers.get("content-length", self.content_length)
+        if not self.chunked and CONTENT_LENGTH.fullmatch(self.content_length) is None:  # chunked overrides it
+            print("Invalid Content-Length received: " + self.content_length, file=sys.stderr)
+            sys.exit(1)
+        connection = self.headers.get("connection", "").lower()
+        if head.startswith(b"HTTP/1.0"):  # HTTP/1.0 connections close unless the server says otherwise
+            self.persistent = connection == "keep-alive"
+        else:
+            self.persistent = connection != "close"
+        if self.status == 206:
+            match = CONTENT_RANGE.fullmatch(self.headers.get("content-range", ""))
+            if match is not None:
+                content_range = (int(match[1]), int(match[2]), None if match[3] == "*" else int(match[3]))
+            if match is None or not self.covers(*content_range):
+                print("Invalid Content-Range received: " + self.headers.get("content-range", ""), file=sys.stderr)
+                sys.exit(1)
+            self.content_range = content_range
+
+    def covers(self, first: int, last: int, total: int or None) -> bool:
+        """
+        Checks if the Content-Range of a partial response matches the requested byte range: same first byte, and
+        the requested last one, or the last byte of the file if the range reaches past it. A shorter range would
+        leave a hole in the file.
+
+        :param first: the first byte position of the response
+        :param last: the last byte position of the response
+        :param total: the file size, None if unknown
+        :return: True if the response covers the range, False otherwise
+        """
+
+        wanted = self.byte_range[1]
+        if total is not None and (wanted is None or wanted >= total):
+            wanted = total - 1
+        return first == self.byte_range[0] and last >= first and (wanted is None or last == wanted)
+
+    @property
+    def validator(self) -> str or None:
+        etag = self.headers.get("etag")
+        if etag and not etag.startswith("W/"):  # If-Range needs a strong validator
+            return etag
+        return self.headers.get("last-modified")
+
+    @property
+    def offset(self) -> int:
+        return (self.content_range[0] if self.content_range else 0) + self.written
+
+    @property
+    def framed(self) -> bool:
+        return self.decoder is not None or self.remaining is not None
+
+    @property
+    def complete(self) -> bool:
+        return self.decoder.done if self.decoder else self.remaining == 0
+
+    def open_file(self):
+        """
+        Opens the target file in streaming mode: truncated for a whole file, or written in place from the first byte
+        of a partial (206) response, leaving the rest of the file alone.
+
+        :return: the file object
+        """
+
+        if self.content_range is not None:
+            return PositionalWriter(self.get_file_name(), self.content_range[0])
+        return open(self.get_file_name(), "wb", buffering=WRITE_BUFFER_SIZE)
+
+    def feed(self, chunk: bytes) -> bytes:
+        """
+        Consumes the next chunk of the HTTP response in streaming mode: headers are buffered until complete, then the
+        body is written to the target file as it arrives. A body framed by a Content-Length or the chunked encoding
+        ends on its own (see complete) and whatever follows it belongs to the next response on the connection;
+        otherwise the body ends when the server closes the connection. A malformed chunked body terminates the program.
+
+        :param chunk: the next bytes of the response
+        :return: the bytes past the end of the response, empty if there are none
+        """
+
+        size = len(chunk)
+        if self.file is None:  # still reading the headers
+            self.head += chunk
+            end = self.head.find(b"\r\n\r\n")
+            if end == -1:
+                if len(self.head) > MAX_HEADER_SIZE:  # a peer that never ends the headers can't fill the memory
+                    print("HTTP response headers too long", file=sys.stderr)
+                    sys.exit(1)
+                self.received += size
+                return b""
+            self.parse_headers(bytes(self.head[:end]))
+            chunk = self.head[end + 4:]
+            self.head = bytearray()
+            self.file = self.open_file()
+            if self.chunked:
+                self.decoder = ChunkedDecoder(self.write_body)
+            elif "content-length" in self.headers:
+                self.remaining = int(self.content_length)
+        if self.decoder:
+            try:
+                rest = chunk[self.decoder.feed(chunk):]
+            except ValueError as e:
+                self.malformed = True
+                print("Invalid chunked body received: " + str(e), file=sys.stderr)
+                sys.exit(1)
+        elif self.remaining is not None:
+            body = chunk[:self.remaining]
+            self.write_body(body)
+            self.remaining -= len(body)
+            rest = chunk[len(body):]
+        else:
+            self.write_body(chunk)
+            rest = b""
+        self.received += size - len(rest)
+        if self.journal is not None and self.written - self.checkpointed >= CHECKPOINT_INTERVAL:
+            self.checkpoint()
+        return bytes(rest)  # the chunk may be a view of a receive buffer
+
+    def write_body(self, data: bytes):
+        """
+        Writes the next bytes of the body to the target file in streaming mode.
+
+        :param data: the body bytes
+        """
+
+        self.file.write(data)
+        self.written += len(data)
+
+    def checkpoint(self):
+        """
+        Makes the body written so far durable (flushed and fsynced) and records its length in the journal, so an
+        interrupted download can resume from there.
+        """
+
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.journal.save(self.validator, self.offset)
+        self.checkpointed = self.written
+
+    def finish(self):
+        """
+        Ends streaming mode: flushes and closes the target file.
+        """
+
+        if self.file is None:  # the headers never completed
+            print("Incomplete HTTP response received", file=sys.stderr)
+            sys.exit(1)
+        self.file.close()
+        if self.decoder and not self.decoder.done:
+            print("Incomplete chunked body received", file=sys.stderr)
+        elif self.remaining:
+            print("Incomplete HTTP response body received", file=sys.stderr)
+
+    def save_file(self):
+        """
+        Saves the HTTP message in a file located in the local directory.
+        """
+
+        file_name = self.get_file_name()
         if self.content_type == "binary":
             self.get_binary_status()
             self.check_status()
             self.get_binary()
-            open(file_name, "wb").write(self.content)
+            if self.chunked:
+                with open(file_name, "wb") as fd:
+                    ChunkedDecoder(fd.write).feed(self.content)
+            else:
+                open(file_name, "wb").write(self.content)
         else:
             self.get_text_status()
             self.check_status()
             self.get_html()
-            open(file_name, "w").write(self.content)
-
             if self.chunked:
-                self.decode_chunked_encoding(file_name)
+                with open(file_name, "wb") as fd:
+                    ChunkedDecoder(fd.write).feed(self.content.encode())
+            else:
+                open(file_name, "w").write(self.content)
+
+
+class PositionalWriter:
+    """
+    This class represents a byte range of a file written in place with positional writes (os.pwrite), so several
+    connections can each fill their own range of the same file without sharing a file offset. Writes are buffered
+    like the streaming mode's regular files.
+    """
+
+    def __init__(self, file_name: str, offset: int):
+        """
+        Instantiates this PositionalWriter object to the given file, creating it if needed but never truncating it.
+
+        :param file_name: the file name
+        :param offset: where the range starts in the file
+        """
+
+        self.fd = os.open(file_name, os.O_WRONLY | os.O_CREAT, 0o644)
+        self.offset = offset  # where the buffered bytes go
+        self.buffer = bytearray()
+
+    def write(self, data: bytes):
+        """
+        Appends data to the range.
+
+        :param data: the data
+        """
+
+        self.buffer += data
+        if len(self.buffer) >= WRITE_BUFFER_SIZE:
+            self.flush()
+
+    def flush(self):
+        """
+        Writes the buffered bytes to the file.
+        """
+
+        written = 0
+        while written < len(self.buffer):
+            written += os.pwrite(self.fd, memoryview(self.buffer)[written:], self.offset + written)
+        self.offset += written
+        self.buffer = bytearray()  # rather than clear(), as the views may not be released yet
+
+    def fileno(self) -> int:
+        """
+        Returns the file descriptor of the file.
+
+        :return: the file descriptor
+        """
+
+        return self.fd
+
+    def close(self):
+        """
+        Flushes the buffered bytes and closes the file.
+        """
+
+        self.flush()
+        os.close(self.fd)
+
+
+class ResponseStream:
+    """
+    This class represents the responses coming back on a persistent HTTP/1.1 connection: it splits the byte stream
+    into consecutive responses, in the order the requests were sent, each one saved by its Data object. With
+    pipelining, several requests are outstanding and their responses arrive back to back, possibly in the same chunk.
+    """
+
+    def __init__(self, requests: list, on_response=None):
+        """
+        Instantiates this ResponseStream object to the given requests.
+
+        :param requests: the Data objects of the requests, in the order they are sent
+        :param on_response: called with the Data object of every complete response
+        """
+
+        self.requests = requests
+        self.on_response = on_response
+        self.index = 0  # the response being received, i.e. the number of complete ones
+        self.closing = False  # the server closes the connection after the last complete response
+
+    @property
+    def done(self) -> bool:
+        return self.index == len(self.requests) or self.closing
+
+    def request(self, index: int) -> str:
+        """
+        Returns the HTTP GET request of requests[index]; the last one lets the server close the connection.
+
+        :param index: the request index
+        :return: the HTTP GET request
+        """
+
+        return self.requests[index].build_get_message(keep_alive=index < len(self.requests) - 1)
+
+    def feed(self, chunk: bytes):
+        """
+        Consumes the next chunk received on the connection.
+
+        :param chunk: the next bytes of the stream
+        """
+
+        while not self.done:
+            get_req = self.requests[self.index]
+            chunk = get_req.feed(chunk)
+            if not get_req.complete:
+                return
+            self.next_response()
+            self.closing = not get_req.persistent
+            if not chunk:
+                return
+
+    def next_response(self):
+        """
+        Finishes the current response and moves on to the next one.
+        """
+
+        get_req = self.requests[self.index]
+        get_req.finish()
+        self.index += 1
+        if self.on_response is not None:
+            self.on_response(get_req)
+
+    def close(self):
+        """
+        Ends the stream once the connection is closed: a response without framing is complete then, while an
+        incomplete framed one is dropped, to be requested again on a new connection.
+        """
+
+        if self.index == len(self.requests) or self.requests[self.index].file is None:
+            return
+        get_req = self.requests[self.index]
+        if get_req.framed:
+            get_req.file.close()
+        else:
+            self.next_response()
+
+
+class ChunkedDecoder:
+    """
+    This class represents an incremental decoder for the chunked transfer-encoding (RFC 9112, section 7.1). It is a
+    state machine that consumes the body in arbitrary pieces, so a chunk-size line or CRLF may be split across two
+    calls. Chunk data is passed to the sink as views of the input, without copying. Chunk extensions and trailers are
+    skipped, and bare LF line endings are accepted.
+    """
+
+    def __init__(self, on_data):
+        """
+        Instantiates this ChunkedDecoder object to the given sink.
+
+        :param on_data: called with every run of decoded body bytes
+        """
+
+        self.on_data = on_data
+        self.state = CHUNK_SIZE
+        self.remaining = 0  # bytes left in the current chunk
+        self.line = bytearray()  # partial line carried over from the previous piece
+
+    @property
+    def done(self) -> bool:
+        return self.state == DONE
+
+    def feed(self, data: bytes) -> int:
+        """
+        Decodes the next piece of the chunked body.
+
+        :param data: the next bytes of the body
+        :return: the number of bytes consumed, less than len(data) only if the body ended within the piece
+        """
+
+        data = memoryview(data)
+        pos = 0
+        while pos < len(data) and self.state != DONE:
+            if self.state == CHUNK_DATA:
+                end = min(pos + self.remaining, len(data))
+                self.on_data(data[pos:end])
+                self.remaining -= end - pos
+                pos = end
+                if self.remaining == 0:
+                    self.state = CHUNK_DATA_END
+                continue
+
+            line, pos = self.read_line(data, pos)
+            if line is None:  # the line continues in the next piece
+                break
+            if self.state == CHUNK_SIZE:
+                size = line.split(b";", 1)[0].strip()  # drop chunk extensions
+                if not size or size.translate(None, HEX_DIGITS):  # deletes the digits, leaving anything else
+                    raise ValueError("Invalid chunk size line: %r" % line)
+                self.remaining = int(size, 16)
+                self.state = CHUNK_DATA if self.remaining else TRAILER
+            elif self.state == CHUNK_DATA_END:
+                if line:
+                    raise ValueError("Chunk data is longer than its size")
+                self.state = CHUNK_SIZE
+            elif not line:  # the blank line after the last chunk or trailer
+                self.state = DONE
+        return pos
+
+    def read_line(self, data: memoryview, pos: int) -> tuple:
+        """
+        Reads a line, joining it with what was left over from the previous piece.
+
+        :param data: the current piece
+        :param pos: where the line starts
+        :return: the line without its line break (None if incomplete) and the position after it
+        """
+
+        match = LINE_END.search(data, pos)  # re searches any buffer, views included, without copying
+        if match is None:
+            self.line += data[pos:]
+            if len(self.line) > MAX_LINE_SIZE:
+                raise ValueError("Chunk line too long")
+            return None, len(data)
+        end = match.start()
+        if len(self.line) + end - pos > MAX_LINE_SIZE:
+            raise ValueError("Chunk line too long")
+        line = bytes(self.line) + bytes(data[pos:end]) if self.line else bytes(data[pos:end])
+        self.line = bytearray()
+        return line.rstrip(b"\r"), end + 1
@@ -1,8 +1,17 @@
+import asyncio
+import os
 import sys
+from time import monotonic
 from typing import Tuple
 from urllib.parse import urlparse
 from tcp_sock import TCPSocket
-from data import Data
+from async_sock import AsyncTCPSocket, READ_SIZE
+from packet_engine import PacketEngine
+from data import Data, ResponseStream
+from journal import Journal, PARTIAL_SUFFIX
+
+FIRST_SEGMENT_SIZE = 1 << 20  # bytes asked for by the first request of a segmented download
+MIN_SEGMENT_SIZE = 1 << 20  # smallest range worth another connection
 
 
 def get_url_components(url: str) -> Tuple[str, str]:
@@ -17,23 +26,431 @@ def get_url_components(url: str) -> Tuple[str, str]:
     return url.netloc, url.path
 
 
-def download(url: str):
+def download(url: str, stream: bool = True, resume: bool = False, link=None, stats_file: str = None):
     """
     Downloads the HTTP message.
 
+    In streaming mode, the body goes to a partial file next to the target, along with a Journal of the progress,
+    and the partial file is renamed once the response is complete. If the connection fails, the body received so far
+    stays on disk, and a later call with resume picks up where it stopped with a Range request, as long as the
+    server's validator (ETag or Last-Modified) shows the file didn't change.
+
+    :param url: the full URL
+    :param stream: whether to write the body to disk as it arrives instead of buffering the whole response in memory
+    :param resume: whether to resume an interrupted download of the URL in streaming mode
+    :param link: the link to reach the server through (see link.py), None for raw sockets
+    :param stats_file: the file to write the connection's counters to as JSON (see stats.py) once the download
+    ends, successful or not; - for stdout, None to keep no counters
+    """
+
+    dst_host, path = get_url_components(url)
+    tcp_socket = TCPSocket(dst_host=dst_host, link=link, stats=stats_file is not None)
+    try:
+        if not tcp_socket.connect():  # connection failed
+            print("Handshake failed", file=sys.stderr)
+            sys.exit(1)
+        if path == "":  # if there's no path
+            path = "/"  # add a trailing forward slash
+        if not stream:
+            get_req = Data(dst_host, path)
+            tcp_socket.send(get_req.build_get_message())
+            data = tcp_socket.recv()
+            get_req.get_content_type(data)
+            get_req.save_file()
+            return
+        file_name = Data(dst_host, path).get_file_name()
+        partial_file_name = file_name + PARTIAL_SUFFIX
+        journal = Journal(url, partial_file_name)
+        progress = journal.load() if resume else None
+        if (
+            progress is not None
+            and os.path.exists(partial_file_name)
+            and progress[1] <= os.path.getsize(partial_file_name)
+        ):
+            validator, offset = progress
+            os.truncate(partial_file_name, offset)  # drop what was written after the last checkpoint
+            get_req = Data(dst_host, path, partial_file_name, (offset, None), validator, journal)
+        else:
+            journal.remove()  # a stale journal doesn't describe the new partial file
+            get_req = Data(dst_host, path, partial_file_name, journal=journal)
+        tcp_socket.send(get_req.build_get_message())
+        try:
+            for chunk in tcp_socket.recv_chunks():
+                get_req.feed(chunk)
+                if get_req.complete:  # no need to wait for the server to close
+                    break
+        except BaseException:  # e.g. the server stopped responding, keep what was received
+            if get_req.file is not None and not get_req.malformed:
+                get_req.checkpoint()
+                print("Partial download kept, resume with -c", file=sys.stderr)
+            raise
+        if get_req.framed and not get_req.complete:
+            get_req.checkpoint()
+            print("Connection closed before the end of the response, resume with -c", file=sys.stderr)
+            sys.exit(1)
+        get_req.finish()
+        os.replace(partial_file_name, file_name)
+        journal.remove()
+        if not tcp_socket.closed:
+            tcp_socket.close()
+    finally:
+        if stats_file is not None:
+            tcp_socket.stats.dump(stats_file, url=url)
+
+
+async def download_async(
+    url: str,
+    engine: PacketEngine = None,
+    file_name: str = None,
+    byte_range: tuple = None,
+    on_headers=None,
+    link=None,
+) -> int:
+    """
+    Downloads the HTTP message over an AsyncTCPSocket, writing the body to disk as it arrives.
+
     :param url: the full URL
+    :param engine: the PacketEngine to share with other downloads, None for a connection of its own
+    :param file_name: the local file to save the response to, deduced from the URL path by default
+    :param byte_range: the (first, last) byte positions to request, see Data; None for the whole file
+    :param on_headers: called with the Data object once the response headers are parsed
+    :param link: the link to reach the server through without an engine (see link.py), None for raw sockets
+    :return: the number of bytes received
+    :raise ConnectionError: if the connection can't be established, the server stops responding or closes the
+    connection before the end of the response
     """
 
     dst_host, path = get_url_components(url)
-    tcp_socket = TCPSocket(dst_host=dst_host)
-    if not tcp_socket.connect():  # connection failed
-        print("Handshake failed", file=sys.stderr)
-        sys.exit(1)
+    tcp_socket = AsyncTCPSocket(dst_host=dst_host, engine=engine, link=link)
+    if not await tcp_socket.connect():  # connection failed
+        raise ConnectionError("Handshake failed")
     if path == "":  # if there's no path
         path = "/"  # add a trailing forward slash
-    get_req = Data(dst_host, path)
-    http_req = get_req.build_get_message()
-    tcp_socket.send(http_req)
-    data = tcp_socket.recv()
-    get_req.get_content_type(data)
-    get_req.save_file()
+    get_req = Data(dst_host, path, file_name, byte_range)
+    try:
+        await tcp_socket.send(get_req.build_get_message())
+        received = 0
+        async for chunk in tcp_socket.recv_chunks():
+            received += len(chunk)
+            parsed = get_req.file is not None
+            get_req.feed(chunk)
+            if on_headers is not None and not parsed and get_req.file is not None:
+                on_headers(get_req)
+            if get_req.complete:  # no need to wait for the server to close
+                break
+        get_req.finish()
+        if get_req.framed and not get_req.complete:
+            raise ConnectionError("Connection closed before the end of the response")
+        await tcp_socket.close()
+    finally:
+        if not tcp_socket.closed:  # stop its timers and free its port, other downloads go on
+            tcp_socket.release()
+    return received
+
+
+async def invalid_as_error(download_coro, message: str):
+    """
+    Awaits a download, turning the program exit Data makes on an invalid response, once it reported it, into a
+    ConnectionError: only that download fails, the event loop and the other downloads go on.
+
+    :param download_coro: the download coroutine
+    :param message: the error message
+    :return: what the download returns
+    :raise ConnectionError: if the response is invalid
+    """
+
+    try:
+        return await download_coro
+    except SystemExit:
+        raise ConnectionError(message) from None
+
+
+async def download_segmented(url: str, connections: int, engine: PacketEngine = None) -> int:
+    """
+    Downloads a file over several connections at once. The first request asks for the first FIRST_SEGMENT_SIZE
+    bytes: if the server answers with a partial response, its Content-Range gives the file size, and the rest of the
+    file is split into byte ranges fetched concurrently, each one written in place into the target file while the
+    first response is still arriving. A server that ignores ranges sends the whole file in answer to the first
+    request instead. Every range must come back whole (see Data.covers()) and with the first response's file size,
+    else the download fails.
+
+    :param url: the full URL
+    :param connections: the maximum number of connections open at once
+    :param engine: the PacketEngine to share, None to create one for this download
+    :return: the number of bytes received
+    :raise ConnectionError: if a connection fails (see download_async()), or a server answers a range with the
+    whole file or another file size
+    """
+
+    dst_host, path = get_url_components(url)
+    file_name = Data(dst_host, path or "/").get_file_name()
+    own_engine = engine is None
+    if own_engine:
+        engine = PacketEngine()
+    segments = []  # the tasks fetching the other ranges
+
+    async def fetch_segment(byte_range: tuple, on_segment_headers=None) -> int:
+        return await invalid_as_error(
+            download_async(url, engine, file_name, byte_range, on_segment_headers),
+            "Invalid response to the request for bytes %d-" % byte_range[0],
+        )
+
+    def on_last(get_req: Data):
+        if get_req.content_range is None:  # a 200: the server ignored the range, the file isn't the first response's
+            raise ConnectionError("The server ignored the request for the rest of the file")
+        os.truncate(file_name, get_req.content_range[1] + 1)
+
+    def on_headers(get_req: Data):
+        if get_req.content_range is None:  # the whole file is coming
+            return
+        start = get_req.content_range[1] + 1
+        total = get_req.content_range[2]
+        if total is None:  # unknown size, fetch the rest in one go, whose own Content-Range tells where the file ends
+            segments.append(asyncio.ensure_future(fetch_segment((start, None), on_last)))
+            return
+        os.truncate(file_name, total)  # drop whatever an older file had past the end
+
+        def on_segment_headers(segment_req: Data):
+            if segment_req.content_range[2] != total:  # another file now, the segments wouldn't fit together
+                raise ConnectionError("The file size changed from %d to %s" % (total, segment_req.content_range[2]))
+        count = min(max(connections - 1, 1), -(-(total - start) // MIN_SEGMENT_SIZE))
+        if count <= 0:
+            return
+        size = -(-(total - start) // count)
+        for first in range(start, total, size):
+            byte_range = (first, min(first + size, total) - 1)
+            segments.append(asyncio.ensure_future(fetch_segment(byte_range, on_segment_headers)))
+
+    try:
+        received = await download_async(url, engine, file_name, (0, FIRST_SEGMENT_SIZE - 1), on_headers)
+        received += sum(await asyncio.gather(*segments))
+    except BaseException:
+        for segment in segments:
+            segment.cancel()
+        await asyncio.gather(*segments, return_exceptions=True)  # let them release their connections
+        raise
+    finally:
+        if own_engine:
+            engine.close()
+    return received
+
+
+def group_by_host(urls: list, file_names: list) -> dict:
+    """
+    Groups URLs by host, to be downloaded over persistent connections.
+
+    :param urls: the full URLs
+    :param file_names: the local file of every URL
+    :return: a dict of host -> list of (path, file name) tuples, in the original order
+    """
+
+    hosts = {}
+    for url, file_name in zip(urls, file_names):
+        dst_host, path = get_url_components(url)
+        hosts.setdefault(dst_host, []).append((path or "/", file_name))
+    return hosts
+
+
+def fetch_persistent(tcp_socket: TCPSocket, stream: ResponseStream, pipeline: bool):
+    """
+    Sends the requests of a ResponseStream over an established connection and feeds it the responses, until they
+    are all complete or the server closes the connection. Without pipelining, a request is only sent once the
+    previous response is complete; with pipelining, all of them are sent at once.
+
+    :param tcp_socket: the connection
+    :param stream: the requests and their responses
+    :param pipeline: whether to pipeline the requests
+    """
+
+    window = len(stream.requests) if pipeline else 1  # requests outstanding at once
+    sent = 0
+    chunks = tcp_socket.recv_chunks()
+    while not stream.done:
+        end = min(stream.index + window, len(stream.requests))
+        if sent < end:
+            tcp_socket.send("".join(stream.request(index) for index in range(sent, end)))
+            sent = end
+        chunk = next(chunks, None)
+        if chunk is None:  # the server closed the connection
+            break
+        stream.feed(chunk)
+
+
+def download_persistent(urls: list, pipeline: bool = False, link=None):
+    """
+    Downloads URLs over persistent HTTP/1.1 connections, one host after the other: the requests to a host share one
+    TCPSocket, and a new one is only opened if the server closes it before answering them all.
+
+    :param urls: the full URLs
+    :param pipeline: whether to pipeline the requests, instead of waiting for each response before the next request
+    :param link: the link to reach the servers through (see link.py), None for raw sockets
+    """
+
+    for dst_host, paths in group_by_host(urls, unique_file_names(urls)).items():
+        while paths:
+            tcp_socket = TCPSocket(dst_host=dst_host, link=link)
+            if not tcp_socket.connect():  # connection failed
+                print("Handshake failed", file=sys.stderr)
+                sys.exit(1)
+            stream = ResponseStream([Data(dst_host, path, file_name) for path, file_name in paths])
+            fetch_persistent(tcp_socket, stream, pipeline)
+            if not tcp_socket.closed:
+                tcp_socket.close()
+            stream.close()
+            if stream.index == 0:  # the server closes without answering, retrying won't help
+                print("Incomplete HTTP response received", file=sys.stderr)
+                sys.exit(1)
+            paths = paths[stream.index:]
+
+
+async def download_persistent_async(
+    dst_host: str, paths: list, engine: PacketEngine = None, pipeline: bool = False, on_response=None
+):
+    """
+    Downloads files from a host over persistent HTTP/1.1 AsyncTCPSockets, see download_persistent().
+
+    :param dst_host: the URL host
+    :param paths: the (path, file name) tuples to download
+    :param engine: the PacketEngine to share with other downloads, None for connections of their own
+    :param pipeline: whether to pipeline the requests
+    :param on_response: called with the Data object of every complete response
+    :raise ConnectionError: if a connection can't be established, the server stops responding or closes every
+    connection without answering
+    """
+
+    while paths:
+        tcp_socket = AsyncTCPSocket(dst_host=dst_host, engine=engine)
+        if not await tcp_socket.connect():  # connection failed
+            raise ConnectionError("Handshake failed")
+        stream = ResponseStream([Data(dst_host, path, file_name) for path, file_name in paths], on_response)
+        try:
+            window = len(paths) if pipeline else 1
+            sent = 0
+            while not stream.done:
+                end = min(stream.index + window, len(paths))
+                if sent < end:
+                    await tcp_socket.send("".join(stream.request(index) for index in range(sent, end)))
+                    sent = end
+                chunk = await tcp_socket.reader.read(READ_SIZE)
+                if not chunk:  # the server closed the connection
+                    break
+                stream.feed(chunk)
+            await tcp_socket.close()
+        finally:
+            if not tcp_socket.closed:
+                tcp_socket.release()
+        stream.close()
+        if stream.index == 0:
+            raise ConnectionError("Connection closed without a response")
+        paths = paths[stream.index:]
+
+
+def unique_file_names(urls: list) -> list:
+    """
+    Returns the local file name of every URL, numbering repeated names like wget does (index.html, index.html.1...).
+
+    :param urls: the full URLs
+    :return: the file names, in the same order
+    """
+
+    seen = {}
+    file_names = []
+    for url in urls:
+        dst_host, path = get_url_components(url)
+        file_name = Data(dst_host, path).get_file_name()
+        count = seen.get(file_name, 0)
+        seen[file_name] = count + 1
+        file_names.append(file_name + ".%d" % count if count else file_name)
+    return file_names
+
+
+async def download_batch(
+    urls: list, jobs: int, per_host: int, keep_alive: bool = False, pipeline: bool = False, link=None
+) -> int:
+    """
+    Downloads many URLs concurrently over a shared PacketEngine, printing a line per finished download and a summary.
+    With keep_alive, the URLs of a host are split among up to per_host persistent connections instead of opening a
+    connection per URL.
+
+    :param urls: the full URLs
+    :param jobs: the maximum number of connections open at once
+    :param per_host: the maximum number of connections open at once to the same host
+    :param keep_alive: whether to reuse connections for several requests
+    :param pipeline: whether to pipeline the requests on persistent connections
+    :param link: the link to reach the servers through (see link.py), None for raw sockets
+    :return: the number of failed downloads
+    """
+
+    engine = PacketEngine(link)
+    slots = asyncio.Semaphore(jobs)
+    host_slots = {}  # host -> asyncio.Semaphore
+    start = monotonic()
+    done = failed = total = 0
+    file_names = unique_file_names(urls)
+    file_urls = dict(zip(file_names, urls))
+
+    def report(url: str, file_name: str, received: int, started: float, error=None):
+        nonlocal done, failed, total
+        done += 1
+        if error is not None:
+            failed += 1
+            print("[%d/%d] %s failed: %s" % (done, len(urls), url, error), file=sys.stderr)
+            return
+        total += received
+        print(
+            "[%d/%d] %s -> %s, %d bytes in %.2f s" % (done, len(urls), url, file_name, received, monotonic() - started),
+            file=sys.stderr,
+        )
+
+    async def fetch(url: str, file_name: str):
+        host = get_url_components(url)[0]
+        host_slot = host_slots.setdefault(host, asyncio.Semaphore(per_host))
+        async with host_slot, slots:  # a host's queued URLs don't hold global slots other hosts could use
+            started = monotonic()
+            try:
+                received = await invalid_as_error(download_async(url, engine, file_name), "invalid response")
+                error = None
+            except (ConnectionError, OSError, ValueError) as e:
+                received, error = 0, e
+        report(url, file_name, received, started, error)
+
+    async def fetch_host(host: str, paths: list):
+        async with host_slots.setdefault(host, asyncio.Semaphore(per_host)), slots:
+            started = monotonic()
+            finished = set()
+
+            def on_response(get_req: Data):
+                nonlocal started
+                finished.add(get_req.file_name)
+                report(file_urls[get_req.file_name], get_req.file_name, get_req.received, started)
+                started = monotonic()
+
+            try:
+                await invalid_as_error(
+                    download_persistent_async(host, paths, engine, pipeline, on_response), "invalid response"
+                )
+                return
+            except (ConnectionError, OSError, ValueError) as e:
+                error = e
+        for _, file_name in paths:
+            if file_name not in finished:
+                report(file_urls[file_name], file_name, 0, started, error)
+
+    if keep_alive:
+        tasks = []
+        for host, paths in group_by_host(urls, file_names).items():
+            connections = min(per_host, len(paths))
+            tasks += [fetch_host(host, paths[i::connections]) for i in range(connections)]
+    else:
+        tasks = [fetch(url, file_name) for url, file_name in zip(urls, file_names)]
+    try:
+        await asyncio.gather(*tasks)
+    finally:
+        engine.close()
+    elapsed = monotonic() - start
+    print(
+        "%d downloaded, %d failed, %d bytes in %.2f s (%.2f MB/s)"
+        % (len(urls) - failed, failed, total, elapsed, total / elapsed / 1e6 if elapsed else 0.0),
+        file=sys.stderr,
+    )
+    return failed
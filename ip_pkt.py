@@ -1,11 +1,12 @@
 import socket
 import struct
 from random import randint
-from utils import calculate_checksum
+from utils import calculate_checksum, resolve_host
 
 
 HEADER_SIZE = 20  # IP header size -> 20 bytes
 HEADER_FORMAT = "!BBHHHBBH4s4s"
+WORD = struct.Struct("!H")  # any 16-bit header field
 MAX_PACKET_SIZE = 65535  # maximum byte-size of a TCP pkt
 
 
@@ -14,6 +15,22 @@ class IPPacket:
     This class represents the IP pkt.
     """
 
+    __slots__ = (
+        "version",
+        "header_length",
+        "service_type",
+        "data",
+        "total_length",
+        "id",
+        "flags",
+        "ttl",
+        "protocol",
+        "checksum",
+        "src",
+        "dst",
+        "packet",
+    )
+
     def __init__(
         self,
         dst,
@@ -47,7 +64,7 @@ class IPPacket:
         if mode == "receive":
             self.dst = dst
         else:
-            self.dst = socket.gethostbyname(dst)
+            self.dst = resolve_host(dst)
         self.packet = None
 
     def shift_fields(self):
@@ -85,56 +102,85 @@ class IPPacket:
             socket.inet_aton(self.dst),
         )
         self.checksum = calculate_checksum(self.packet)  # calculate checksum
-        self.packet = (  # inject calculated checksum in the right spot
-            self.packet[:10]
-            + struct.pack("!H", self.checksum)
-            + self.packet[12:]
-            + self.data
-        )
+        self.packet = bytearray(self.packet + self.data)
+        struct.pack_into("!H", self.packet, 10, self.checksum)  # inject calculated checksum in the right spot
         return self.packet
 
     @staticmethod
-    def unpack(raw_pkt: bytes) -> str or None:
+    def unpack(raw_pkt: bytes) -> "IPPacketView" or None:
         """
-        Decodes and parses incoming IP packets.
+        Decodes and parses incoming IP packets without copying them: the returned view reads its header fields lazily
+        from the receive buffer.
 
         :param raw_pkt: the encoded IP pkt
         :return: the decoded IP pkt or None
         """
 
-        (
-            _,  # don't need version + header length
-            _,  # don't need TOS
-            _,  # don't need total length
-            pkt_id,
-            _,  # don't need flags + fragment offset
-            ttl,
-            protocol,
-            checksum,
-            src_ip,
-            dst_ip,
-        ) = struct.unpack(HEADER_FORMAT, raw_pkt[:20])
-        src_ip = socket.inet_ntoa(src_ip)
-        dst_ip = socket.inet_ntoa(dst_ip)
-        data = raw_pkt[20:]
-        ip_pkt = IPPacket(
-            dst=dst_ip,
-            data=data,
-            src=src_ip,
-            mode="receive",
-            checksum=checksum,
-        )
-        ip_pkt.id = pkt_id
-        ip_pkt.ttl = ttl
-        ip_pkt.protocol = protocol
-        ip_pkt.checksum = checksum
-        zero_csum_raw_ip_pkt = (  # reset the incoming packet's checksum to 0
-                raw_pkt[:10]
-                + struct.pack("!H", 0)
-                + raw_pkt[12:20]
-        )
-        check_checksum = calculate_checksum(zero_csum_raw_ip_pkt)  # calculate checksum
-        if check_checksum == checksum:  # compare locally calculated checksum with server's one
-            return ip_pkt
-        else:
+        view = memoryview(raw_pkt)
+        if len(view) < HEADER_SIZE:  # truncated pkt
+            return None
+        header_length = (view[0] & 0x0f) * 4  # IHL is in 32-bit words, options included
+        if header_length < HEADER_SIZE or len(view) < header_length:
             return None
+        if calculate_checksum(view[:header_length]) != 0:  # the sum over a valid header, checksum included, is -0
+            return None
+        return IPPacketView(view, header_length)
+
+
+class IPPacketView:
+    """
+    This class represents a received IP pkt, backed by the receive buffer. Header fields are decoded on access.
+    """
+
+    __slots__ = ("buf", "header_length")
+
+    def __init__(self, buf: memoryview, header_length: int):
+        """
+        Instantiates this IPPacketView object over the given buffer.
+
+        :param buf: the encoded IP pkt
+        :param header_length: the header length in bytes, options included
+        """
+
+        self.buf = buf
+        self.header_length = header_length
+
+    @property
+    def total_length(self) -> int:
+        return min(WORD.unpack_from(self.buf, 2)[0], len(self.buf))
+
+    @property
+    def id(self) -> int:
+        return WORD.unpack_from(self.buf, 4)[0]
+
+    @property
+    def ttl(self) -> int:
+        return self.buf[8]
+
+    @property
+    def protocol(self) -> int:
+        return self.buf[9]
+
+    @property
+    def checksum(self) -> int:
+        return WORD.unpack_from(self.buf, 10)[0]
+
+    @property
+    def addrs(self) -> memoryview:
+        """
+        The packed source and destination addresses, which are also the first 8 bytes of the TCP pseudo header.
+        """
+
+        return self.buf[12:20]
+
+    @property
+    def src(self) -> str:
+        return socket.inet_ntoa(self.buf[12:16])
+
+    @property
+    def dst(self) -> str:
+        return socket.inet_ntoa(self.buf[16:20])
+
+    @property
+    def data(self) -> memoryview:
+        return self.buf[self.header_length:self.total_length]
@@ -0,0 +1,68 @@
+import json
+import os
+
+PARTIAL_SUFFIX = ".part"  # appended to the target file name while the download is in progress
+JOURNAL_SUFFIX = ".json"  # appended to the partial file name
+
+
+class Journal:
+    """
+    This class represents the progress journal of a resumable download: a small JSON file next to the partial file,
+    recording the URL, the validator of the response (its ETag or Last-Modified) and how many body bytes are safely
+    on disk. A later run can resume with a Range request from that offset, as long as the validator still matches.
+    """
+
+    __slots__ = ("url", "file_name")
+
+    def __init__(self, url: str, partial_file_name: str):
+        """
+        Instantiates this Journal object to the given download.
+
+        :param url: the full URL
+        :param partial_file_name: the partial file the body is written to
+        """
+
+        self.url = url
+        self.file_name = partial_file_name + JOURNAL_SUFFIX
+
+    def load(self) -> tuple or None:
+        """
+        Returns where the previous attempt at the download stopped.
+
+        :return: the (validator, offset) tuple, or None if there is no usable journal for the URL
+        """
+
+        try:
+            with open(self.file_name) as fd:
+                entry = json.load(fd)
+        except (OSError, ValueError):
+            return None
+        if entry.get("url") != self.url or not entry.get("validator") or not isinstance(entry.get("offset"), int):
+            return None
+        return entry["validator"], entry["offset"]
+
+    def save(self, validator: str or None, offset: int):
+        """
+        Records the download's progress. The journal is replaced atomically, so a crash leaves the old or the new
+        one, never a mix.
+
+        :param validator: the response's validator, None if it has none (it can't be resumed then)
+        :param offset: the number of body bytes that are on disk
+        """
+
+        temp_file_name = self.file_name + ".tmp"
+        with open(temp_file_name, "w") as fd:
+            json.dump({"url": self.url, "validator": validator, "offset": offset}, fd)
+            fd.flush()
+            os.fsync(fd.fileno())
+        os.replace(temp_file_name, self.file_name)
+
+    def remove(self):
+        """
+        Deletes the journal, once the download is complete or restarts from scratch.
+        """
+
+        try:
+            os.remove(self.file_name)
+        except FileNotFoundError:
+            pass
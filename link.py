@@ -0,0 +1,224 @@
+import socket
+from collections import deque
+from utils import get_local_ip_addr, resolve_host
+from batch_io import RecvRing, Sender
+from socket_filter import flow_program, attach_filter
+
+TEST = "0.0.0.0"
+PORT_BLOCK = 64  # ports reserved at a time
+
+
+class PortPool:
+    """
+    This class represents the local ports reserved for our connections. Each one is held by a bound TCP socket for
+    as long as the program runs, so no other socket on the host gets it meanwhile. The kernel picks them among its
+    ephemeral ports, without any retries, a block at a time.
+
+    Free ports wait in a FIFO queue: taking and releasing one are O(1), and a released port is reused last, which
+    gives the server time to forget its old connection.
+    """
+
+    __slots__ = ("held", "free", "taken")
+
+    def __init__(self):
+        """
+        Instantiates this PortPool object, empty: ports are reserved on demand.
+        """
+
+        self.held = {}  # port -> the socket reserving it
+        self.free = deque()  # reserved ports no connection uses, oldest released first
+        self.taken = set()  # reserved ports in use
+
+    def reserve(self, count: int):
+        """
+        Reserves more ports.
+
+        :param count: the number of ports
+        :raise OSError: if the kernel has no ephemeral port left, and none could be reserved
+        """
+
+        for _ in range(count):
+            sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            try:
+                sock.bind((TEST, 0))  # the kernel picks the port
+            except OSError:
+                sock.close()
+                if self.free:  # make do with the ones reserved so far
+                    return
+                raise
+            port = sock.getsockname()[1]
+            self.held[port] = sock
+            self.free.append(port)
+
+    def take(self) -> int:
+        """
+        Returns a free port, marking it in use.
+
+        :return: the port
+        :raise OSError: if no port could be reserved
+        """
+
+        if not self.free:
+            self.reserve(PORT_BLOCK)
+        port = self.free.popleft()
+        self.taken.add(port)
+        return port
+
+    def release(self, port: int):
+        """
+        Puts a port back, once its connection is closed. Ports that didn't come from the pool are ignored.
+
+        :param port: the port
+        """
+
+        if port in self.taken:
+            self.taken.remove(port)
+            self.free.append(port)
+
+
+PORTS = PortPool()  # shared by the RawLinks of all connections
+
+
+class RawLink:
+    """
+    This class represents the link a TCPSocket reaches the network through, here the host's IP layer via raw sockets.
+
+    A link resolves the addresses of a connection, picks its local port (and takes it back with release_port()),
+    and opens its endpoint: the recv_ring (recv(timeout) and len(), like batch_io.RecvRing) and sender (send(bufs),
+    like batch_io.Sender) the connection exchanges raw IP pkts through. For asyncio, add_reader() and remove_reader()
+    watch the receive socket the link opened from an event loop, and open_engine(), open_shared() and close_engine()
+    handle the sockets a packet_engine.PacketEngine shares. See
+    sim_link.SimLink for an in-memory link.
+
+    Connection setup is cheap: host names are resolved through a cache, the source address comes from a routing
+    lookup cached per destination, and ports come from the shared PortPool.
+    """
+
+    __slots__ = ()
+
+    def resolve(self, host: str) -> str:
+        """
+        Returns the address of a host, see utils.resolve_host().
+
+        :param host: the host name or address
+        :return: the address (dotted quad)
+        """
+
+        return resolve_host(host)
+
+    def local_addr(self, dst_host: str) -> str:
+        """
+        Returns our address towards a destination, see utils.get_local_ip_addr().
+
+        :param dst_host: the destination address (dotted quad)
+        :return: the address (dotted quad)
+        """
+
+        return get_local_ip_addr(dst_host)
+
+    def pick_port(self) -> int:
+        """
+        Returns a local port that is available, from the shared PortPool.
+
+        :return: the port
+        """
+
+        return PORTS.take()
+
+    def release_port(self, port: int):
+        """
+        Returns a port to the shared PortPool.
+
+        :param port: the port
+        """
+
+        PORTS.release(port)
+
+    def open(self, connection, kernel_filter: bool = True):
+        """
+        Opens the raw receive and send sockets of a connection.
+
+        :param connection: the TCPSocket
+        :param kernel_filter: whether to attach a BPF filter to the receive socket
+        """
+
+        connection.recv_sock = socket.socket(
+            socket.AF_INET, socket.SOCK_RAW, socket.IPPROTO_TCP
+        )
+        connection.send_sock = socket.socket(
+            socket.AF_INET, socket.SOCK_RAW, socket.IPPROTO_RAW
+        )
+        if kernel_filter:
+            try:
+                attach_filter(
+                    connection.recv_sock,
+                    flow_program(connection.src_host, connection.src_port, connection.dst_host, connection.dst_port),
+                )
+            except OSError:  # no socket filters here, the FlowFilter still drops other flows' pkts
+                pass
+        connection.recv_ring = RecvRing(connection.recv_sock)  # batched receives
+        connection.sender = Sender(connection.send_sock, connection.dst_addr)
+
+    def open_engine(self, engine):
+        """
+        Opens the raw receive and send sockets a PacketEngine shares among its connections.
+
+        :param engine: the PacketEngine
+        """
+
+        engine.recv_sock = socket.socket(socket.AF_INET, socket.SOCK_RAW, socket.IPPROTO_TCP)
+        engine.send_sock = socket.socket(socket.AF_INET, socket.SOCK_RAW, socket.IPPROTO_RAW)
+        engine.recv_ring = RecvRing(engine.recv_sock)
+
+    def open_shared(self, connection, engine):
+        """
+        Opens the endpoint of a connection on the sockets of a PacketEngine, which receives for it: its sender.
+
+        :param connection: the AsyncTCPSocket
+        :param engine: the PacketEngine
+        """
+
+        connection.send_sock = engine.send_sock
+        connection.sender = Sender(engine.send_sock, connection.dst_addr)
+
+    def close_engine(self, engine):
+        """
+        Closes the raw sockets of a PacketEngine.
+
+        :param engine: the PacketEngine
+        """
+
+        engine.recv_sock.close()
+        engine.send_sock.close()
+
+    def add_reader(self, loop, sock, callback):
+        """
+        Has an event loop call back whenever a receive socket of this link is readable.
+
+        :param loop: the event loop
+        :param sock: the receive socket, i.e. the recv_sock the link opened for a connection or a PacketEngine
+        :param callback: called without arguments
+        """
+
+        loop.add_reader(sock.fileno(), callback)
+
+    def remove_reader(self, loop, sock):
+        """
+        Stops watching a receive socket, see add_reader().
+
+        :param loop: the event loop
+        :param sock: the receive socket
+        """
+
+        loop.remove_reader(sock.fileno())
+
+    def close(self, connection):
+        """
+        Closes the raw sockets of a connection and releases its port.
+
+        :param connection: the TCPSocket
+        """
+
+        connection.recv_sock.close()
+        connection.send_sock.close()
+        self.release_port(connection.src_port)
@@ -0,0 +1,99 @@
+import asyncio
+from link import RawLink
+from socket_filter import flow_key
+
+
+class PacketEngine:
+    """
+    This class represents a packet engine shared by many AsyncTCPSockets: it owns a single raw receive socket and a
+    single raw send socket, reads every incoming pkt once and hands it to its connection through a hash table keyed
+    by the pkt's 4-tuple. Without it, every connection has its own raw receive socket, so the kernel copies each pkt
+    to all of them and each connection sifts through everybody else's traffic.
+
+    The sockets come from a link (see link.py): raw sockets by default, or the shared endpoint of a sim_link.SimLink.
+    Connections using the engine go through its link.
+    """
+
+    __slots__ = ("link", "recv_sock", "send_sock", "recv_ring", "connections", "loop")
+
+    def __init__(self, link=None):
+        """
+        Instantiates this PacketEngine object with its shared sockets, opened on the given link.
+
+        :param link: the link to reach the servers through, None for raw sockets
+        """
+
+        self.link = RawLink() if link is None else link
+        self.recv_sock = self.send_sock = self.recv_ring = None
+        self.link.open_engine(self)
+        self.connections = {}  # flow key (see socket_filter.flow_key) -> AsyncTCPSocket
+        self.loop = None  # the event loop watching the receive socket
+
+    def __contains__(self, key: tuple) -> bool:
+        """
+        Checks if a connection is registered under a flow key.
+
+        :param key: the flow key of the pkts the connection receives
+        :return: True if the key is taken, False otherwise
+        """
+
+        return key in self.connections
+
+    def register(self, connection):
+        """
+        Starts handing a connection its pkts, which also reserves its flow key.
+
+        :param connection: the AsyncTCPSocket
+        """
+
+        self.connections[connection.flow.key] = connection
+
+    def listen(self):
+        """
+        Has the running event loop watch the receive socket, if it doesn't yet.
+        """
+
+        if self.loop is None:
+            self.loop = asyncio.get_running_loop()
+            self.link.add_reader(self.loop, self.recv_sock, self.on_readable)
+
+    def unregister(self, connection):
+        """
+        Stops handing a connection its pkts.
+
+        :param connection: the AsyncTCPSocket
+        """
+
+        self.connections.pop(connection.flow.key, None)
+
+    def on_readable(self):
+        """
+        Dispatches a batch of incoming pkts, called by the event loop when the raw socket is readable. Each
+        connection that got pkts then re-arms its timer once for the whole batch.
+        """
+
+        try:
+            raw_pkt = self.recv_ring.recv(0)
+        except (BlockingIOError, TimeoutError):  # the readiness was spurious
+            return
+        woken = {}  # dict rather than set, to keep the arrival order
+        while True:
+            connection = self.connections.get(flow_key(raw_pkt))
+            if connection is not None:
+                connection.on_raw_pkt(raw_pkt)
+                woken[connection] = None
+            if not self.recv_ring:
+                break
+            raw_pkt = self.recv_ring.recv(0)
+        for connection in woken:
+            connection.after_event()
+
+    def close(self):
+        """
+        Stops watching the receive socket and closes the shared sockets.
+        """
+
+        if self.loop is not None:
+            self.link.remove_reader(self.loop, self.recv_sock)
+            self.loop = None
+        self.link.close_engine(self)
@@ -0,0 +1,520 @@
+import socket
+import struct
+from time import time
+from socket_filter import FlowFilter, flow_key
+from tcp_pkt import SEQ_SPACE, SYN, ACK, END_OF_OPTIONS, NOP, TIMESTAMPS
+from utils import checksum_sum, update_checksum
+
+PCAP_MAGIC = 0xA1B2C3D4  # microsecond timestamps
+PCAP_MAGIC_NS = 0xA1B23C4D  # nanosecond timestamps
+LINKTYPE_ETHERNET = 1
+LINKTYPE_RAW = 101  # IP pkts without a link-layer header, what we write
+LINKTYPE_IPV4 = 228
+ETHERNET_HEADER_SIZE = 14
+ETHERTYPE_IPV4 = 0x0800
+SNAPLEN = 65535
+FILE_HEADER = struct.Struct("<IHHiIII")  # magic, version, time zone, accuracy, snaplen, link type
+RECORD_HEADER = struct.Struct("<IIII")  # seconds, fraction, captured length, original length
+
+
+class PcapWriter:
+    """
+    This class represents a capture file in the classic pcap format, with microsecond timestamps and raw IP pkts,
+    which tcpdump and Wireshark read.
+    """
+
+    __slots__ = ("file",)
+
+    def __init__(self, file_name: str):
+        """
+        Instantiates this PcapWriter object, creating the file.
+
+        :param file_name: the capture file
+        """
+
+        self.file = open(file_name, "wb")
+        self.file.write(FILE_HEADER.pack(PCAP_MAGIC, 2, 4, 0, 0, SNAPLEN, LINKTYPE_RAW))
+
+    def write(self, pkt, timestamp: float = None):
+        """
+        Appends a pkt.
+
+        :param pkt: the raw IP pkt (bytes-like)
+        :param timestamp: when it was sent or received, in seconds since the epoch; now by default
+        """
+
+        if timestamp is None:
+            timestamp = time()
+        seconds = int(timestamp)
+        self.file.write(RECORD_HEADER.pack(seconds, int((timestamp - seconds) * 1e6), len(pkt), len(pkt)))
+        self.file.write(pkt)
+
+    def flush(self):
+        """
+        Writes the buffered pkts to the file.
+        """
+
+        self.file.flush()
+
+    def close(self):
+        """
+        Writes the buffered pkts and closes the file.
+        """
+
+        self.file.close()
+
+
+def read_pcap(file_name: str):
+    """
+    Reads the IPv4 pkts of a classic pcap file: raw IP, as written by PcapWriter, or Ethernet, as tcpdump captures
+    on most interfaces (other frames are skipped). Either byte order, micro or nanosecond timestamps.
+
+    :param file_name: the capture file
+    :return: a generator of (timestamp, raw IP pkt) tuples
+    :raise ValueError: if the file isn't a pcap file or has another link type
+    """
+
+    with open(file_name, "rb") as fd:
+        header = fd.read(FILE_HEADER.size)
+        if len(header) < FILE_HEADER.size:
+            raise ValueError("Not a pcap file: " + file_name)
+        for order in "<>":
+            magic = struct.unpack(order + "I", header[:4])[0]
+            if magic in (PCAP_MAGIC, PCAP_MAGIC_NS):
+                break
+        else:
+            raise ValueError("Not a pcap file: " + file_name)
+        fraction = 1e-9 if magic == PCAP_MAGIC_NS else 1e-6
+        link_type = struct.unpack(order + "I", header[20:24])[0] & 0xFFFF  # the upper bits may hold FCS flags
+        if link_type not in (LINKTYPE_RAW, LINKTYPE_IPV4, LINKTYPE_ETHERNET):
+            raise ValueError("Unsupported pcap link type: %d" % link_type)
+        record_header = struct.Struct(order + "IIII")
+        while True:
+            record = fd.read(record_header.size)
+            if len(record) < record_header.size:  # end of the file, or a capture cut short
+                return
+            seconds, sub_seconds, captured_length, _ = record_header.unpack(record)
+            frame = fd.read(captured_length)
+            if len(frame) < captured_length:
+                return
+            if link_type == LINKTYPE_ETHERNET:
+                if len(frame) < ETHERNET_HEADER_SIZE or int.from_bytes(frame[12:14], "big") != ETHERTYPE_IPV4:
+                    continue
+                frame = frame[ETHERNET_HEADER_SIZE:]
+            if frame and frame[0] >> 4 == 4:
+                yield seconds + sub_seconds * fraction, frame
+
+
+class CaptureLink:
+    """
+    This class represents a link that records the traffic of another one (see link.py): every datagram its
+    connections send or receive is appended to a pcap file, as it leaves or arrives. The file can be opened with
+    tcpdump or Wireshark, or replayed through the stack with ReplayLink.
+    """
+
+    __slots__ = ("link", "writer")
+
+    def __init__(self, link, file_name: str):
+        """
+        Instantiates this CaptureLink object around the given link.
+
+        :param link: the link that carries the traffic, e.g. link.RawLink
+        :param file_name: the capture file
+        """
+
+        self.link = link
+        self.writer = PcapWriter(file_name)
+
+    def resolve(self, host: str) -> str:
+        """
+        Returns the address of a host, see RawLink.resolve().
+
+        :param host: the host name or address
+        :return: the address (dotted quad)
+        """
+
+        return self.link.resolve(host)
+
+    def local_addr(self, dst_host: str) -> str:
+        """
+        Returns our address towards a destination, see RawLink.local_addr().
+
+        :param dst_host: the destination address (dotted quad)
+        :return: the address (dotted quad)
+        """
+
+        return self.link.local_addr(dst_host)
+
+    def pick_port(self) -> int:
+        """
+        Returns a local port, see RawLink.pick_port().
+
+        :return: the port
+        """
+
+        return self.link.pick_port()
+
+    def release_port(self, port: int):
+        """
+        Releases a local port, see RawLink.release_port().
+
+        :param port: the port
+        """
+
+        self.link.release_port(port)
+
+    def open(self, connection, kernel_filter: bool = True):
+        """
+        Opens the endpoint of a connection on the underlying link, then taps it.
+
+        :param connection: the TCPSocket
+        :param kernel_filter: whether to attach a BPF filter to the receive socket
+        """
+
+        self.link.open(connection, kernel_filter)
+        connection.recv_ring = CaptureRing(connection.recv_ring, self.writer, connection.flow)
+        connection.sender = CaptureSender(connection.sender, self.writer)
+
+    def add_reader(self, loop, sock, callback):
+        """
+        Watches a receive socket of the underlying link from an event loop, see RawLink.add_reader().
+
+        :param loop: the event loop
+        :param sock: the receive socket
+        :param callback: called without arguments
+        """
+
+        self.link.add_reader(loop, sock, callback)
+
+    def remove_reader(self, loop, sock):
+        """
+        Stops watching a receive socket, see RawLink.remove_reader().
+
+        :param loop: the event loop
+        :param sock: the receive socket
+        """
+
+        self.link.remove_reader(loop, sock)
+
+    def close(self, connection):
+        """
+        Closes the endpoint of a connection, and writes out its pkts.
+
+        :param connection: the TCPSocket
+        """
+
+        self.link.close(connection)
+        self.writer.flush()
+
+
+class CaptureRing:
+    """
+    This class represents a connection's recv_ring tapped by a CaptureLink. Only the connection's own pkts are
+    recorded: without the kernel filter, the raw socket also delivers every other flow's.
+    """
+
+    __slots__ = ("ring", "writer", "flow")
+
+    def __init__(self, ring, writer: PcapWriter, flow: FlowFilter):
+        """
+        Instantiates this CaptureRing object around the given ring.
+
+        :param ring: the recv_ring
+        :param writer: the PcapWriter
+        :param flow: the connection's FlowFilter
+        """
+
+        self.ring = ring
+        self.writer = writer
+        self.flow = flow
+
+    def __len__(self) -> int:
+        return len(self.ring)
+
+    def recv(self, timeout: float):
+        """
+        Returns the next pkt from the ring, see batch_io.RecvRing.recv(), and records it if it is the connection's.
+
+        :param timeout: how long to wait, in seconds
+        :return: the raw IP pkt
+        """
+
+        raw_pkt = self.ring.recv(timeout)
+        if self.flow.matches(raw_pkt):
+            self.writer.write(raw_pkt)
+        return raw_pkt
+
+
+class CaptureSender:
+    """
+    This class represents a connection's sender tapped by a CaptureLink.
+    """
+
+    __slots__ = ("sender", "writer")
+
+    def __init__(self, sender, writer: PcapWriter):
+        """
+        Instantiates this CaptureSender object around the given sender.
+
+        :param sender: the sender
+        :param writer: the PcapWriter
+        """
+
+        self.sender = sender
+        self.writer = writer
+
+    def send(self, bufs: list):
+        """
+        Sends a pkt, see batch_io.Sender.send(), and records it.
+
+        :param bufs: the pkt's bytes-like parts, in order
+        """
+
+        self.writer.write(b"".join(bufs))
+        self.sender.send(bufs)
+
+
+class RecordedConnection:
+    """
+    This class represents a TCP connection found in a capture: its addresses, the client's initial sequence number,
+    and the pkts the server sent on it, in capture order.
+    """
+
+    __slots__ = ("client_host", "client_port", "server_host", "server_port", "isn", "pkts")
+
+    def __init__(self, syn_pkt: bytes):
+        """
+        Instantiates this RecordedConnection object from the client's SYN.
+
+        :param syn_pkt: the raw IP pkt of the SYN
+        """
+
+        header_length = (syn_pkt[0] & 0x0F) * 4
+        self.client_host = socket.inet_ntoa(syn_pkt[12:16])
+        self.server_host = socket.inet_ntoa(syn_pkt[16:20])
+        self.client_port, self.server_port, self.isn = struct.unpack_from("!HHI", syn_pkt, header_length)
+        self.pkts = []
+
+
+class ReplayLink:
+    """
+    This class represents a link that plays the server's side of captured connections back, for reproducing a
+    transfer offline: the pkts the server sent go through IPPacket.unpack, TCPPacket.unpack, the TCPSocket's
+    reassembly and the HTTP layer again, as fast as they are consumed, in the captured order (losses, duplicates,
+    reordering and all). What the connection sends is dropped.
+
+    Each new connection takes the next connection of the capture, with its addresses and port. The client must send
+    the same requests as in the capture, i.e. download the same URLs the same way. Its initial sequence number is
+    random, so the server's ACK numbers are shifted to match it (checksums included). The timestamps option is
+    blanked out of the server's SYN-ACK, so the connection doesn't agree on timestamps: the server's echoes are
+    captured ones, and would give bogus RTT samples. The other fields are left as captured.
+    """
+
+    __slots__ = ("recorded", "next")
+
+    def __init__(self, file_name: str):
+        """
+        Instantiates this ReplayLink object to the given capture.
+
+        :param file_name: the pcap file, see read_pcap()
+        :raise ValueError: if the file can't be read or holds no TCP connection
+        """
+
+        self.recorded = []  # RecordedConnection objects, in the order of their SYNs
+        self.next = 0  # index of the recorded connection the next connection replays
+        by_server_flow = {}  # flow_key() of the server's pkts -> RecordedConnection
+        for _, raw_pkt in read_pcap(file_name):
+            key = flow_key(raw_pkt)
+            if key is None or raw_pkt[9] != socket.IPPROTO_TCP:
+                continue
+            header_length = (raw_pkt[0] & 0x0F) * 4
+            if raw_pkt[header_length + 13] & (SYN | ACK) == SYN:  # a client opens a connection
+                server_key = (key[1], key[0], key[3], key[2])
+                connection = by_server_flow.get(server_key)
+                isn, = struct.unpack_from("!I", raw_pkt, header_length + 4)
+                if connection is None or connection.isn != isn or connection.pkts:  # not a retransmitted SYN
+                    by_server_flow[server_key] = connection = RecordedConnection(bytes(raw_pkt))
+                    self.recorded.append(connection)
+            elif key in by_server_flow:
+                by_server_flow[key].pkts.append(strip_timestamps(bytes(raw_pkt)))
+        if not self.recorded:
+            raise ValueError("No TCP connection in the capture: " + file_name)
+
+    def upcoming(self) -> RecordedConnection:
+        """
+        Returns the recorded connection the next connection replays.
+
+        :return: the RecordedConnection
+        :raise ConnectionError: if every recorded connection was replayed
+        """
+
+        if self.next == len(self.recorded):
+            raise ConnectionError("No more connections in the capture")
+        return self.recorded[self.next]
+
+    def resolve(self, host: str) -> str:
+        """
+        Returns the captured server's address, whatever the host.
+
+        :param host: the host name or address
+        :return: the address (dotted quad)
+        """
+
+        return self.upcoming().server_host
+
+    def local_addr(self, dst_host: str) -> str:
+        """
+        Returns the captured client's address.
+
+        :param dst_host: the destination address, ignored
+        :return: the address (dotted quad)
+        """
+
+        return self.upcoming().client_host
+
+    def pick_port(self) -> int:
+        """
+        Returns the captured client's port.
+
+        :return: the port
+        """
+
+        return self.upcoming().client_port
+
+    def release_port(self, port: int):
+        """
+        Does nothing, the ports are the captured ones.
+
+        :param port: the port
+        """
+
+    def open(self, connection, kernel_filter: bool = True):
+        """
+        Opens the endpoint of a connection, which replays the next recorded connection.
+
+        :param connection: the TCPSocket
+        :param kernel_filter: ignored, only the recorded connection's pkts are replayed
+        """
+
+        connection.recv_ring = connection.sender = ReplayEndpoint(self.upcoming())
+        self.next += 1
+
+    def close(self, connection):
+        """
+        Closes the endpoint of a connection.
+
+        :param connection: the TCPSocket
+        """
+
+
+class ReplayEndpoint:
+    """
+    This class represents a connection's end of a ReplayLink, standing in for both its RecvRing and its Sender.
+    """
+
+    __slots__ = ("recorded", "pkts", "index")
+
+    def __init__(self, recorded: RecordedConnection):
+        """
+        Instantiates this ReplayEndpoint object to the given recorded connection.
+
+        :param recorded: the RecordedConnection
+        """
+
+        self.recorded = recorded
+        self.pkts = None  # the server's pkts, ACK numbers shifted, once our SYN is sent
+        self.index = 0  # the next pkt to receive
+
+    def __len__(self) -> int:
+        """
+        Returns the number of pkts left to receive.
+
+        :return: the number of pkts
+        """
+
+        return len(self.pkts) - self.index if self.pkts else 0
+
+    def send(self, bufs: list):
+        """
+        Drops a pkt, after learning the shift of the ACK numbers from the first one, our SYN.
+
+        :param bufs: the pkt's bytes-like parts, in order
+        """
+
+        if self.pkts is not None:
+            return
+        header_length = (bufs[0][0] & 0x0F) * 4
+        isn = struct.unpack_from("!I", b"".join(bufs), header_length + 4)[0]
+        shift = (isn - self.recorded.isn) % SEQ_SPACE
+        self.pkts = [shift_ack(raw_pkt, shift) for raw_pkt in self.recorded.pkts] if shift else self.recorded.pkts
+
+    def recv(self, timeout: float) -> bytes:
+        """
+        Returns the next pkt the server sent, right away.
+
+        :param timeout: ignored, there is no waiting
+        :return: the raw IP pkt
+        :raise TimeoutError: once the capture is exhausted (BlockingIOError if the timeout is 0)
+        """
+
+        if not self:
+            raise BlockingIOError if timeout == 0 else TimeoutError
+        self.index += 1
+        return self.pkts[self.index - 1]
+
+
+def shift_ack(raw_pkt: bytes, shift: int) -> bytes:
+    """
+    Returns a copy of a TCP/IP pkt with its ACK number shifted, and its checksum updated to match.
+
+    :param raw_pkt: the raw IP pkt
+    :param shift: what to add to the ACK number
+    :return: the raw IP pkt
+    """
+
+    header_length = (raw_pkt[0] & 0x0F) * 4
+    if len(raw_pkt) < header_length + 20 or not raw_pkt[header_length + 13] & ACK:
+        return raw_pkt
+    raw_pkt = bytearray(raw_pkt)
+    ack_num, = struct.unpack_from("!I", raw_pkt, header_length + 8)
+    checksum, = struct.unpack_from("!H", raw_pkt, header_length + 16)
+    new_ack_num = (ack_num + shift) % SEQ_SPACE
+    struct.pack_into("!I", raw_pkt, header_length + 8, new_ack_num)
+    struct.pack_into("!H", raw_pkt, header_length + 16, update_checksum(checksum, ack_num, new_ack_num))
+    return bytes(raw_pkt)
+
+
+def strip_timestamps(raw_pkt: bytes) -> bytes:
+    """
+    Returns a copy of a TCP/IP SYN pkt with its timestamps option overwritten with NOPs, and its checksum updated to
+    match. Other pkts are returned as they are.
+
+    :param raw_pkt: the raw IP pkt
+    :return: the raw IP pkt
+    """
+
+    header_length = (raw_pkt[0] & 0x0F) * 4
+    if len(raw_pkt) < header_length + 20 or not raw_pkt[header_length + 13] & SYN:
+        return raw_pkt
+    i = header_length + 20
+    end = min(header_length + (raw_pkt[header_length + 12] >> 4) * 4, len(raw_pkt))
+    while i < end and raw_pkt[i] != END_OF_OPTIONS:
+        if raw_pkt[i] == NOP:
+            i += 1
+            continue
+        if i + 1 >= end or not 2 <= raw_pkt[i + 1] <= end - i:  # malformed, see tcp_pkt.iter_options()
+            return raw_pkt
+        if raw_pkt[i] == TIMESTAMPS:
+            break
+        i += raw_pkt[i + 1]
+    else:
+        return raw_pkt
+    length = raw_pkt[i + 1]
+    nops = bytes([NOP]) * length
+    padding = b"\0" * ((i - header_length) % 2)  # the sums of a field at an odd offset are shifted by a byte
+    raw_pkt = bytearray(raw_pkt)
+    checksum, = struct.unpack_from("!H", raw_pkt, header_length + 16)
+    checksum = update_checksum(checksum, checksum_sum(padding + raw_pkt[i:i + length]), checksum_sum(padding + nops))
+    raw_pkt[i:i + length] = nops
+    struct.pack_into("!H", raw_pkt, header_length + 16, checksum)
+    return bytes(raw_pkt)
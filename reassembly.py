@@ -0,0 +1,174 @@
+from bisect import bisect_left, bisect_right
+from tcp_pkt import SEQ_SPACE
+
+
+class ReassemblyQueue:
+    """
+    This class represents the reassembly queue of a TCP byte stream. In-order data is handed straight to a callback,
+    while out-of-order data is kept in a sorted set of disjoint blocks that are merged and trimmed as segments
+    arrive, so overlapping or re-segmented retransmissions can't corrupt the stream.
+
+    Sequence numbers are mapped to unbounded stream offsets relative to the next expected byte, which takes care of
+    32-bit wraparound.
+
+    Bytes past the receive window are dropped, so a misbehaving peer can't make the queue hold more than the window
+    we advertised.
+    """
+
+    __slots__ = ("next_seq", "next_offset", "on_data", "window", "starts", "blocks", "latest")
+
+    def __init__(self, next_seq: int, on_data, window: int = None):
+        """
+        Instantiates this ReassemblyQueue object to the given next expected seq_num, bytes-ready callback and receive
+        window.
+
+        :param next_seq: the seq_num of the next expected byte
+        :param on_data: called with every run of in-order bytes, in stream order
+        :param window: the bytes accepted past the next expected byte, None for no limit
+        """
+
+        self.next_seq = next_seq
+        self.next_offset = 0  # stream offset of next_seq
+        self.on_data = on_data
+        self.window = window
+        self.starts = []  # sorted stream offsets of the out-of-order blocks
+        self.blocks = {}  # stream offset -> bytearray
+        self.latest = None  # stream offset of the block that received the latest segment
+
+    def __len__(self) -> int:
+        """
+        Returns the number of out-of-order blocks.
+
+        :return: the number of blocks
+        """
+
+        return len(self.starts)
+
+    def offset(self, seq_num: int) -> int:
+        """
+        Maps a seq_num to a stream offset, assuming it is within half the seq_num space of the next expected byte.
+
+        :param seq_num: the seq_num
+        :return: the stream offset
+        """
+
+        delta = (seq_num - self.next_seq) % SEQ_SPACE
+        if delta >= SEQ_SPACE // 2:  # before the next expected byte
+            delta -= SEQ_SPACE
+        return self.next_offset + delta
+
+    def add(self, seq_num: int, payload) -> int:
+        """
+        Adds a segment to the stream.
+
+        :param seq_num: the segment's seq_num
+        :param payload: the segment's payload (bytes-like, may be a view of a reused buffer)
+        :return: the number of bytes delivered to the callback, 0 if the segment was buffered, a duplicate or out of
+        the window
+        """
+
+        start = self.offset(seq_num)
+        end = start + len(payload)
+        if end <= self.next_offset:  # duplicate
+            return 0
+        if self.window is not None and end > self.next_offset + self.window:  # keep the part within the window
+            end = self.next_offset + self.window
+            if end <= start:
+                return 0
+            payload = payload[:end - start]
+        if start < self.next_offset:  # keep the new tail of a re-segmented retransmission
+            payload = payload[self.next_offset - start:]
+            start = self.next_offset
+        if start > self.next_offset:
+            self.insert(start, end, payload)
+            return 0
+
+        self.on_data(payload)
+        delivered = len(payload)
+        self.advance(delivered)
+        starts = self.starts
+        filled = 0  # blocks now reached by the in-order data, removed from starts at once
+        while filled < len(starts) and starts[filled] <= self.next_offset:  # the gap before the block is filled
+            block_start = starts[filled]
+            filled += 1
+            block = self.blocks.pop(block_start)
+            if block_start == self.latest:
+                self.latest = None
+            overlap = self.next_offset - block_start
+            if overlap < len(block):
+                self.on_data(memoryview(block)[overlap:])
+                delivered += len(block) - overlap
+                self.advance(len(block) - overlap)
+        if filled:
+            del starts[:filled]
+        return delivered
+
+    def advance(self, length: int):
+        """
+        Moves the next expected byte forward.
+
+        :param length: the number of bytes delivered
+        """
+
+        self.next_offset += length
+        self.next_seq = (self.next_seq + length) % SEQ_SPACE
+
+    def insert(self, start: int, end: int, payload):
+        """
+        Buffers out-of-order data, merging it with the blocks it overlaps or touches.
+
+        :param start: the data's stream offset
+        :param end: the data's end stream offset
+        :param payload: the data
+        """
+
+        first = bisect_left(self.starts, start)
+        if first > 0:
+            prev_start = self.starts[first - 1]
+            if prev_start + len(self.blocks[prev_start]) >= start:  # touches the previous block
+                first -= 1
+        last = bisect_right(self.starts, end)  # blocks[first:last] touch the new data
+        if first == last:  # a new block
+            self.starts.insert(first, start)
+            self.blocks[start] = bytearray(payload)
+            self.latest = start
+            return
+
+        block_start = self.starts[first]
+        block = self.blocks[block_start]
+        self.latest = min(block_start, start)
+        if last == first + 1 and block_start <= start:  # extends a single block, e.g. in-order data after a gap
+            block_end = block_start + len(block)
+            if end > block_end:
+                block += payload[block_end - start:]
+            return
+
+        merged_start = min(block_start, start)
+        last_start = self.starts[last - 1]
+        merged_end = max(end, last_start + len(self.blocks[last_start]))
+        merged = bytearray(merged_end - merged_start)
+        merged[start - merged_start:end - merged_start] = payload
+        for old_start in self.starts[first:last]:
+            old_block = self.blocks.pop(old_start)
+            merged[old_start - merged_start:old_start - merged_start + len(old_block)] = old_block
+        self.starts[first:last] = [merged_start]
+        self.blocks[merged_start] = merged
+
+    def sack_blocks(self, max_blocks: int) -> list:
+        """
+        Returns the out-of-order blocks to report in a SACK option, the one holding the latest segment first.
+
+        :param max_blocks: the maximum number of blocks
+        :return: the (left edge, right edge) seq_num tuples
+        """
+
+        starts = self.starts
+        if self.latest in self.blocks:
+            starts = [self.latest] + [start for start in starts if start != self.latest]
+        return [
+            (
+                (self.next_seq + start - self.next_offset) % SEQ_SPACE,
+                (self.next_seq + start - self.next_offset + len(self.blocks[start])) % SEQ_SPACE,
+            )
+            for start in starts[:max_blocks]
+        ]
@@ -0,0 +1,47 @@
+INITIAL_RTO = 1.0  # seconds, RFC 6298 section 2.1
+MIN_RTO = 0.2  # seconds, RFC 6298 asks for 1 s but allows less; 200 ms is what Linux uses
+MAX_RTO = 60.0  # seconds
+ALPHA = 1 / 8  # SRTT gain
+BETA = 1 / 4  # RTTVAR gain
+K = 4  # RTTVAR multiplier
+CLOCK_GRANULARITY = 0.001  # seconds, time.monotonic() is much finer but timeouts aren't
+
+
+class RTTEstimator:
+    """
+    This class represents the round-trip time estimator and retransmission timeout (RTO) of a connection, as per
+    RFC 6298. The caller only feeds it samples of segments that weren't retransmitted (Karn's algorithm).
+    """
+
+    __slots__ = ("srtt", "rttvar", "rto")
+
+    def __init__(self):
+        """
+        Instantiates this RTTEstimator object with no samples yet.
+        """
+
+        self.srtt = None  # smoothed RTT in seconds
+        self.rttvar = None  # RTT variation in seconds
+        self.rto = INITIAL_RTO  # seconds
+
+    def sample(self, rtt: float):
+        """
+        Updates the estimates with a new RTT measurement and recomputes the RTO, which also undoes any backoff.
+
+        :param rtt: the measured RTT in seconds
+        """
+
+        if self.srtt is None:  # first measurement
+            self.srtt = rtt
+            self.rttvar = rtt / 2
+        else:
+            self.rttvar = (1 - BETA) * self.rttvar + BETA * abs(self.srtt - rtt)
+            self.srtt = (1 - ALPHA) * self.srtt + ALPHA * rtt
+        self.rto = min(max(self.srtt + max(CLOCK_GRANULARITY, K * self.rttvar), MIN_RTO), MAX_RTO)
+
+    def backoff(self):
+        """
+        Doubles the RTO after a retransmission timeout.
+        """
+
+        self.rto = min(self.rto * 2, MAX_RTO)
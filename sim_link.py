@@ -0,0 +1,449 @@
+import heapq
+import importlib
+import random
+import sys
+from collections import deque
+from contextlib import contextmanager
+from itertools import count
+from time import monotonic, sleep
+from socket_filter import flow_key
+
+CLIENT_HOST = "192.0.2.1"  # documentation addresses (RFC 5737), never routed
+SERVER_HOST = "192.0.2.80"
+FIRST_PORT = 40000  # local ports are handed out in order from here
+MIN_REORDER_DELAY = 0.001  # seconds a reordered pkt is held back at least, even on a link without delay
+CLOCK_USERS = ("tcp_sock", "congestion", "stats", "utils")  # the modules of the stack reading time.monotonic()
+
+
+class SimClock:
+    """
+    This class represents a simulated clock for blocking connections over a SimLink. While installed, the stack and
+    the link read it instead of time.monotonic(), and the link's waits move it forward at once instead of sleeping.
+    A run then takes no real time, and its timing only depends on the link's settings and seed, not on the machine.
+    Event loop timers keep real time, so asyncio connections can't run on it.
+    """
+
+    __slots__ = ("now",)
+
+    def __init__(self, start: float = 1000.0):
+        """
+        Instantiates this SimClock object at the given time.
+
+        :param start: the time, in seconds
+        """
+
+        self.now = start
+
+    def monotonic(self) -> float:
+        return self.now
+
+    def sleep(self, seconds: float):
+        self.now += max(seconds, 0.0)
+
+    @contextmanager
+    def installed(self):
+        """
+        Has the stack and the SimLink use this clock, within the context.
+        """
+
+        modules = [importlib.import_module(name) for name in CLOCK_USERS] + [sys.modules[__name__]]
+        saved = [(module, module.monotonic) for module in modules]
+        saved_sleep = modules[-1].sleep
+        for module in modules:
+            module.monotonic = self.monotonic
+        modules[-1].sleep = self.sleep
+        try:
+            yield self
+        finally:
+            for module, clock in saved:
+                module.monotonic = clock
+            modules[-1].sleep = saved_sleep
+
+
+class Channel:
+    """
+    This class represents one direction of a simulated link. Pkts are serialized at the link's bandwidth behind the
+    ones still queued, then travel for half the RTT. On the way, they may be dropped because the bottleneck buffer
+    is full (tail drop) or at random. They may also be duplicated, or held back so they arrive after later pkts.
+    """
+
+    __slots__ = (
+        "bandwidth", "delay", "loss", "reorder", "duplicate", "buffer", "rng", "free_at", "queue", "order", "stats"
+    )
+
+    def __init__(
+        self, bandwidth: float, delay: float, loss: float, reorder: float, duplicate: float, buffer: int, rng
+    ):
+        """
+        Instantiates this Channel object with the given characteristics.
+
+        :param bandwidth: bytes per second, None for no limit
+        :param delay: the one-way delay in seconds
+        :param loss: the probability of losing a pkt
+        :param reorder: the probability of holding a pkt back
+        :param duplicate: the probability of delivering a pkt twice
+        :param buffer: the bytes the bottleneck queue holds, None for no limit
+        :param rng: the random.Random generator drawing the losses, reorderings and duplicates
+        """
+
+        self.bandwidth = bandwidth
+        self.delay = delay
+        self.loss = loss
+        self.reorder = reorder
+        self.duplicate = duplicate
+        self.buffer = buffer
+        self.rng = rng
+        self.free_at = 0.0  # when the bottleneck is done serializing the queued pkts
+        self.queue = []  # heap of (arrival time, order, pkt)
+        self.order = count()  # pkts arriving at the same time keep their sending order
+        self.stats = dict.fromkeys(("sent", "delivered", "dropped", "lost", "reordered", "duplicated"), 0)
+
+    def send(self, pkt: bytes, now: float):
+        """
+        Puts a pkt on the link.
+
+        :param pkt: the raw IP pkt
+        :param now: the sending time
+        """
+
+        self.stats["sent"] += 1
+        start = max(now, self.free_at)
+        if self.bandwidth is not None:
+            if self.buffer is not None and (start - now) * self.bandwidth + len(pkt) > self.buffer:
+                self.stats["dropped"] += 1
+                return
+            self.free_at = start + len(pkt) / self.bandwidth
+        else:
+            self.free_at = start
+        if self.rng.random() < self.loss:
+            self.stats["lost"] += 1
+            return
+        arrival = self.free_at + self.delay
+        if self.rng.random() < self.reorder:
+            self.stats["reordered"] += 1
+            arrival += self.rng.random() * max(self.delay, MIN_REORDER_DELAY)
+        heapq.heappush(self.queue, (arrival, next(self.order), pkt))
+        if self.rng.random() < self.duplicate:
+            self.stats["duplicated"] += 1
+            heapq.heappush(self.queue, (arrival, next(self.order), pkt))
+
+    def next_arrival(self) -> float or None:
+        """
+        Returns when the next pkt arrives.
+
+        :return: the arrival time, None if nothing is on the way
+        """
+
+        return self.queue[0][0] if self.queue else None
+
+    def pop(self) -> bytes:
+        """
+        Takes the next pkt off the link.
+
+        :return: the raw IP pkt
+        """
+
+        self.stats["delivered"] += 1
+        return heapq.heappop(self.queue)[2]
+
+
+class SimEndpoint:
+    """
+    This class represents a connection's end of a SimLink, standing in for its receive socket, RecvRing and Sender,
+    or the end a packet_engine.PacketEngine shares among its connections.
+    """
+
+    __slots__ = ("link", "inbox", "reader")
+
+    def __init__(self, link):
+        """
+        Instantiates this SimEndpoint object on the given link.
+
+        :param link: the SimLink
+        """
+
+        self.link = link
+        self.inbox = deque()  # pkts delivered but not received yet
+        self.reader = None  # called from the event loop when pkts are delivered, see SimLink.add_reader()
+
+    def __len__(self) -> int:
+        """
+        Returns the number of pkts delivered but not received yet.
+
+        :return: the number of pkts
+        """
+
+        return len(self.inbox)
+
+    def send(self, bufs: list):
+        """
+        Puts a pkt on the link.
+
+        :param bufs: the pkt's bytes-like parts, in order
+        """
+
+        self.link.up.send(b"".join(bufs), monotonic())
+        self.link.schedule()
+
+    def recv(self, timeout: float) -> bytes:
+        """
+        Returns the next pkt, running the network until one is delivered.
+
+        :param timeout: how long to wait, in seconds
+        :return: the raw IP pkt
+        :raise TimeoutError: if no pkt arrives in time
+        :raise BlockingIOError: if the timeout is 0 and no pkt is delivered yet
+        """
+
+        deadline = monotonic() + timeout
+        while True:
+            now = monotonic()
+            self.link.run(now)
+            if self.inbox:
+                return self.inbox.popleft()
+            if timeout == 0:
+                raise BlockingIOError
+            if now >= deadline:
+                raise TimeoutError
+            next_event = self.link.next_event()
+            sleep(min(deadline, next_event if next_event is not None else deadline) - now)
+
+
+class SimLink:
+    """
+    This class represents an in-memory network between TCPSockets and a simulated server, such as
+    sim_peer.ScriptedServer. It stands in for raw sockets (the link argument of TCPSocket), so the whole stack runs
+    without privileges or a network, on a link of known bandwidth, RTT, loss, reordering and duplication.
+
+    The network runs in the calling thread: it advances whenever a connection waits for a pkt or, for connections
+    run by asyncio (see add_reader()), from event loop timers. Time is real, so the stack's timers behave as on a
+    real link, unless a SimClock is installed. The random decisions come from a seeded generator, so a run with the
+    same settings sees the same sequence of them, and on a SimClock the same run altogether.
+    """
+
+    def __init__(
+        self,
+        server,
+        bandwidth: float = None,
+        rtt: float = 0.0,
+        loss: float = 0.0,
+        reorder: float = 0.0,
+        duplicate: float = 0.0,
+        buffer: int = None,
+        seed: int = 0,
+    ):
+        """
+        Instantiates this SimLink object to the given server and link characteristics, the same in both directions.
+
+        :param server: the simulated server: receive(raw_pkt, now), next_timer() and on_timer(now)
+        :param bandwidth: bytes per second, None for no limit
+        :param rtt: the round-trip time in seconds
+        :param loss: the probability of losing a pkt
+        :param reorder: the probability of holding a pkt back
+        :param duplicate: the probability of delivering a pkt twice
+        :param buffer: the bytes the bottleneck queue holds, None for no limit
+        :param seed: the seed of the random generator
+        """
+
+        rng = random.Random(seed)
+        self.up = Channel(bandwidth, rtt / 2, loss, reorder, duplicate, buffer, rng)  # to the server
+        self.down = Channel(bandwidth, rtt / 2, loss, reorder, duplicate, buffer, rng)  # to us
+        self.server = server
+        server.attach(self)
+        self.endpoints = {}  # our port -> SimEndpoint
+        self.shared = None  # the SimEndpoint of a PacketEngine, getting the pkts of ports without their own
+        self.next_port = FIRST_PORT
+        self.loop = None  # the event loop running the network, once an endpoint is watched
+        self.timer = None  # handle of the loop timer of the next event
+
+    def resolve(self, host: str) -> str:
+        """
+        Returns the server's address, whatever the host.
+
+        :param host: the host name or address
+        :return: the address (dotted quad)
+        """
+
+        return SERVER_HOST
+
+    def local_addr(self, dst_host: str) -> str:
+        """
+        Returns our address.
+
+        :param dst_host: the destination address, ignored
+        :return: the address (dotted quad)
+        """
+
+        return CLIENT_HOST
+
+    def pick_port(self) -> int:
+        """
+        Returns a local port no other connection on this link uses.
+
+        :return: the port
+        """
+
+        while self.next_port in self.endpoints:
+            self.next_port += 1
+        self.next_port += 1
+        return self.next_port - 1
+
+    def release_port(self, port: int):
+        """
+        Does nothing, a port is free again once its endpoint is closed.
+
+        :param port: the port
+        """
+
+    def open(self, connection, kernel_filter: bool = True):
+        """
+        Opens the endpoint of a connection.
+
+        :param connection: the TCPSocket
+        :param kernel_filter: ignored, the link only delivers the connection's own pkts
+        """
+
+        endpoint = self.endpoints[connection.src_port] = SimEndpoint(self)
+        connection.recv_sock = connection.recv_ring = connection.sender = endpoint
+
+    def open_engine(self, engine):
+        """
+        Opens the endpoint a PacketEngine shares among its connections.
+
+        :param engine: the PacketEngine
+        """
+
+        self.shared = SimEndpoint(self)
+        engine.recv_sock = engine.send_sock = engine.recv_ring = self.shared
+
+    def open_shared(self, connection, engine):
+        """
+        Has a connection send through the endpoint of a PacketEngine, which receives for it.
+
+        :param connection: the AsyncTCPSocket
+        :param engine: the PacketEngine
+        """
+
+        connection.send_sock = connection.sender = engine.send_sock
+
+    def close_engine(self, engine):
+        """
+        Closes the endpoint of a PacketEngine.
+
+        :param engine: the PacketEngine
+        """
+
+        self.shared = None
+
+    def watched(self) -> list:
+        """
+        Returns the endpoints an event loop watches.
+
+        :return: the SimEndpoints
+        """
+
+        endpoints = list(self.endpoints.values()) + ([self.shared] if self.shared is not None else [])
+        return [endpoint for endpoint in endpoints if endpoint.reader is not None]
+
+    def add_reader(self, loop, endpoint: SimEndpoint, callback):
+        """
+        Has an event loop call back whenever pkts are delivered to an endpoint. The network then runs from loop
+        timers, at the time of each event.
+
+        :param loop: the event loop
+        :param endpoint: the SimEndpoint, i.e. the recv_sock of the connection or PacketEngine
+        :param callback: called without arguments
+        """
+
+        if loop is not self.loop:  # a timer armed on another loop never fires on this one
+            self.loop = loop
+            self.timer = None
+        endpoint.reader = callback
+        self.schedule()
+
+    def remove_reader(self, loop, endpoint: SimEndpoint):
+        """
+        Stops watching an endpoint, see add_reader().
+
+        :param loop: the event loop
+        :param endpoint: the SimEndpoint
+        """
+
+        endpoint.reader = None
+
+    def close(self, connection):
+        """
+        Closes the endpoint of a connection.
+
+        :param connection: the TCPSocket
+        """
+
+        self.endpoints.pop(connection.src_port, None)
+
+    def next_event(self) -> float or None:
+        """
+        Returns when the next pkt arrives or the next server timer fires.
+
+        :return: the time, None if nothing is pending
+        """
+
+        times = (self.up.next_arrival(), self.down.next_arrival(), self.server.next_timer())
+        return min((t for t in times if t is not None), default=None)
+
+    def schedule(self):
+        """
+        Arms the loop timer for the next event, or for right away if a watched endpoint has pkts waiting. Does
+        nothing unless an event loop runs the network.
+        """
+
+        if self.loop is None or self.loop.is_closed():
+            return
+        if any(endpoint.inbox for endpoint in self.watched()):
+            when = self.loop.time()
+        else:
+            when = self.next_event()
+        if when is None or self.timer is not None and self.timer.when() <= when:  # the armed timer comes first
+            return
+        if self.timer is not None:
+            self.timer.cancel()
+        self.timer = self.loop.call_at(when, self.on_timer)  # the default loop clock is time.monotonic()
+
+    def on_timer(self):
+        """
+        Runs the network up to now and calls back the watched endpoints that got pkts, called by the event loop.
+        """
+
+        self.timer = None
+        self.run(monotonic())
+        for endpoint in self.watched():
+            if endpoint.reader is not None and endpoint.inbox:  # not stopped by an earlier reader
+                endpoint.reader()
+        self.schedule()
+
+    def run(self, now: float):
+        """
+        Delivers the pkts and fires the server timers due by now, in time order.
+
+        :param now: the current time
+        """
+
+        while True:
+            up, down, timer = self.up.next_arrival(), self.down.next_arrival(), self.server.next_timer()
+            times = [t for t in (up, down, timer) if t is not None]
+            if not times or min(times) > now:
+                return
+            first = min(times)
+            if first == up:
+                self.server.receive(self.up.pop(), up)
+            elif first == down:
+                raw_pkt = self.down.pop()
+                key = flow_key(raw_pkt)
+                endpoint = self.endpoints.get(key[3], self.shared) if key else None
+                if endpoint is not None:  # else the connection is gone
+                    endpoint.inbox.append(raw_pkt)
+            else:
+                self.server.on_timer(timer)
+
+    @property
+    def stats(self) -> dict:
+        return {"up": dict(self.up.stats), "down": dict(self.down.stats)}
@@ -0,0 +1,318 @@
+import re
+from random import Random
+from zlib import crc32
+from ip_pkt import IPPacket
+from tcp_pkt import TCPPacket, TCPOptions, HeaderTemplate, SEQ_SPACE, FIN, SYN, ACK
+from socket_filter import flow_key
+
+PEER_MSS = 1460  # largest segment the peer sends
+PEER_WINDOW = 1 << 20  # bytes the peer keeps in flight at most
+PEER_RECV_WINDOW = 65535  # the peer only receives requests
+CHUNK_SIZE = 8192  # body bytes per chunk with the chunked encoding
+INITIAL_RTO = 1.0  # seconds, until the handshake gives an RTT sample
+MIN_RTO = 0.05  # seconds
+MAX_RTO = 4.0  # seconds
+DUP_ACK_THRESHOLD = 3
+RANGE = re.compile(r"bytes=(\d+)-(\d*)")
+
+
+class ScriptedServer:
+    """
+    This class represents a tiny HTTP server with a TCP stack of its own, to put at the far end of a SimLink.
+
+    It serves GET requests for a fixed set of paths from memory: with a Content-Length or the chunked encoding, an
+    ETag, and byte ranges. Connections stay open for more requests unless the client asks to close them. It sends
+    with a fixed window. On a timeout it retransmits from the oldest unacknowledged byte; after three duplicate ACKs,
+    it retransmits the oldest segment. It accepts the MSS and window scale options and declines the others, and
+    drops out-of-order request bytes. Closed connections are kept, so a retransmitted FIN still gets its ACK.
+    """
+
+    def __init__(self, files: dict, chunked: bool = False, mss: int = PEER_MSS, window: int = PEER_WINDOW, seed=0):
+        """
+        Instantiates this ScriptedServer object to the given files.
+
+        :param files: path -> body bytes
+        :param chunked: whether to send bodies with the chunked encoding instead of a Content-Length
+        :param mss: the largest segment to send
+        :param window: the bytes to keep in flight at most
+        :param seed: the seed of the initial sequence numbers
+        """
+
+        self.files = files
+        self.chunked = chunked
+        self.mss = mss
+        self.window = window
+        self.rng = Random(seed)
+        self.link = None  # set by attach()
+        self.connections = {}  # client port -> PeerConnection
+
+    def attach(self, link):
+        """
+        Connects the server to a link, which it sends its pkts on.
+
+        :param link: the SimLink
+        """
+
+        self.link = link
+
+    def receive(self, raw_pkt: bytes, now: float):
+        """
+        Handles a pkt from a client.
+
+        :param raw_pkt: the raw IP pkt
+        :param now: the arrival time
+        """
+
+        ip_pkt = IPPacket.unpack(raw_pkt)
+        tcp_pkt = TCPPacket.unpack(ip_pkt, ip_pkt.data) if ip_pkt else None
+        if tcp_pkt is None:  # corrupted
+            return
+        port = flow_key(raw_pkt)[2]
+        connection = self.connections.get(port)
+        if tcp_pkt.syn and not tcp_pkt.ack:
+            if connection is None or connection.rcv_nxt != (tcp_pkt.seq_num + 1) % SEQ_SPACE:  # not a retransmission
+                connection = self.connections[port] = PeerConnection(self, tcp_pkt.src_host, port, tcp_pkt)
+            connection.send_syn_ack(now)
+            return
+        if connection is None:
+            return
+        if tcp_pkt.rst:
+            del self.connections[port]
+        else:
+            connection.receive(tcp_pkt, now)
+
+    def next_timer(self) -> float or None:
+        """
+        Returns when the next retransmission timer fires.
+
+        :return: the time, None if no timer is running
+        """
+
+        deadlines = [c.deadline for c in self.connections.values() if c.deadline is not None]
+        return min(deadlines) if deadlines else None
+
+    def on_timer(self, now: float):
+        """
+        Fires the retransmission timers due by now.
+
+        :param now: the current time
+        """
+
+        for connection in list(self.connections.values()):
+            if connection.deadline is not None and connection.deadline <= now:
+                connection.on_timeout(now)
+
+    def respond(self, request: bytes) -> tuple:
+        """
+        Returns the response to an HTTP request.
+
+        :param request: the request, up to the blank line ending its headers
+        :return: the response and whether to close the connection after it
+        """
+
+        lines = request.decode("latin-1").split("\r\n")
+        method, path, version = (lines[0].split() + ["", "", ""])[:3]
+        headers = {}
+        for line in lines[1:]:
+            name, _, value = line.partition(":")
+            headers[name.strip().lower()] = value.strip()
+        connection = headers.get("connection", "").lower()
+        close = connection != "keep-alive" if version == "HTTP/1.0" else connection == "close"
+        body = self.files.get(path)
+        if method != "GET" or body is None:
+            return b"HTTP/1.1 404 Not Found\r\nContent-Length: 0\r\n\r\n", close
+        etag = '"%08x"' % crc32(body)
+        status = "200 OK"
+        fields = ["ETag: " + etag]
+        match = RANGE.fullmatch(headers.get("range", ""))
+        if match and headers.get("if-range", etag) == etag and int(match[1]) < len(body):
+            first = int(match[1])
+            last = min(int(match[2]), len(body) - 1) if match[2] else len(body) - 1
+            status = "206 Partial Content"
+            fields.append("Content-Range: bytes %d-%d/%d" % (first, last, len(body)))
+            body = body[first:last + 1]
+        if self.chunked:
+            fields.append("Transfer-Encoding: chunked")
+            body = b"".join(
+                b"%x\r\n" % len(body[i:i + CHUNK_SIZE]) + body[i:i + CHUNK_SIZE] + b"\r\n"
+                for i in range(0, len(body), CHUNK_SIZE)
+            ) + b"0\r\n\r\n"
+        else:
+            fields.append("Content-Length: %d" % len(body))
+        head = "HTTP/1.1 " + status + "\r\n" + "".join(field + "\r\n" for field in fields) + "\r\n"
+        return head.encode() + body, close
+
+
+class PeerConnection:
+    """
+    This class represents a connection of the ScriptedServer.
+    """
+
+    __slots__ = (
+        "server", "template", "isn", "base", "out", "sent", "rcv_nxt", "mss", "wscale", "offered_wscale", "rwnd",
+        "request", "closing", "fin_sent", "fin_acked", "client_fin", "established", "syn_sent_at", "rto", "deadline",
+        "dup_acks", "measured_rto",
+    )
+
+    def __init__(self, server: ScriptedServer, client_host: str, client_port: int, syn_pkt):
+        """
+        Instantiates this PeerConnection object from the client's SYN.
+
+        :param server: the ScriptedServer
+        :param client_host: the client's address
+        :param client_port: the client's port
+        :param syn_pkt: the client's SYN
+        """
+
+        options = TCPOptions.unpack(syn_pkt.options)
+        self.server = server
+        self.template = HeaderTemplate(syn_pkt.dst_host, syn_pkt.dst_port, client_host, client_port)
+        self.isn = server.rng.randrange(SEQ_SPACE)
+        self.base = (self.isn + 1) % SEQ_SPACE  # seq_num of out[0]
+        self.out = bytearray()  # response bytes not acknowledged yet
+        self.sent = 0  # bytes of out sent since the last timeout
+        self.rcv_nxt = (syn_pkt.seq_num + 1) % SEQ_SPACE
+        self.mss = min(server.mss, options.mss or 536)
+        self.offered_wscale = options.window_scale is not None
+        self.wscale = options.window_scale or 0  # shift count of the client's window
+        self.rwnd = syn_pkt.adv_wnd
+        self.request = bytearray()
+        self.closing = False  # the FIN goes out after the queued bytes
+        self.fin_sent = False  # the FIN is sent but not acknowledged
+        self.fin_acked = False
+        self.client_fin = False
+        self.established = False
+        self.syn_sent_at = None
+        self.rto = INITIAL_RTO
+        self.measured_rto = INITIAL_RTO  # the RTO before any backoff
+        self.deadline = None  # when the retransmission timer fires
+        self.dup_acks = 0
+
+    def emit(self, seq_num: int, flags: int, payload: bytes, now: float, options: bytes = b""):
+        """
+        Puts a pkt on the link.
+
+        :param seq_num: the sequence number
+        :param flags: the TCP flags
+        :param payload: the payload
+        :param now: the sending time
+        :param options: the encoded options
+        """
+
+        header = self.template.stamp(seq_num % SEQ_SPACE, self.rcv_nxt, PEER_RECV_WINDOW, flags, payload, None, options)
+        self.server.link.down.send(bytes(header) + options + payload, now)
+
+    def send_syn_ack(self, now: float):
+        """
+        Sends (or re-sends) the SYN-ACK.
+
+        :param now: the sending time
+        """
+
+        options = TCPOptions(mss=self.mss, window_scale=0 if self.offered_wscale else None).pack()
+        self.emit(self.isn, SYN | ACK, b"", now, options)
+        self.syn_sent_at = now
+        self.deadline = now + self.rto
+
+    def receive(self, tcp_pkt, now: float):
+        """
+        Handles a pkt of the connection.
+
+        :param tcp_pkt: the TCP pkt
+        :param now: the arrival time
+        """
+
+        if tcp_pkt.ack:
+            self.on_ack(tcp_pkt, now)
+        payload = tcp_pkt.payload
+        if not self.established or not (payload or tcp_pkt.fin):
+            return
+        if tcp_pkt.seq_num == self.rcv_nxt:
+            self.rcv_nxt = (self.rcv_nxt + len(payload)) % SEQ_SPACE
+            self.request += payload
+            if tcp_pkt.fin and not self.client_fin:
+                self.rcv_nxt = (self.rcv_nxt + 1) % SEQ_SPACE
+                self.client_fin = self.closing = True
+            while not self.closing and b"\r\n\r\n" in self.request:
+                request, _, rest = bytes(self.request).partition(b"\r\n\r\n")
+                self.request = bytearray(rest)
+                response, self.closing = self.server.respond(request)
+                self.out += response
+        sent = self.transmit(now)
+        if not sent:  # nothing to piggyback the ACK on
+            self.emit(self.base + self.sent + self.fin_sent, ACK, b"", now)
+
+    def on_ack(self, tcp_pkt, now: float):
+        """
+        Handles the ACK and window of a pkt.
+
+        :param tcp_pkt: the TCP pkt
+        :param now: the arrival time
+        """
+
+        if not self.established:
+            if tcp_pkt.ack_num != self.base:
+                return
+            self.established = True
+            self.measured_rto = min(max(3 * (now - self.syn_sent_at), MIN_RTO), MAX_RTO)
+            self.deadline = None
+        self.rwnd = tcp_pkt.adv_wnd << self.wscale
+        acked = (tcp_pkt.ack_num - self.base) % SEQ_SPACE
+        if acked > len(self.out) + self.fin_sent:  # acknowledges bytes never sent
+            return
+        if acked:
+            data_acked = min(acked, len(self.out))
+            if acked > data_acked:  # our FIN is acknowledged
+                self.fin_sent = False
+                self.fin_acked = True
+            del self.out[:data_acked]
+            self.base = (self.base + acked) % SEQ_SPACE
+            self.sent = max(self.sent - data_acked, 0)
+            self.dup_acks = 0
+            self.rto = self.measured_rto  # undo the backoff
+            self.deadline = now + self.rto if self.sent or self.fin_sent else None
+        elif self.sent and not tcp_pkt.payload and not tcp_pkt.fin:
+            self.dup_acks += 1
+            if self.dup_acks == DUP_ACK_THRESHOLD:  # fast retransmit
+                self.emit(self.base, ACK, bytes(self.out[:self.mss]), now)
+        self.transmit(now)
+
+    def transmit(self, now: float) -> bool:
+        """
+        Sends as many new segments as the window allows, then the FIN once everything else is sent.
+
+        :param now: the sending time
+        :return: True if anything was sent, False otherwise
+        """
+
+        sent = False
+        window = min(self.server.window, self.rwnd)
+        while self.sent < len(self.out) and self.sent < window:
+            segment = bytes(self.out[self.sent:self.sent + min(self.mss, window - self.sent)])
+            self.emit(self.base + self.sent, ACK, segment, now)
+            self.sent += len(segment)
+            sent = True
+        if self.closing and self.sent == len(self.out) and not (self.fin_sent or self.fin_acked):
+            self.emit(self.base + self.sent, FIN | ACK, b"", now)
+            self.fin_sent = sent = True
+        if sent and self.deadline is None:
+            self.deadline = now + self.rto
+        return sent
+
+    def on_timeout(self, now: float):
+        """
+        Retransmits after the retransmission timer fired: the SYN-ACK, or everything from the oldest unacknowledged
+        byte on (go-back-N).
+
+        :param now: the current time
+        """
+
+        self.rto = min(self.rto * 2, MAX_RTO)
+        self.deadline = None
+        if not self.established:
+            self.send_syn_ack(now)
+            return
+        self.sent = 0
+        self.fin_sent = False
+        self.dup_acks = 0
+        self.transmit(now)
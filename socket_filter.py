@@ -0,0 +1,119 @@
+import ctypes
+import socket
+import struct
+from ip_pkt import MAX_PACKET_SIZE
+
+SO_ATTACH_FILTER = getattr(socket, "SO_ATTACH_FILTER", 26)  # Linux value, not exported by every Python build
+BPF_INSN = struct.Struct("HBBI")  # struct sock_filter: code, jt, jf, k
+BPF_FPROG = struct.Struct("HP")  # struct sock_fprog: len, filter pointer
+ADDRS = struct.Struct("!II")  # IP source and destination addresses
+PORTS = struct.Struct("!HH")  # TCP source and destination ports
+
+# classic BPF opcodes, see linux/filter.h
+BPF_LD, BPF_LDX, BPF_JMP, BPF_RET = 0x00, 0x01, 0x05, 0x06
+BPF_W, BPF_H, BPF_B = 0x00, 0x08, 0x10
+BPF_ABS, BPF_IND, BPF_MSH = 0x20, 0x40, 0xA0
+BPF_JEQ, BPF_JSET, BPF_K = 0x10, 0x40, 0x00
+
+
+def flow_program(src_host: str, src_port: int, dst_host: str, dst_port: int) -> list:
+    """
+    Returns a classic BPF program for a raw IPPROTO_TCP socket that only accepts the TCP pkts the server sends to us,
+    i.e. from dst_host:dst_port to src_host:src_port. The program sees the pkt from its IP header on.
+
+    :param src_host: our address
+    :param src_port: our port
+    :param dst_host: the server's address
+    :param dst_port: the server's port
+    :return: the (code, jt, jf, k) instructions
+    """
+
+    server, us = ADDRS.unpack(socket.inet_aton(dst_host) + socket.inet_aton(src_host))
+    ports = dst_port << 16 | src_port
+    return [
+        (BPF_LD | BPF_B | BPF_ABS, 0, 0, 9),  # 0: IP protocol
+        (BPF_JMP | BPF_JEQ | BPF_K, 0, 10, socket.IPPROTO_TCP),  # 1: else drop
+        (BPF_LD | BPF_W | BPF_ABS, 0, 0, 12),  # 2: IP source address
+        (BPF_JMP | BPF_JEQ | BPF_K, 0, 8, server),  # 3: else drop
+        (BPF_LD | BPF_W | BPF_ABS, 0, 0, 16),  # 4: IP destination address
+        (BPF_JMP | BPF_JEQ | BPF_K, 0, 6, us),  # 5: else drop
+        (BPF_LD | BPF_H | BPF_ABS, 0, 0, 6),  # 6: fragment offset
+        (BPF_JMP | BPF_JSET | BPF_K, 4, 0, 0x1FFF),  # 7: drop later fragments, they have no TCP header
+        (BPF_LDX | BPF_B | BPF_MSH, 0, 0, 0),  # 8: X = IP header length
+        (BPF_LD | BPF_W | BPF_IND, 0, 0, 0),  # 9: TCP source and destination ports
+        (BPF_JMP | BPF_JEQ | BPF_K, 0, 1, ports),  # 10: else drop
+        (BPF_RET | BPF_K, 0, 0, MAX_PACKET_SIZE),  # 11: accept the whole pkt
+        (BPF_RET | BPF_K, 0, 0, 0),  # 12: drop
+    ]
+
+
+def attach_filter(sock: socket.socket, program: list):
+    """
+    Attaches a classic BPF program to a socket (SO_ATTACH_FILTER, Linux only), then discards the pkts that were
+    queued before it took effect.
+
+    :param sock: the socket
+    :param program: the (code, jt, jf, k) instructions
+    :raise OSError: if the platform or the kernel doesn't support socket filters
+    """
+
+    filters = ctypes.create_string_buffer(b"".join(BPF_INSN.pack(*insn) for insn in program))
+    sock.setsockopt(socket.SOL_SOCKET, SO_ATTACH_FILTER, BPF_FPROG.pack(len(program), ctypes.addressof(filters)))
+    timeout = sock.gettimeout()
+    sock.settimeout(0)
+    try:
+        while True:
+            sock.recv(1)
+    except BlockingIOError:
+        pass
+    finally:
+        sock.settimeout(timeout)
+
+
+def flow_key(raw_pkt) -> tuple or None:
+    """
+    Returns the addresses and ports of a raw TCP/IP pkt, read straight from the buffer without parsing it.
+
+    :param raw_pkt: the raw IP pkt
+    :return: the (source address, destination address, source port, destination port) tuple, addresses as
+    integers, or None if the pkt is too short or not TCP
+    """
+
+    if len(raw_pkt) < 40 or raw_pkt[9] != socket.IPPROTO_TCP:
+        return None
+    header_length = (raw_pkt[0] & 0x0F) * 4
+    if len(raw_pkt) < header_length + PORTS.size:
+        return None
+    return ADDRS.unpack_from(raw_pkt, 12) + PORTS.unpack_from(raw_pkt, header_length)
+
+
+class FlowFilter:
+    """
+    This class represents the user-space version of flow_program(): it checks the addresses and ports of a raw pkt
+    straight from the receive buffer, so pkts of other flows are dropped before any parsing or checksum work. It
+    also covers platforms where the kernel filter can't be attached.
+    """
+
+    __slots__ = ("key",)
+
+    def __init__(self, src_host: str, src_port: int, dst_host: str, dst_port: int):
+        """
+        Instantiates this FlowFilter object to the given connection.
+
+        :param src_host: our address
+        :param src_port: our port
+        :param dst_host: the server's address
+        :param dst_port: the server's port
+        """
+
+        self.key = ADDRS.unpack(socket.inet_aton(dst_host) + socket.inet_aton(src_host)) + (dst_port, src_port)
+
+    def matches(self, raw_pkt) -> bool:
+        """
+        Checks if a raw IP pkt belongs to the connection.
+
+        :param raw_pkt: the raw IP pkt
+        :return: True if it comes from the server's address and port to ours, False otherwise
+        """
+
+        return flow_key(raw_pkt) == self.key
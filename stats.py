@@ -0,0 +1,212 @@
+import json
+from time import monotonic, perf_counter
+
+RTT_BUCKETS = 16  # powers of two of milliseconds, the last one takes everything above 16 s
+CWND_SAMPLE_INTERVAL = 0.01  # seconds between two cwnd samples while it grows, decreases are always recorded
+MAX_CWND_SAMPLES = 10000  # about 100 s of growth, the timeline stops there
+COUNTERS = (
+    "bytes_in", "bytes_out", "segments_in", "segments_out", "retransmits", "timeouts", "dup_acks", "out_of_order",
+    "duplicates", "out_of_window", "filtered_flow", "filtered_checksum", "recv_time", "send_time", "parse_time",
+)
+
+
+class Histogram:
+    """
+    This class represents a histogram of durations in milliseconds, with power-of-two buckets: the first one counts
+    the values below 1 ms, the next one those below 2 ms, then 4 ms and so on.
+    """
+
+    __slots__ = ("buckets", "count", "total", "min", "max")
+
+    def __init__(self):
+        """
+        Instantiates this Histogram object, empty.
+        """
+
+        self.buckets = [0] * RTT_BUCKETS
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+
+    def add(self, value: float):
+        """
+        Counts a value.
+
+        :param value: the value in milliseconds
+        """
+
+        self.buckets[min(int(value).bit_length(), RTT_BUCKETS - 1)] += 1
+        self.count += 1
+        self.total += value
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+
+    def to_dict(self) -> dict:
+        """
+        Returns the histogram as a JSON-serializable dict, leaving out the empty buckets.
+
+        :return: the dict
+        """
+
+        labels = ["<%d" % (1 << i) for i in range(RTT_BUCKETS - 1)] + [">=%d" % (1 << RTT_BUCKETS - 2)]
+        return {
+            "count": self.count,
+            "mean": self.total / self.count if self.count else None,
+            "min": self.min,
+            "max": self.max,
+            "buckets": {label: n for label, n in zip(labels, self.buckets) if n},
+        }
+
+
+class ConnectionStats:
+    """
+    This class represents the counters of a TCPSocket, kept only if the connection was created with stats=True:
+    bytes and segments in each direction, retransmissions, duplicate ACKs, out-of-order, duplicate and out-of-window
+    segments, pkts dropped by the flow filter or for a bad checksum, RTT samples, the cwnd over time, and the time
+    spent waiting in the receive and send calls versus parsing pkts. Byte counts are payload bytes.
+    """
+
+    __slots__ = ("start",) + COUNTERS + ("rtt", "cwnd", "last_cwnd")
+
+    def __init__(self):
+        """
+        Instantiates this ConnectionStats object, all counters at 0.
+        """
+
+        self.start = monotonic()
+        self.bytes_in = 0  # payload bytes received, duplicates included
+        self.bytes_out = 0  # payload bytes sent, retransmissions included
+        self.segments_in = 0  # pkts of the connection that parsed
+        self.segments_out = 0  # pkts sent, pure ACKs included
+        self.retransmits = 0
+        self.timeouts = 0  # retransmission timer expiries
+        self.dup_acks = 0
+        self.out_of_order = 0  # segments that arrived ahead of a gap
+        self.duplicates = 0  # segments carrying only bytes received before
+        self.out_of_window = 0  # segments past the advertised window
+        self.filtered_flow = 0  # other flows' pkts, dropped before parsing
+        self.filtered_checksum = 0  # corrupted or non-TCP pkts
+        self.recv_time = 0.0  # seconds in the receive calls, waiting for the network included
+        self.send_time = 0.0  # seconds in the send calls
+        self.parse_time = 0.0  # seconds checking and parsing received pkts
+        self.rtt = Histogram()
+        self.cwnd = []  # (seconds since the start, cwnd in bytes)
+        self.last_cwnd = None  # (time, cwnd) of the latest sample
+
+    def sample_cwnd(self, cwnd: int):
+        """
+        Records the cwnd, at most every CWND_SAMPLE_INTERVAL while it grows, and every time it shrinks.
+
+        :param cwnd: the congestion window in bytes
+        """
+
+        now = monotonic()
+        last = self.last_cwnd
+        if last is not None and (cwnd == last[1] or cwnd > last[1] and now - last[0] < CWND_SAMPLE_INTERVAL):
+            return
+        if len(self.cwnd) < MAX_CWND_SAMPLES:
+            self.cwnd.append((round(now - self.start, 6), cwnd))
+        self.last_cwnd = now, cwnd
+
+    def to_dict(self) -> dict:
+        """
+        Returns the counters as a JSON-serializable dict.
+
+        :return: the dict
+        """
+
+        counters = {name: getattr(self, name) for name in COUNTERS}
+        counters["duration"] = monotonic() - self.start
+        counters["rtt"] = self.rtt.to_dict()
+        counters["cwnd"] = self.cwnd
+        return counters
+
+    def dump(self, file_name: str, **info):
+        """
+        Writes the counters as JSON.
+
+        :param file_name: the file to write, - for stdout
+        :param info: more fields to write along, e.g. the URL
+        """
+
+        report = dict(info, **self.to_dict())
+        if file_name == "-":
+            print(json.dumps(report, indent=2))
+            return
+        with open(file_name, "w") as fd:
+            json.dump(report, fd, indent=2)
+            fd.write("\n")
+
+
+class TimedRing:
+    """
+    This class represents a connection's recv_ring seen through its stats: it adds the time spent in recv() to
+    recv_time.
+    """
+
+    __slots__ = ("ring", "stats")
+
+    def __init__(self, ring, stats: ConnectionStats):
+        """
+        Instantiates this TimedRing object around the given ring.
+
+        :param ring: the recv_ring
+        :param stats: the connection's ConnectionStats
+        """
+
+        self.ring = ring
+        self.stats = stats
+
+    def __len__(self) -> int:
+        return len(self.ring)
+
+    def recv(self, timeout: float):
+        """
+        Returns the next pkt from the ring, see batch_io.RecvRing.recv().
+
+        :param timeout: how long to wait, in seconds
+        :return: the raw IP pkt
+        """
+
+        start = perf_counter()
+        try:
+            return self.ring.recv(timeout)
+        finally:
+            self.stats.recv_time += perf_counter() - start
+
+
+class TimedSender:
+    """
+    This class represents a connection's sender seen through its stats: it counts the pkts sent and adds the time
+    spent sending them to send_time.
+    """
+
+    __slots__ = ("sender", "stats")
+
+    def __init__(self, sender, stats: ConnectionStats):
+        """
+        Instantiates this TimedSender object around the given sender.
+
+        :param sender: the sender
+        :param stats: the connection's ConnectionStats
+        """
+
+        self.sender = sender
+        self.stats = stats
+
+    def send(self, bufs: list):
+        """
+        Sends a pkt, see batch_io.Sender.send().
+
+        :param bufs: the pkt's bytes-like parts, in order
+        """
+
+        self.stats.segments_out += 1
+        start = perf_counter()
+        try:
+            self.sender.send(bufs)
+        finally:
+            self.stats.send_time += perf_counter() - start
@@ -1,9 +1,27 @@
 import socket
 import struct
-from ip_pkt import IPPacket, calculate_checksum
+from ip_pkt import IPPacketView, HEADER_SIZE as IP_HEADER_SIZE, WORD
+from utils import calculate_checksum, checksum_sum
 
+HEADER_SIZE = 20  # TCP header size without options -> 20 bytes
 HEADER_FORMAT = "!HHIIBBHHH"
 PSEUDO_HEADER_FORMAT = "!4s4sBBH"
+PSEUDO_HEADER_TAIL = struct.Struct("!HH")  # reserved + protocol ID, TCP length
+PORTS = struct.Struct("!HH")
+SEQ_ACK = struct.Struct("!II")
+IP_LENGTH_ID = struct.Struct("!HH")
+OFFSET_FLAGS_WND_CSUM = struct.Struct("!BBHH")
+FIN, SYN, RST, PSH, ACK = 1, 1 << 1, 1 << 2, 1 << 3, 1 << 4  # TCP flags
+SEQ_SPACE = 2**32  # seq_nums wrap around at 32 bits
+# option kinds
+END_OF_OPTIONS = 0
+NOP = 1
+MAX_SEGMENT_SIZE = 2
+WINDOW_SCALE = 3
+SACK_PERMITTED = 4
+SACK = 5
+TIMESTAMPS = 8
+MAX_WINDOW_SCALE = 14  # RFC 7323 section 2.3
 
 
 class TCPPacket:
@@ -11,6 +29,31 @@ class TCPPacket:
     This class represents a TCP pkt.
     """
 
+    __slots__ = (
+        "src_host",
+        "src_port",
+        "dst_host",
+        "dst_port",
+        "seq_num",
+        "ack_num",
+        "data_offset",
+        "flags",
+        "fin",
+        "syn",
+        "rst",
+        "psh",
+        "ack",
+        "urg",
+        "adv_wnd",
+        "checksum",
+        "urg_ptr",
+        "packet",
+        "pseudo_header",
+        "payload",
+        "payload_sum",
+        "options",
+    )
+
     def __init__(self, src_host: str, src_port: int, dst_host: str, dst_port: int, payload: str = ""):
         """
         Instantiates a TCPPacket object to the given source address, source port, destination address, destination
@@ -43,6 +86,8 @@ class TCPPacket:
         self.packet = None
         self.pseudo_header = None
         self.payload = payload.encode()
+        self.payload_sum = None  # cached by HeaderTemplate users for retransmissions
+        self.options = b""  # encoded options, padded to a multiple of 4 bytes
 
     def set_flags(self):
         """
@@ -68,6 +113,7 @@ class TCPPacket:
         """
 
         self.set_flags()
+        self.data_offset = (HEADER_SIZE + len(self.options)) // 4 << 4
         self.packet = struct.pack(
             HEADER_FORMAT,
             self.src_port,  # source port
@@ -77,9 +123,9 @@ class TCPPacket:
             self.data_offset,  # data offset (first 4 bits of the byte, the rest is reserved)
             self.flags,  # flags
             self.adv_wnd,  # window
-            self.checksum,  # checksum
+            0,  # checksum
             self.urg_ptr,  # urgent pointer
-        )
+        ) + self.options
         self.pseudo_header = struct.pack(  # packs an IP pseudo header for calculating the checksum
             PSEUDO_HEADER_FORMAT,
             socket.inet_aton(self.src_host),  # source address
@@ -88,75 +134,316 @@ class TCPPacket:
             socket.IPPROTO_TCP,  # protocol ID
             len(self.packet) + len(self.payload),  # pkt length
         )
-        self.checksum = calculate_checksum(self.pseudo_header + self.packet + self.payload)  # calculate checksum
-        self.packet = (  # inject calculated checksum in the right spot
-            self.packet[:16]
-            + struct.pack("!H", self.checksum)
-            + self.packet[18:]
-            + self.payload
-        )
+        self.checksum = calculate_checksum(self.pseudo_header, self.packet, self.payload)  # calculate checksum
+        self.packet = bytearray(self.packet + self.payload)
+        struct.pack_into("!H", self.packet, 16, self.checksum)  # inject calculated checksum in the right spot
         return self.packet
 
     @staticmethod
-    def unpack(ip_pkt: IPPacket, raw_tcp_pkt: bytes) -> str or None:
+    def unpack(ip_pkt: IPPacketView, raw_tcp_pkt: memoryview) -> "TCPPacketView" or None:
         """
-        Decodes and parses incoming TCP packets.
+        Decodes and parses incoming TCP packets without copying them: the returned view reads its header fields lazily
+        and keeps the payload as a view of the receive buffer.
 
         :param ip_pkt: the IP pkt
         :param raw_tcp_pkt: the encoded TCP pkt
         :return: the decoded TCP pkt or None
         """
 
-        (
-            src_port,
-            dst_port,
-            seq_num,
-            ack_num,
-            _,  # don't need header length
-            flag_byte,
-            adv_wnd,
-            checksum,
-            urg,
-        ) = struct.unpack(HEADER_FORMAT, raw_tcp_pkt[:20])
-        fin = flag_byte & 1 == 1
-        syn = flag_byte & 1 << 1 == 1 << 1
-        rst = flag_byte & 1 << 2 == 1 << 2
-        psh = flag_byte & 1 << 3 == 1 << 3
-        ack = flag_byte & 1 << 4 == 1 << 4
-        urg = flag_byte & 1 << 5 == 1 << 5
-        tcp_pkt = TCPPacket(
-            src_host=ip_pkt.src,
-            src_port=src_port,
-            dst_host=ip_pkt.dst,
-            dst_port=dst_port,
+        raw_tcp_pkt = memoryview(raw_tcp_pkt)
+        if len(raw_tcp_pkt) < HEADER_SIZE:  # truncated pkt
+            return None
+        header_length = (raw_tcp_pkt[12] >> 4) * 4  # data offset is in 32-bit words, options included
+        if header_length < HEADER_SIZE or len(raw_tcp_pkt) < header_length:
+            return None
+        check_checksum = calculate_checksum(  # pseudo header + pkt, checksum included, must sum to -0
+            ip_pkt.addrs,
+            PSEUDO_HEADER_TAIL.pack(socket.IPPROTO_TCP, len(raw_tcp_pkt)),
+            raw_tcp_pkt,
         )
-        tcp_pkt.seq_num = seq_num
-        tcp_pkt.ack_num = ack_num
-        tcp_pkt.adv_wnd = adv_wnd
-        tcp_pkt.checksum = checksum
-        tcp_pkt.payload = raw_tcp_pkt[20:]
-        tcp_pkt.fin = fin
-        tcp_pkt.syn = syn
-        tcp_pkt.rst = rst
-        tcp_pkt.psh = psh
-        tcp_pkt.ack = ack
-        tcp_pkt.urg = urg
-        pseudo_header = struct.pack(
-            PSEUDO_HEADER_FORMAT,
-            socket.inet_aton(ip_pkt.src),
-            socket.inet_aton(ip_pkt.dst),
-            0,  # reserved
+        if check_checksum != 0:
+            return None
+        return TCPPacketView(ip_pkt, raw_tcp_pkt, header_length)
+
+
+def iter_options(options: memoryview):
+    """
+    Iterates over encoded TCP options, up to the end-of-options list or the first malformed option (a length below
+    2 or past the end), since the options after it can't be located.
+
+    :param options: the encoded options
+    :return: a generator of (kind, value) tuples
+    """
+
+    i = 0
+    while i < len(options):
+        kind = options[i]
+        if kind == END_OF_OPTIONS:
+            return
+        if kind == NOP:
+            i += 1
+            continue
+        if i + 1 >= len(options) or not 2 <= options[i + 1] <= len(options) - i:  # malformed or truncated option
+            return
+        length = options[i + 1]
+        yield kind, options[i + 2:i + length]
+        i += length
+
+
+class TCPOptions:
+    """
+    This class represents the TCP options this stack understands: maximum segment size, window scale, SACK-permitted,
+    SACK blocks and timestamps. Unknown options are ignored when decoding.
+    """
+
+    __slots__ = ("mss", "window_scale", "sack_permitted", "sack_blocks", "timestamps")
+
+    def __init__(
+        self,
+        mss: int = None,
+        window_scale: int = None,
+        sack_permitted: bool = False,
+        sack_blocks: list = (),
+        timestamps: tuple = None,
+    ):
+        """
+        Instantiates this TCPOptions object to the given option values; None or empty means the option is absent.
+
+        :param mss: the maximum segment size
+        :param window_scale: the window scale shift count
+        :param sack_permitted: whether SACK is permitted
+        :param sack_blocks: the (left edge, right edge) tuples of the received out-of-order blocks
+        :param timestamps: the (TSval, TSecr) tuple
+        """
+
+        self.mss = mss
+        self.window_scale = window_scale
+        self.sack_permitted = sack_permitted
+        self.sack_blocks = sack_blocks
+        self.timestamps = timestamps
+
+    def pack(self) -> bytes:
+        """
+        Encodes the options, each one aligned so the result is a multiple of 4 bytes.
+
+        :return: the encoded options
+        """
+
+        options = b""
+        if self.mss is not None:
+            options += struct.pack("!BBH", MAX_SEGMENT_SIZE, 4, self.mss)
+        if self.timestamps is not None:
+            leading = (SACK_PERMITTED, 2) if self.sack_permitted else (NOP, NOP)
+            options += struct.pack("!BBBBII", *leading, TIMESTAMPS, 10, *self.timestamps)
+        elif self.sack_permitted:
+            options += bytes((NOP, NOP, SACK_PERMITTED, 2))
+        if self.window_scale is not None:
+            options += bytes((NOP, WINDOW_SCALE, 3, self.window_scale))
+        if self.sack_blocks:
+            options += bytes((NOP, NOP, SACK, 2 + 8 * len(self.sack_blocks)))
+            options += b"".join(SEQ_ACK.pack(left, right) for left, right in self.sack_blocks)
+        return options
+
+    @staticmethod
+    def unpack(options: memoryview) -> "TCPOptions":
+        """
+        Decodes encoded options, skipping unknown and malformed ones.
+
+        :param options: the encoded options
+        :return: the decoded options
+        """
+
+        tcp_options = TCPOptions()
+        for kind, value in iter_options(options):
+            if kind == MAX_SEGMENT_SIZE and len(value) == 2:
+                tcp_options.mss = WORD.unpack_from(value)[0]
+            elif kind == WINDOW_SCALE and len(value) == 1:
+                tcp_options.window_scale = min(value[0], MAX_WINDOW_SCALE)
+            elif kind == SACK_PERMITTED and len(value) == 0:
+                tcp_options.sack_permitted = True
+            elif kind == SACK and len(value) % 8 == 0:
+                tcp_options.sack_blocks = [SEQ_ACK.unpack_from(value, i) for i in range(0, len(value), 8)]
+            elif kind == TIMESTAMPS and len(value) == 8:
+                tcp_options.timestamps = SEQ_ACK.unpack_from(value)
+        return tcp_options
+
+
+class TCPPacketView:
+    """
+    This class represents a received TCP pkt, backed by the receive buffer. Header fields are decoded on access and
+    the payload stays a view until it is reassembled.
+    """
+
+    __slots__ = ("ip_pkt", "buf", "header_length")
+
+    def __init__(self, ip_pkt: IPPacketView, buf: memoryview, header_length: int):
+        """
+        Instantiates this TCPPacketView object over the given buffer.
+
+        :param ip_pkt: the IP pkt carrying this TCP pkt
+        :param buf: the encoded TCP pkt
+        :param header_length: the header length in bytes, options included
+        """
+
+        self.ip_pkt = ip_pkt
+        self.buf = buf
+        self.header_length = header_length
+
+    @property
+    def src_host(self) -> str:
+        return self.ip_pkt.src
+
+    @property
+    def dst_host(self) -> str:
+        return self.ip_pkt.dst
+
+    @property
+    def src_port(self) -> int:
+        return PORTS.unpack_from(self.buf)[0]
+
+    @property
+    def dst_port(self) -> int:
+        return PORTS.unpack_from(self.buf)[1]
+
+    @property
+    def seq_num(self) -> int:
+        return SEQ_ACK.unpack_from(self.buf, 4)[0]
+
+    @property
+    def ack_num(self) -> int:
+        return SEQ_ACK.unpack_from(self.buf, 4)[1]
+
+    @property
+    def flags(self) -> int:
+        return self.buf[13]
+
+    @property
+    def fin(self) -> bool:
+        return self.buf[13] & 1 == 1
+
+    @property
+    def syn(self) -> bool:
+        return self.buf[13] & 1 << 1 == 1 << 1
+
+    @property
+    def rst(self) -> bool:
+        return self.buf[13] & 1 << 2 == 1 << 2
+
+    @property
+    def psh(self) -> bool:
+        return self.buf[13] & 1 << 3 == 1 << 3
+
+    @property
+    def ack(self) -> bool:
+        return self.buf[13] & 1 << 4 == 1 << 4
+
+    @property
+    def urg(self) -> bool:
+        return self.buf[13] & 1 << 5 == 1 << 5
+
+    @property
+    def adv_wnd(self) -> int:
+        return PORTS.unpack_from(self.buf, 14)[0]
+
+    @property
+    def checksum(self) -> int:
+        return PORTS.unpack_from(self.buf, 16)[0]
+
+    @property
+    def urg_ptr(self) -> int:
+        return PORTS.unpack_from(self.buf, 18)[0]
+
+    @property
+    def options(self) -> memoryview:
+        return self.buf[HEADER_SIZE:self.header_length]
+
+    @property
+    def payload(self) -> memoryview:
+        return self.buf[self.header_length:]
+
+
+class HeaderTemplate:
+    """
+    This class represents the pre-built IP + TCP header of one connection. The packed addresses, ports, fixed IP
+    fields and their partial checksums (pseudo header included) are computed once, so sending a pkt only stamps the
+    varying fields into a preallocated buffer with a few struct.pack_into calls.
+    """
+
+    __slots__ = ("header", "ip_sum", "tcp_sum", "ip_id")
+
+    def __init__(self, src_host: str, src_port: int, dst_host: str, dst_port: int):
+        """
+        Instantiates this HeaderTemplate object to the given source address, source port, destination address and
+        destination port.
+
+        :param src_host: the source address (dotted quad)
+        :param src_port: the source port
+        :param dst_host: the destination address (dotted quad)
+        :param dst_port: the destination port
+        """
+
+        addrs = socket.inet_aton(src_host) + socket.inet_aton(dst_host)
+        self.header = bytearray(IP_HEADER_SIZE + HEADER_SIZE)
+        struct.pack_into(
+            "!BBHHHBBH8sHH",
+            self.header,
+            0,
+            4 << 4 | IP_HEADER_SIZE // 4,  # version + header length
+            0,  # TOS
+            0,  # total length, stamped per pkt
+            0,  # ID, stamped per pkt
+            0,  # flags + fragment offset
+            255,  # TTL
             socket.IPPROTO_TCP,
-            len(raw_tcp_pkt),  # payload included
-        )
-        zero_csum_raw_tcp_pkt = (  # reset the incoming packet's checksum to 0
-                raw_tcp_pkt[:16]
-                + struct.pack("!H", 0)
-                + raw_tcp_pkt[18:]
+            0,  # checksum, stamped per pkt
+            addrs,
+            src_port,
+            dst_port,
         )
-        check_checksum = calculate_checksum(pseudo_header + zero_csum_raw_tcp_pkt)  # calculate checksum
+        self.ip_sum = sum(struct.unpack_from("!10H", self.header))  # fixed IP header words
+        self.tcp_sum = sum(struct.unpack("!4H", addrs)) + socket.IPPROTO_TCP + src_port + dst_port  # pseudo header too
+        self.ip_id = 0
 
-        if check_checksum == checksum:  # compare locally calculated checksum with server's one
-            return tcp_pkt
-        else:
-            return None
+    def stamp(
+        self,
+        seq_num: int,
+        ack_num: int,
+        adv_wnd: int,
+        flags: int = ACK,
+        payload: bytes = b"",
+        payload_sum: int = None,
+        options: bytes = b"",
+    ) -> bytearray:
+        """
+        Fills in the varying fields and checksums of this template for a pkt carrying the given options and payload.
+        Neither is copied; they are sent right after the returned header, in that order.
+
+        :param seq_num: the sequence number
+        :param ack_num: the acknowledgment number
+        :param adv_wnd: the window
+        :param flags: the TCP flags
+        :param payload: the payload
+        :param payload_sum: the payload's one's complement sum, if already known (e.g. on a retransmission)
+        :param options: the encoded options, padded to a multiple of 4 bytes
+        :return: the encoded IP + TCP header
+        """
+
+        header = self.header
+        if payload_sum is None:
+            payload_sum = checksum_sum(payload)
+        if options:
+            payload_sum += checksum_sum(options)
+        tcp_length = HEADER_SIZE + len(options) + len(payload)
+        self.ip_id = ip_id = (self.ip_id + 1) & 0xffff
+        data_offset = (HEADER_SIZE + len(options)) // 4 << 4
+        tcp_sum = (
+            self.tcp_sum + tcp_length + seq_num + ack_num + (data_offset << 8 | flags) + adv_wnd + payload_sum
+        ) % 0xffff
+        ip_sum = (self.ip_sum + IP_HEADER_SIZE + tcp_length + ip_id) % 0xffff
+        IP_LENGTH_ID.pack_into(header, 2, IP_HEADER_SIZE + tcp_length, ip_id)
+        WORD.pack_into(header, 10, ~ip_sum & 0xffff if ip_sum else 0)
+        SEQ_ACK.pack_into(header, IP_HEADER_SIZE + 4, seq_num, ack_num)
+        OFFSET_FLAGS_WND_CSUM.pack_into(
+            header, IP_HEADER_SIZE + 12, data_offset, flags, adv_wnd, ~tcp_sum & 0xffff if tcp_sum else 0
+        )
+        return header
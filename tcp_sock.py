@@ -1,14 +1,39 @@
 import socket
 import sys
+from collections import deque
 from random import randint
-from utils import get_local_ip_addr
-from tcp_pkt import TCPPacket
+from time import monotonic, perf_counter
+from utils import checksum_sum
+from tcp_pkt import TCPPacket, TCPOptions, HeaderTemplate, SEQ_SPACE, HEADER_SIZE
 from ip_pkt import IPPacket
+from socket_filter import FlowFilter
+from link import RawLink
+from reassembly import ReassemblyQueue
+from congestion import NewReno, DUP_ACK_THRESHOLD
+from rtt import RTTEstimator, MAX_RTO
+from stats import ConnectionStats, TimedRing, TimedSender
 
-TEST = "0.0.0.0"
-MAX_CWND = 1000
 MAX_PACKET_SIZE = 65535  # maximum byte-size of a TCP pkt
-MSS = 1460
+MSS = 1460  # largest segment our interface takes, announced in the SYN
+DEFAULT_MSS = 536  # RFC 1122 section 4.2.2.6, if the server doesn't announce its MSS
+RECV_WINDOW = 1 << 22  # bytes advertised once window scaling is agreed
+RECV_WINDOW_SCALE = 7  # shift count, lets the 16-bit window field reach RECV_WINDOW
+TIMESTAMPS_OPTION_SIZE = 12  # bytes each segment loses to the timestamps option, padding included
+DELAYED_ACK_TIMEOUT = 0.2  # seconds, RFC 1122 allows up to 0.5
+DELAYED_ACK_SEGMENTS = 2  # ACK at least every second full-sized segment
+MAX_SACK_BLOCKS = 3
+MAX_RETRANSMISSIONS = 8  # consecutive timeouts of outstanding data before giving up, 100+ s with exponential backoff
+MAX_IDLE_TIME = 180.0  # seconds the server may stay silent while nothing of ours is outstanding, e.g. mid-download
+
+
+def ts_clock() -> int:
+    """
+    Returns the current value of the timestamps clock, which ticks every millisecond.
+
+    :return: the timestamp
+    """
+
+    return int(monotonic() * 1000) % SEQ_SPACE
 
 
 class TCPSocket:
@@ -16,52 +41,100 @@ class TCPSocket:
     This class represents the TCP socket.
     """
 
-    def __init__(self, dst_host: str):
+    def __init__(
+        self,
+        dst_host: str,
+        sack: bool = False,
+        congestion_control=NewReno,
+        window_scaling: bool = True,
+        timestamps: bool = True,
+        kernel_filter: bool = True,
+        link=None,
+        stats: bool = False,
+    ):
         """
         Instantiates this TCPSocket object to the given destination address.
 
         :param dst_host: the destination address
+        :param sack: whether to offer SACK and report out-of-order blocks in duplicate ACKs
+        :param congestion_control: the congestion controller class (see congestion.py), instantiated with the MSS
+        :param window_scaling: whether to offer window scaling (RFC 7323), to advertise windows above 64 KB
+        :param timestamps: whether to offer timestamps (RFC 7323), to measure the RTT on every ACK
+        :param kernel_filter: whether to attach a BPF filter to the raw socket, so the kernel only delivers this
+        connection's pkts (Linux only, ignored elsewhere)
+        :param link: the link to reach the server through (see link.py), None for raw sockets
+        :param stats: whether to keep the connection's counters (see stats.py) in self.stats, at a small cost per pkt
         """
 
+        self.stats = ConnectionStats() if stats else None  # before opening the sockets, which it wraps
         self.adv_wnd = MAX_PACKET_SIZE
-        self.rto = 60  # seconds
-        self.recv_sock = socket.socket(
-            socket.AF_INET, socket.SOCK_RAW, socket.IPPROTO_TCP
-        )
-        self.recv_sock.settimeout(self.rto)
-        self.send_sock = socket.socket(
-            socket.AF_INET, socket.SOCK_RAW, socket.IPPROTO_RAW
-        )
-        self.dst_host = socket.gethostbyname(dst_host)
+        self.rtt = RTTEstimator()
+        self.link = RawLink() if link is None else link
+        self.dst_host = self.link.resolve(dst_host)
         self.dst_port = 80  # HTTP
-        self.src_host = get_local_ip_addr()
-        self.src_port = randint(1025, MAX_PACKET_SIZE)
-        self.try_port()
-        self.seq_num = randint(0, 2**32 - 1)
-        self.start_seq_num = self.seq_num
+        self.src_host = self.link.local_addr(self.dst_host)
+        self.src_port = self.link.pick_port()
+        self.dst_addr = (self.dst_host, self.dst_port)
+        self.recv_sock = self.send_sock = self.recv_ring = self.sender = self.flow = None
+        self.open_sockets(kernel_filter)
+        self.template = None  # pre-built outgoing header, see connect()
+        self.seq_num = randint(0, 2**32 - 1)  # next seq_num to send
+        self.snd_una = self.seq_num  # oldest unacknowledged seq_num
         self.ack_num = 0
         self.last_pkt = None  # cache last pkt for retransmission
-        self.counter = 3  # retransmit 3 times, then end connection
+        self.retransmission_queue = deque()  # data pkts sent but not acknowledged yet, oldest first
+        self.counter = MAX_RETRANSMISSIONS  # retransmit this many times in a row, then end connection
+        self.idle_timeouts = 0  # consecutive timeouts while nothing is outstanding, each re-sends an ACK
+        self.idle_time = 0.0  # seconds they add up to, see MAX_IDLE_TIME
+        self.rtx_deadline = None  # when the retransmission timer fires, None while nothing is outstanding
+        self.rtx_next = None  # after a timeout, the first seq_num not retransmitted yet, None once caught up
+        self.rtx_end = None  # the seq_num to send next when the timeout fired, where retransmitting stops
+        self.partial_ack_recover = None  # the recovery point whose first partial ACK restarted the timer
+        self.rtt_seq = None  # the ACK that completes the RTT measurement in progress
+        self.rtt_start = None  # when the timed pkt was sent
+        self.closed = False
         # congestion control
-        self.cwnd = 1
+        self.congestion_control = congestion_control
+        self.cc = congestion_control(MSS)
         self.dst_adv_wnd = 1
-        self.buf = bytearray()
+        # options, see connect()
+        self.mss = MSS  # largest payload to send, once the server's MSS is known
+        self.window_scaling = window_scaling
+        self.snd_wscale = 0  # shift count of the server's window
+        self.rcv_wscale = 0  # shift count of our window
+        self.timestamps = timestamps
+        self.ts_ok = False  # both ends agreed on timestamps
+        self.ts_recent = 0  # latest timestamp to echo to the server
+        # receive side
+        self.sack = sack
+        self.sack_ok = False  # both ends agreed on SACK
+        self.reassembly = None  # set up once the connection is established
+        self.ready = deque()  # in-order data chunks not handed to the application yet
+        self.fin_seq = None  # seq_num of the server's FIN, once seen
+        self.unacked_segments = 0  # in-order segments received since the last ACK
+        self.ack_deadline = None  # when the delayed ACK timer fires
+
+    def open_sockets(self, kernel_filter: bool = True):
+        """
+        Opens this connection's endpoint on its link: the raw receive and send sockets, by default.
+
+        :param kernel_filter: whether to attach a BPF filter to the receive socket
+        """
 
-    def try_port(self):
+        self.flow = FlowFilter(self.src_host, self.src_port, self.dst_host, self.dst_port)
+        self.link.open(self, kernel_filter)
+        self.instrument()
+
+    def instrument(self):
         """
-        Checks if a port is available locally.
+        Wraps the receive ring and sender so they feed self.stats, if this connection keeps stats.
         """
 
-        test_sock = socket.socket(
-            socket.AF_INET, socket.SOCK_STREAM
-        )  # new socket object for testing the port
-        while True:
-            try:
-                test_sock.bind((TEST, self.src_port))
-                break  # the port is open
-            except:  # the port is busy
-                self.src_port = randint(1025, MAX_PACKET_SIZE)
-        test_sock.close()
+        if self.stats is None:
+            return
+        if self.recv_ring is not None:
+            self.recv_ring = TimedRing(self.recv_ring, self.stats)
+        self.sender = TimedSender(self.sender, self.stats)
 
     def connect(self) -> bool:
         """
@@ -71,144 +144,599 @@ class TCPSocket:
         """
 
         # 3-way handshake
-        syn_pkt = self.create_tcp_pkt()
-        syn_pkt.syn = True
-        self.send_pkt(syn_pkt)
-        recvd_pkt = self.recv_pkt()
-        self.ack_num = recvd_pkt.seq_num + 1
-        if recvd_pkt and recvd_pkt.syn and recvd_pkt.ack:
-            self.send_ack()
+        self.send_syn()
+        if self.establish(self.recv_pkt()):
             return True
         else:
             self.close()
             return False
 
+    def send_syn(self):
+        """
+        Transmits the SYN pkt, with the options we offer.
+        """
+
+        self.template = HeaderTemplate(self.src_host, self.src_port, self.dst_host, self.dst_port)
+        syn_pkt = self.create_tcp_pkt()
+        syn_pkt.syn = True
+        syn_pkt.options = TCPOptions(
+            mss=MSS,
+            window_scale=RECV_WINDOW_SCALE if self.window_scaling else None,
+            sack_permitted=self.sack,
+            timestamps=(ts_clock(), 0) if self.timestamps else None,
+        ).pack()
+        self.send_pkt(syn_pkt)
+        self.seq_num = (self.seq_num + 1) % SEQ_SPACE  # the SYN takes up one seq_num
+
+    def establish(self, recvd_pkt, on_data=None) -> bool:
+        """
+        Completes the handshake with the server's answer to the SYN.
+
+        :param recvd_pkt: the TCP pkt
+        :param on_data: called with the in-order data chunks, queued for recv_chunks() by default
+        :return: True if it was a SYN-ACK, False otherwise
+        """
+
+        self.ack_num = (recvd_pkt.seq_num + 1) % SEQ_SPACE
+        if not (recvd_pkt and recvd_pkt.syn and recvd_pkt.ack):
+            return False
+        self.negotiate(TCPOptions.unpack(recvd_pkt.options))
+        self.reassembly = ReassemblyQueue(self.ack_num, on_data or self.ready.append, self.adv_wnd << self.rcv_wscale)
+        self.send_ack()
+        return True
+
+    def negotiate(self, options: TCPOptions):
+        """
+        Settles the connection's options from the server's SYN-ACK: each one is only used if both ends offered it.
+
+        :param options: the SYN-ACK's options
+        """
+
+        self.sack_ok = self.sack and options.sack_permitted
+        self.mss = min(MSS, options.mss or DEFAULT_MSS)
+        if self.window_scaling and options.window_scale is not None:
+            self.snd_wscale = options.window_scale
+            self.rcv_wscale = RECV_WINDOW_SCALE
+            self.adv_wnd = RECV_WINDOW >> RECV_WINDOW_SCALE
+        self.ts_ok = self.timestamps and options.timestamps is not None
+        if self.ts_ok:
+            self.ts_recent = options.timestamps[0]
+            self.mss -= TIMESTAMPS_OPTION_SIZE
+        self.cc = self.congestion_control(self.mss)
+        self.cc.rtt = self.rtt.srtt
+
     def close(self):
         """
         Shuts down the connection.
         """
 
+        self.keep_ready()  # a FIN may come with data still queued, and the answer to ours refills the ring
+        self.send_fin()
+        self.finish_close(self.recv_pkt())
+
+    def send_fin(self):
+        """
+        Transmits the FIN pkt.
+        """
+
         fin_ack_pkt = self.create_tcp_pkt()
         fin_ack_pkt.fin = True
         fin_ack_pkt.ack = True
         self.send_pkt(fin_ack_pkt)
-        recvd_pkt = self.recv_pkt()
-        self.ack_num = recvd_pkt.seq_num + 1
-        self.recv_sock.close()
-        self.send_sock.close()
+        self.seq_num = (self.seq_num + 1) % SEQ_SPACE  # the FIN takes up one seq_num
+
+    def finish_close(self, recvd_pkt):
+        """
+        Releases the sockets once the server answered the FIN.
+
+        :param recvd_pkt: the TCP pkt
+        """
+
+        self.ack_num = (recvd_pkt.seq_num + 1) % SEQ_SPACE
+        self.release()
+
+    def release(self):
+        """
+        Closes the link endpoint.
+        """
+
+        self.closed = True
+        self.link.close(self)
 
-    def send(self, pkt: str):
+    def send(self, data: str or bytes):
         """
-        Sends a pkt.
+        Sends data with a sliding window: the data is cut into MSS-sized segments and up to min(cwnd, rwnd) bytes are
+        kept in flight, advancing as cumulative ACKs come back. Returns once everything is acknowledged. Data the
+        server sends in the meantime is reassembled for recv().
 
-        :param pkt: the pkt
+        :param data: the data
         """
-        self.buf += pkt.encode()
 
-        # Determine the actual size of the congestion window in bytes
-        wnd_start_offset = self.seq_num - self.start_seq_num - 1
-        wnd_size_bytes = MSS * min(self.dst_adv_wnd, self.cwnd)
+        if isinstance(data, str):
+            data = data.encode()
+        data = memoryview(data)
+        offset = 0
+        while offset < len(data) or self.retransmission_queue:
+            offset = self.fill_window(data, offset)
+            self.keep_ready()
+            if self.process_pkt(self.recv_pkt()):  # the server closed the connection
+                self.close()
+                break
+
+    def keep_ready(self):
+        """
+        Copies the data chunks not handed to the application yet out of the receive ring, which the next recv_pkt()
+        may refill: this covers data that arrives while sending or with the server's FIN, and chunks left over when
+        the application stopped reading at the end of a response on a persistent connection.
+        """
 
-        # Sliding window
-        for offset in range(wnd_start_offset, len(self.buf), wnd_size_bytes):
-            payload = self.buf[offset : offset + wnd_size_bytes]
+        for _ in range(len(self.ready)):
+            chunk = self.ready.popleft()
+            self.ready.append(chunk if isinstance(chunk, bytes) else bytes(chunk))
 
+    def fill_window(self, data: memoryview, offset: int) -> int:
+        """
+        Sends as many segments of the data as the window allows.
+
+        :param data: the data
+        :param offset: where the unsent data starts
+        :return: where the unsent data starts now
+        """
+
+        while offset < len(data):
+            in_flight = (self.seq_num - self.snd_una) % SEQ_SPACE
+            payload_size = min(self.mss, len(data) - offset)
+            if in_flight and in_flight + payload_size > self.send_window():
+                break  # the window is full, an empty one still lets a single segment probe it
             tcp_pkt = self.create_tcp_pkt()
-            tcp_pkt.payload = payload
-            tcp_pkt.psh = True
+            tcp_pkt.payload = data[offset:offset + payload_size]
+            tcp_pkt.psh = offset + payload_size == len(data)
             tcp_pkt.ack = True
-            
             self.send_pkt(tcp_pkt=tcp_pkt)
-            recvd_pkt = self.recv_pkt()
-            if recvd_pkt.ack:
-                self.ack_num = recvd_pkt.seq_num
+            self.retransmission_queue.append(tcp_pkt)
+            self.seq_num = (self.seq_num + payload_size) % SEQ_SPACE
+            offset += payload_size
+        return offset
+
+    def send_window(self) -> int:
+        """
+        Returns how many bytes may be in flight: the smaller of the congestion and advertised windows.
+
+        :return: the window in bytes
+        """
+
+        return min(self.cc.cwnd, self.dst_adv_wnd)
+
+    def on_ack(self, tcp_pkt, ts_ecr: int = None):
+        """
+        Processes the ACK of an incoming pkt: advances the oldest unacknowledged seq_num, drops fully acknowledged
+        pkts from the retransmission queue and lets the congestion controller react, fast retransmitting on 3
+        duplicate ACKs and on partial ACKs during recovery, unless it is going back after a timeout.
+
+        :param tcp_pkt: the TCP pkt
+        :param ts_ecr: the timestamp echoed by the pkt, if timestamps are in use
+        """
+
+        ack_num = tcp_pkt.ack_num
+        flight_size = (self.seq_num - self.snd_una) % SEQ_SPACE
+        acked = (ack_num - self.snd_una) % SEQ_SPACE
+        if acked == 0:
+            if (  # a duplicate ACK as defined by RFC 5681
+                self.retransmission_queue
+                and not tcp_pkt.payload
+                and not (tcp_pkt.syn or tcp_pkt.fin)
+                and tcp_pkt.adv_wnd << self.snd_wscale == self.dst_adv_wnd
+            ):
+                if self.stats is not None:
+                    self.stats.dup_acks += 1
+                if self.cc.on_dup_ack(ack_num, self.seq_num, flight_size):
+                    self.retransmit(self.retransmission_queue[0])
+                elif self.rtx_next is not None and self.rtx_next != ack_num:  # going back, a resent pkt was lost
+                    if self.cc.dup_acks < DUP_ACK_THRESHOLD:  # limited transmit (RFC 3042) keeps the ACKs coming
+                        self.go_back(self.cc.dup_acks * self.mss)
+                    elif self.cc.dup_acks == DUP_ACK_THRESHOLD:  # the same loss episode, no window reduction
+                        self.rtx_next = ack_num
+                        self.go_back()
+            return
+        if acked > flight_size:  # acks unsent data
+            return
+        self.snd_una = ack_num
+        now = monotonic()
+        sample = None
+        if ts_ecr is not None:  # timestamps give a sample per ACK, retransmissions included (RFC 7323 section 4)
+            sample = (ts_clock() - ts_ecr) % SEQ_SPACE / 1000
+        elif self.rtt_seq is not None and (ack_num - self.rtt_seq) % SEQ_SPACE < SEQ_SPACE // 2:  # covers the timed pkt
+            sample = now - self.rtt_start
+            self.rtt_seq = None
+        if sample is not None:
+            self.rtt.sample(sample)
+            self.cc.rtt = self.rtt.srtt
+            if self.stats is not None:
+                self.stats.rtt.add(sample * 1000)
+        while self.retransmission_queue:
+            queued_pkt = self.retransmission_queue[0]
+            end = (queued_pkt.seq_num + len(queued_pkt.payload)) % SEQ_SPACE
+            if (ack_num - end) % SEQ_SPACE >= SEQ_SPACE // 2:  # not fully acknowledged
+                break
+            self.retransmission_queue.popleft()
+        partial_ack = self.cc.on_ack(acked, ack_num, flight_size)
+        # restart the retransmission timer for the remaining data, if any (RFC 6298 section 5.3), but only on the
+        # first partial ACK of a recovery (the Impatient variant of RFC 6582 section 4.3): when more is lost than one
+        # segment per RTT repairs, the timeout goes back over the whole window
+        if ack_num == self.seq_num:
+            self.rtx_deadline = None
+        elif not partial_ack or self.partial_ack_recover != self.cc.recover:
+            self.rtx_deadline = now + self.rtt.rto
+        if partial_ack:
+            self.partial_ack_recover = self.cc.recover
+        if partial_ack and self.retransmission_queue and self.rtx_next is None:
+            self.retransmit(self.retransmission_queue[0])
+        if self.rtx_next is not None:  # going back after a timeout, which resends the head of the queue itself
+            self.go_back()
 
     def recv(self) -> bytearray:
         """
-        Receives, processes, and returns encoded packets.
+        Receives and returns the server's data until it closes the connection.
 
-        :return: the encoded pkt
+        :return: the data
         """
 
-        window = {}  # buffer
-        while True:
-            recvd_pkt = self.recv_pkt()
-            if recvd_pkt.ack and recvd_pkt.seq_num not in window:  # if it's an ACK pkt
-                self.ack_num = recvd_pkt.seq_num + len(recvd_pkt.payload)
-
-                if recvd_pkt.payload:  # check for duplicate packets & None payloads
-                    window[
-                        recvd_pkt.seq_num
-                    ] = recvd_pkt.payload  # add to buffer -> key=seq_num value=payload
-                    self.send_ack()  # send an ACK
-
-                if (
-                    recvd_pkt.fin or recvd_pkt.rst
-                ):  # server wants to close the connection
-                    self.close()  # close connection
-                    break  # stop receiving
-
-        sorted_seq_nums = sorted(
-            window.keys()
-        )  # sort out of order packets by the seq_num
         data = bytearray()
-        for (
-            seq_num
-        ) in sorted_seq_nums:  # reassemble packet payload using sorted seq_nums
-            data += window[seq_num]
+        for chunk in self.recv_chunks():
+            data += chunk
         return data
 
+    def recv_chunks(self):
+        """
+        Receives the server's data until it closes the connection, yielding in-order chunks as soon as they are
+        reassembled. ACKs are cumulative (they cover the highest contiguous byte) and delayed per RFC 1122, while gaps
+        and duplicates are ACKed immediately.
+
+        Chunks may be views of receive buffers, so they must be consumed (copied or written) before the next one is
+        requested. The application may stop reading at any point, e.g. at the end of a response, and call send() or
+        recv_chunks() again later: nothing is lost or yielded twice.
+
+        :return: a generator of in-order data chunks
+        """
+
+        while True:
+            while self.ready:
+                yield self.ready.popleft()
+            if self.closed:
+                break
+            if self.process_pkt(self.recv_pkt()):
+                self.close()
+
+    def process_pkt(self, recvd_pkt) -> bool:
+        """
+        Handles the data, FIN and RST of an incoming pkt.
+
+        :param recvd_pkt: the TCP pkt
+        :return: True if the server is done with the connection and it must be closed, False otherwise
+        """
+
+        if recvd_pkt.rst:  # server reset the connection
+            return True
+        if not recvd_pkt.ack:
+            return False
+        payload = recvd_pkt.payload
+        if payload:
+            self.recv_segment(recvd_pkt.seq_num, payload)
+        if recvd_pkt.fin:
+            self.fin_seq = (recvd_pkt.seq_num + len(payload)) % SEQ_SPACE
+        if self.fin_seq == self.ack_num:  # all data up to the FIN arrived, server wants to close the connection
+            self.ack_num = (self.ack_num + 1) % SEQ_SPACE  # the FIN takes up one seq_num
+            return True
+        return False
+
+    def recv_segment(self, seq_num: int, payload: memoryview):
+        """
+        Hands a data segment to the reassembly queue and ACKs accordingly.
+
+        :param seq_num: the segment's seq_num
+        :param payload: the segment's payload
+        """
+
+        if self.stats is not None:
+            self.count_segment(seq_num, len(payload))
+        had_gaps = len(self.reassembly) > 0
+        delivered = self.reassembly.add(seq_num, payload)
+        self.ack_num = self.reassembly.next_seq
+        if not delivered or had_gaps:  # duplicate, out of order or filling a gap: ACK right away
+            self.send_ack()
+            return
+        self.unacked_segments += 1
+        if self.unacked_segments >= DELAYED_ACK_SEGMENTS:
+            self.send_ack()
+        elif self.ack_deadline is None:
+            self.ack_deadline = monotonic() + DELAYED_ACK_TIMEOUT
+
+    def count_segment(self, seq_num: int, length: int):
+        """
+        Classifies a data segment in self.stats, relative to the next expected byte: out of order (ahead of it), out
+        of window (past what we advertised) or duplicate (entirely before it).
+
+        :param seq_num: the segment's seq_num
+        :param length: the segment's payload length
+        """
+
+        ahead = (seq_num - self.ack_num) % SEQ_SPACE
+        if ahead >= SEQ_SPACE // 2:  # starts before the next expected byte
+            if (self.ack_num - seq_num - length) % SEQ_SPACE < SEQ_SPACE // 2:  # ends there too
+                self.stats.duplicates += 1
+        elif ahead:
+            self.stats.out_of_order += 1
+            if ahead + length > self.adv_wnd << self.rcv_wscale:
+                self.stats.out_of_window += 1
+
     def send_ack(self):
         """
-        Transmits an ACK pkt.
+        Transmits an ACK pkt, stamped into this connection's pre-built header, with SACK blocks if there are gaps.
         """
 
-        ack_pkt = self.create_tcp_pkt()
-        ack_pkt.ack = True
-        self.send_pkt(ack_pkt)
+        self.last_pkt = None  # a lost ACK is recovered by sending a fresh one
+        self.unacked_segments = 0
+        self.ack_deadline = None
+        options = self.segment_options(self.sack_ok and len(self.reassembly) > 0)
+        header = self.template.stamp(self.seq_num, self.ack_num, self.adv_wnd, options=options)
+        self.sender.send([bytes(header), options])  # the template is reused, so copy the header
 
-    def send_pkt(self, tcp_pkt: TCPPacket):
+    def segment_options(self, sack: bool = False) -> bytes:
         """
-        Transmits a pkt.
+        Returns the encoded options for a pkt sent after the handshake: timestamps, if agreed, and SACK blocks.
+
+        :param sack: whether to report the out-of-order blocks
+        :return: the encoded options
+        """
+
+        if not (self.ts_ok or sack):
+            return b""
+        return TCPOptions(
+            sack_blocks=self.reassembly.sack_blocks(MAX_SACK_BLOCKS) if sack else (),
+            timestamps=(ts_clock(), self.ts_recent) if self.ts_ok else None,
+        ).pack()
+
+    def send_pkt(self, tcp_pkt: TCPPacket, retransmission: bool = False):
+        """
+        Transmits a pkt by stamping its header fields into this connection's header template. The payload's checksum
+        contribution is cached on the pkt, so retransmissions don't re-sum it. Pkts that take up seq_nums start the
+        retransmission timer, and one of them at a time is timed to measure the RTT.
 
         :param tcp_pkt: the TCP pkt
+        :param retransmission: whether the pkt was sent before, in which case neither it nor the timed pkt it may
+        cover can be timed (Karn's algorithm)
         """
+
+        seq_len = len(tcp_pkt.payload) + tcp_pkt.syn + tcp_pkt.fin
+        if self.stats is not None:
+            self.stats.bytes_out += len(tcp_pkt.payload)
+            self.stats.retransmits += retransmission
+        if seq_len:
+            now = monotonic()
+            if self.rtx_deadline is None:
+                self.rtx_deadline = now + self.rtt.rto
+            if retransmission:
+                timed = self.rtt_seq is not None and (self.rtt_seq - tcp_pkt.seq_num - 1) % SEQ_SPACE < seq_len
+                if timed:  # its ACK could answer either copy, the next new pkt is timed instead
+                    self.rtt_seq = None
+            elif self.rtt_seq is None:
+                self.rtt_seq = (tcp_pkt.seq_num + seq_len) % SEQ_SPACE
+                self.rtt_start = now
         self.last_pkt = tcp_pkt
-        ip_pkt = IPPacket(src=self.src_host, dst=self.dst_host, data=tcp_pkt.pack())
-        ip_pkt_raw = ip_pkt.pack()
-        bytes_sent = self.send_sock.sendto(ip_pkt_raw, (self.dst_host, self.dst_port))
-        assert len(ip_pkt_raw) == bytes_sent
+        if not tcp_pkt.syn:  # refresh the timestamps
+            tcp_pkt.options = self.segment_options()
+        self.unacked_segments = 0  # the pkt carries our latest ACK
+        self.ack_deadline = None
+        tcp_pkt.set_flags()
+        if tcp_pkt.payload_sum is None:
+            tcp_pkt.payload_sum = checksum_sum(tcp_pkt.payload)
+        header = self.template.stamp(
+            tcp_pkt.seq_num,
+            tcp_pkt.ack_num,
+            tcp_pkt.adv_wnd,
+            tcp_pkt.flags,
+            tcp_pkt.payload,
+            tcp_pkt.payload_sum,
+            tcp_pkt.options,
+        )
+        self.sender.send([bytes(header), tcp_pkt.options, tcp_pkt.payload])
 
     def recv_pkt(self) -> TCPPacket:
         """
-        Performs error checking on incoming packets and handles retransmission as well as congestion control.
+        Performs error checking on incoming packets and handles retransmission as well as congestion control. While
+        waiting, it also fires the delayed ACK and retransmission timers.
+
+        Pkts are received in batches. The returned pkt's payload points into the receive ring, so it is only valid
+        until the next call.
 
         :return: the TCP pkt
         """
         while True:
+            now = monotonic()
+            deadline = self.rtx_deadline or now + self.idle_interval()  # without outstanding data, time out when idle
+            if self.ack_deadline is not None:
+                deadline = min(deadline, self.ack_deadline)
             try:
-                raw_pkt = self.recv_sock.recv(MAX_PACKET_SIZE)
-                ip_pkt = IPPacket.unpack(raw_pkt=raw_pkt)
-                if ip_pkt and ip_pkt.protocol == socket.IPPROTO_TCP:
-                    tcp_pkt = TCPPacket.unpack(ip_pkt=ip_pkt, raw_tcp_pkt=ip_pkt.data)
-                    if tcp_pkt and tcp_pkt.dst_port == self.src_port:
-                        if self.cwnd < MAX_CWND:
-                            self.cwnd += 1
-
-                        self.dst_adv_wnd = tcp_pkt.adv_wnd
-                        self.counter = 3
-                        self.seq_num = tcp_pkt.ack_num
-                        return tcp_pkt
+                tcp_pkt = self.handle_raw_pkt(self.recv_ring.recv(max(deadline - now, 0.001)))
+                if tcp_pkt:
+                    return tcp_pkt
             except TimeoutError:
-                if self.counter > 0:  # 3 retransmission max
-                    self.send_pkt(self.last_pkt)  # retransmit the last pkt sent
-                    self.counter -= 1  # 1 retransmission happened
-                    # multiplicative decrease
-                    self.cwnd = 1
-                else:  # no response from the server for 3 straight times i.e. 3 minutes passed
-                    print("Connection failed", file=sys.stderr)
-                    self.close()
-                    sys.exit(1)
+                self.fire_timers()
+
+    def handle_raw_pkt(self, raw_pkt):
+        """
+        Checks and parses a raw pkt, then processes its ACK, window and timestamps.
+
+        :param raw_pkt: the raw IP pkt
+        :return: the TCP pkt, or None if it isn't for this connection or is corrupted
+        """
+
+        stats = self.stats
+        if stats is not None:
+            start = perf_counter()
+        if not self.flow.matches(raw_pkt):  # another flow's pkt, before any checksum work
+            if stats is not None:
+                stats.filtered_flow += 1
+            return None
+        ip_pkt = IPPacket.unpack(raw_pkt=raw_pkt)
+        tcp_pkt = None
+        if ip_pkt and ip_pkt.protocol == socket.IPPROTO_TCP:
+            tcp_pkt = TCPPacket.unpack(ip_pkt=ip_pkt, raw_tcp_pkt=ip_pkt.data)
+        if stats is not None:
+            stats.parse_time += perf_counter() - start
+            if tcp_pkt:
+                stats.segments_in += 1
+                stats.bytes_in += len(tcp_pkt.payload)
+            else:
+                stats.filtered_checksum += 1
+        if not tcp_pkt:
+            return None
+        ts_ecr = self.update_timestamps(tcp_pkt) if self.ts_ok else None
+        if tcp_pkt.ack:
+            self.on_ack(tcp_pkt, ts_ecr)
+            if stats is not None:
+                stats.sample_cwnd(self.cc.cwnd)
+        self.dst_adv_wnd = tcp_pkt.adv_wnd << (0 if tcp_pkt.syn else self.snd_wscale)
+        self.counter = MAX_RETRANSMISSIONS
+        self.idle_timeouts = 0
+        self.idle_time = 0.0
+        return tcp_pkt
+
+    def fire_timers(self):
+        """
+        Handles the expiry of the earliest timer: the delayed ACK one, or else the retransmission one.
+        """
+
+        ack_due = self.ack_deadline is not None
+        if ack_due and (self.rtx_deadline is None or self.ack_deadline <= self.rtx_deadline):
+            self.send_ack()  # the delayed ACK timer fired
+        else:
+            self.on_timeout()
+
+    def update_timestamps(self, tcp_pkt) -> int or None:
+        """
+        Records the timestamp to echo back from an incoming pkt (RFC 7323 section 4.3) and returns the one it echoes.
+
+        :param tcp_pkt: the TCP pkt
+        :return: the echoed timestamp, or None if the pkt has none
+        """
+
+        if tcp_pkt.header_length == HEADER_SIZE:  # no options at all
+            return None
+        timestamps = TCPOptions.unpack(tcp_pkt.options).timestamps
+        if timestamps is None:
+            return None
+        ts_val, ts_ecr = timestamps
+        newer = (ts_val - self.ts_recent) % SEQ_SPACE < SEQ_SPACE // 2
+        if newer and (self.ack_num - tcp_pkt.seq_num) % SEQ_SPACE < SEQ_SPACE // 2:  # starts at or before ack_num
+            self.ts_recent = ts_val
+        return ts_ecr
+
+    def idle_interval(self) -> float:
+        """
+        Returns how long to wait for the server while nothing is outstanding: the RTO, doubled for each idle timeout
+        in a row. The RTO itself isn't backed off, no RTT sample would undo it while only the server sends data.
+
+        :return: the time in seconds
+        """
+
+        return min(self.rtt.rto * 2 ** self.idle_timeouts, MAX_RTO)
+
+    def on_timeout(self):
+        """
+        Handles a retransmission timeout: goes back to the oldest unacknowledged data pkt (or re-sends the SYN or FIN),
+        backs off the RTO and restarts the timer. When idle, it only re-sends an ACK, and gives up once the server
+        was silent for MAX_IDLE_TIME.
+        """
+
+        flight_size = (self.seq_num - self.snd_una) % SEQ_SPACE
+        if not flight_size:
+            self.on_idle_timeout()
+            return
+        if self.counter == 0:  # no response from the server for too long
+            self.give_up()
+            return
+        self.counter -= 1  # 1 retransmission happened
+        if self.stats is not None:
+            self.stats.timeouts += 1
+        if flight_size:
+            self.cc.on_timeout(self.seq_num, flight_size)
+            if self.stats is not None:
+                self.stats.sample_cwnd(self.cc.cwnd)
+        if self.retransmission_queue:
+            self.rtx_next = self.snd_una
+            self.rtx_end = self.seq_num
+            self.go_back()
+        elif self.last_pkt is not None:  # an unacknowledged SYN or FIN
+            self.retransmit(self.last_pkt)
+        self.rtt.backoff()
+        self.rtx_deadline = monotonic() + self.rtt.rto
+
+    def on_idle_timeout(self):
+        """
+        Handles a timeout while nothing is outstanding: the server may be waiting for an ACK that was lost, so one
+        is re-sent, and the wait for the next one doubles (see idle_interval()).
+        """
+
+        self.idle_time += self.idle_interval()
+        if self.idle_time >= MAX_IDLE_TIME:  # no response from the server for too long
+            self.give_up()
+            return
+        self.idle_timeouts += 1
+        if self.stats is not None:
+            self.stats.timeouts += 1
+        self.send_ack()
+        self.rtx_deadline = None
+
+    def go_back(self, allowance: int = 0):
+        """
+        Retransmits the queued pkts after a timeout, oldest first, as far as the window allows: everything that was
+        in flight is presumed lost (RFC 5681 section 3.1), so each ACK lets slow start resend more of it, up to where
+        the sender stood when the timer fired. Segments the server acknowledges meanwhile are skipped.
+
+        :param allowance: bytes that may be resent past the window, for limited transmit on duplicate ACKs
+        """
+
+        if (self.snd_una - self.rtx_end) % SEQ_SPACE < SEQ_SPACE // 2:  # everything up to rtx_end is acknowledged
+            self.rtx_next = None
+            return
+        resent = (self.rtx_next - self.snd_una) % SEQ_SPACE  # bytes retransmitted and still in flight
+        if resent >= SEQ_SPACE // 2:  # the ACK went past rtx_next
+            resent = 0
+        stop = (self.rtx_end - self.snd_una) % SEQ_SPACE
+        for queued_pkt in self.retransmission_queue:
+            end = (queued_pkt.seq_num + len(queued_pkt.payload) - self.snd_una) % SEQ_SPACE
+            if end <= resent:
+                continue
+            if end > stop or resent and end > self.send_window() + allowance:
+                break
+            self.retransmit(queued_pkt)
+            resent = end
+        self.rtx_next = (self.snd_una + resent) % SEQ_SPACE
+        if resent >= stop:
+            self.rtx_next = None
+
+    def give_up(self):
+        """
+        Ends the program after the server stopped responding. The FIN goes out, but there is no point waiting for
+        the answer (which would time out and give up again).
+        """
+
+        print("Connection failed", file=sys.stderr)
+        self.send_fin()
+        self.release()
+        sys.exit(1)
+
+    def retransmit(self, tcp_pkt: TCPPacket):
+        """
+        Retransmits a pkt with an up-to-date ACK.
+
+        :param tcp_pkt: the TCP pkt
+        """
+
+        tcp_pkt.ack_num = self.ack_num
+        tcp_pkt.adv_wnd = self.adv_wnd
+        self.send_pkt(tcp_pkt, retransmission=True)
 
     def create_tcp_pkt(self, payload: str = "") -> TCPPacket:
         """
@@ -0,0 +1,20 @@
+"""
+The working directory fixture of the tests that download files.
+"""
+import os
+import tempfile
+
+
+class TempDirTest:
+    """
+    A mixin for test cases that download files, before unittest.TestCase in the bases: each test runs in a
+    temporary working directory, where downloads are saved, removed once the test is done.
+    """
+
+    def setUp(self):
+        super().setUp()
+        cwd = os.getcwd()
+        directory = tempfile.TemporaryDirectory()
+        os.chdir(directory.name)
+        self.addCleanup(directory.cleanup)
+        self.addCleanup(os.chdir, cwd)  # cleanups run last in, first out: leave the directory before removing it
@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+"""
+Checks AsyncTCPSocket over a SimLink run by asyncio: whole downloads through download_async() on a clean and a lossy
+link, a lost request resent by the retransmission timer, a reset from the server, giving up on a silent server, and
+what a torn down connection leaves behind: no timer and no pending future.
+
+Usage: python3 test/test_async_sock.py, or python3 -m pytest test
+"""
+import asyncio
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from async_sock import AsyncTCPSocket  # noqa: E402
+from download import download_async  # noqa: E402
+from sim_link import SimLink  # noqa: E402
+from sim_peer import ScriptedServer  # noqa: E402
+from tcp_pkt import RST, ACK  # noqa: E402
+from temp_dir import TempDirTest  # noqa: E402
+
+BODY = os.urandom(1 << 18)
+FILES = {"/body": BODY}
+REQUEST = b"GET /body HTTP/1.1\r\nHost: sim\r\nConnection: close\r\n\r\n"
+LOSSY_LINK = dict(bandwidth=50e6, rtt=0.01, loss=0.02, reorder=0.02, duplicate=0.01, seed=15)
+
+
+class ResettingServer(ScriptedServer):
+    """
+    A ScriptedServer that resets every connection right after it starts answering the request.
+    """
+
+    def receive(self, raw_pkt: bytes, now: float):
+        super().receive(raw_pkt, now)
+        for port, connection in list(self.connections.items()):
+            if connection.out:
+                connection.emit(connection.base + connection.sent, RST | ACK, b"", now)
+                del self.connections[port]
+
+
+class AsyncSocketTest(TempDirTest, unittest.IsolatedAsyncioTestCase):
+    async def connect(self, link: SimLink) -> AsyncTCPSocket:
+        """
+        Opens a connection that keeps stats.
+
+        :param link: the SimLink
+        :return: the connected AsyncTCPSocket
+        """
+
+        sock = AsyncTCPSocket("sim", link=link, stats=True)
+        self.assertTrue(await sock.connect())
+        return sock
+
+    def assertTornDown(self, sock: AsyncTCPSocket):
+        """
+        Checks that a connection let go of everything: its timer, the futures awaited on it and its endpoint.
+
+        :param sock: the AsyncTCPSocket
+        """
+
+        self.assertTrue(sock.closed)
+        self.assertIsNone(sock.timer)
+        for future in (sock.handshake, sock.fin_answer, sock.progress):
+            self.assertTrue(future is None or future.done())
+        self.assertNotIn(sock.src_port, sock.link.endpoints)
+
+    async def test_download(self):
+        for settings in (dict(rtt=0.005), LOSSY_LINK):
+            link = SimLink(ScriptedServer(FILES), **settings)
+            received = await download_async("http://sim/body", link=link)
+            with open("body", "rb") as fd:
+                self.assertTrue(fd.read() == BODY, settings)  # not assertEqual, which would print the body
+            self.assertGreater(received, len(BODY))
+            self.assertEqual(link.endpoints, {})  # the connection is released
+
+    async def test_retransmit(self):
+        link = SimLink(ScriptedServer(FILES), rtt=0.01)
+        sock = await self.connect(link)
+        link.up.loss = 1.0  # the request is lost
+        sending = asyncio.ensure_future(sock.send(REQUEST))
+        await asyncio.sleep(0)  # until send() waits for the ACK
+        link.up.loss = 0.0
+        await sending
+        self.assertGreaterEqual(sock.stats.timeouts, 1)
+        self.assertEqual(sock.stats.retransmits, 1)
+        self.assertTrue((await sock.recv()).endswith(BODY))
+        await sock.close()
+        self.assertTornDown(sock)
+
+    async def test_reset(self):
+        sock = await self.connect(SimLink(ResettingServer(FILES), rtt=0.01))
+        with self.assertRaises(ConnectionResetError):
+            await sock.send(REQUEST)
+            await sock.recv()
+        self.assertTornDown(sock)
+        await sock.close()  # nothing left to close, no FIN waiting for an answer
+
+    async def test_give_up(self):
+        link = SimLink(ScriptedServer(FILES), rtt=0.01)
+        sock = await self.connect(link)
+        link.up.loss = 1.0  # the server hears nothing more
+        sock.counter = 1  # give up after one retransmission rather than minutes of backoff
+        with self.assertRaises(ConnectionError):
+            await sock.send(REQUEST)
+        with self.assertRaises(ConnectionError):
+            await sock.recv()
+        self.assertEqual(sock.stats.timeouts, 1)
+        self.assertTornDown(sock)
+
+    async def test_release_while_sending(self):
+        sock = await self.connect(SimLink(ScriptedServer(FILES), rtt=0.01))
+        sending = asyncio.ensure_future(sock.send(REQUEST))
+        await asyncio.sleep(0)  # until send() waits for the ACK
+        sock.release()
+        with self.assertRaises(asyncio.CancelledError):
+            await sending
+        self.assertTornDown(sock)
+
+    async def test_timer_without_deadline(self):
+        sock = await self.connect(SimLink(ScriptedServer(FILES), rtt=0.01))
+        sock.timer.cancel()
+        sock.rtx_deadline = sock.idle_deadline = sock.ack_deadline = None
+        sock.on_timer()  # a timer that outlived the deadline it was armed for
+        self.assertIsNotNone(sock.timer)  # re-armed for the idle deadline
+        sock.release()
+        self.assertTornDown(sock)
+
+
+if __name__ == "__main__":
+    unittest.main()
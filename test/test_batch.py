@@ -0,0 +1,58 @@
+#!/usr/bin/env python3
+"""
+Checks download_batch() over a SimLink: a host with many URLs at the front of the list waits for its own slots
+without holding the global ones, so the downloads from other hosts start right away.
+
+Usage: python3 test/test_batch.py, or python3 -m pytest test
+"""
+import contextlib
+import io
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from download import download_batch  # noqa: E402
+from sim_link import SimLink  # noqa: E402
+from sim_peer import ScriptedServer  # noqa: E402
+from temp_dir import TempDirTest  # noqa: E402
+
+SLOW_PATHS = ["/s%d.bin" % i for i in range(6)]
+FAST_HOSTS = ["fast0", "fast1"]
+FILES = dict({path: os.urandom(50000) for path in SLOW_PATHS}, **{"/f.bin": os.urandom(3000)})
+
+
+class RecordingServer(ScriptedServer):
+    """
+    A ScriptedServer that records the Host header of each request, in arrival order.
+    """
+
+    def __init__(self, files: dict):
+        super().__init__(files)
+        self.hosts = []
+
+    def respond(self, request: bytes) -> tuple:
+        for line in request.decode("latin-1").split("\r\n")[1:]:
+            name, _, value = line.partition(":")
+            if name.lower() == "host":
+                self.hosts.append(value.strip())
+        return super().respond(request)
+
+
+class BatchTest(TempDirTest, unittest.IsolatedAsyncioTestCase):
+    async def test_other_hosts_start(self):
+        server = RecordingServer(FILES)
+        urls = ["http://slow" + path for path in SLOW_PATHS] + ["http://%s/f.bin" % host for host in FAST_HOSTS]
+        with contextlib.redirect_stderr(io.StringIO()):  # a line per download
+            failed = await download_batch(urls, jobs=3, per_host=1, link=SimLink(server, bandwidth=20e6, rtt=0.01))
+        self.assertEqual(failed, 0)
+        for path in SLOW_PATHS:
+            with open(path[1:], "rb") as fd:
+                self.assertTrue(fd.read() == FILES[path], path)  # not assertEqual, which would print the body
+        self.assertEqual(sorted(server.hosts[:3]), ["fast0", "fast1", "slow"])  # one slot per host at once
+        self.assertEqual(len(server.hosts), len(SLOW_PATHS) + len(FAST_HOSTS))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+"""
+Checks RecvRing over loopback UDP: one fill() drains every queued datagram, in order and with its own length, with
+recvmmsg through ctypes and with the recv_into fallback. A batch larger than the ring is left for the next fill(),
+and a wait with nothing queued times out. The datagrams are sent by Sender, from several parts each.
+
+Usage: python3 test/test_batch_io.py, or python3 -m pytest test
+"""
+import os
+import socket
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from batch_io import RecvRing, Sender, LIBC  # noqa: E402
+
+SLOTS = 8
+SLOT_SIZE = 2048
+
+
+class RecvRingTest(unittest.TestCase):
+    def setUp(self):
+        self.recv_sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.recv_sock.bind(("127.0.0.1", 0))
+        self.send_sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sender = Sender(self.send_sock, self.recv_sock.getsockname())
+        self.ring = RecvRing(self.recv_sock, SLOTS, SLOT_SIZE)
+
+    def tearDown(self):
+        self.recv_sock.close()
+        self.send_sock.close()
+
+    def send(self, count: int) -> list:
+        """
+        Sends datagrams of different lengths to the ring's socket.
+
+        :param count: the number of datagrams
+        :return: the datagrams, in sending order
+        """
+
+        datagrams = [bytes((i,)) * (1 + 97 * i % SLOT_SIZE) for i in range(count)]
+        for datagram in datagrams:
+            self.sender.send([datagram[:1], datagram[1:]])  # a header and a payload, as the stack sends them
+        return datagrams
+
+    def check_batch(self):
+        """
+        Checks that one fill() receives a batch of queued datagrams whole.
+        """
+
+        datagrams = self.send(SLOTS - 1)
+        self.ring.fill(1.0)
+        self.assertEqual(len(self.ring), len(datagrams))  # a single wakeup drained them all
+        for datagram in datagrams:
+            view = self.ring.recv(1.0)
+            self.assertEqual(len(view), len(datagram))
+            self.assertEqual(bytes(view), datagram)
+        self.assertEqual(len(self.ring), 0)
+
+    @unittest.skipIf(LIBC is None, "no recvmmsg in the C library")
+    def test_recvmmsg(self):
+        self.assertIsNotNone(self.ring.msgs)
+        self.check_batch()
+
+    def test_recv_into(self):
+        self.ring.msgs = None  # as without recvmmsg
+        self.check_batch()
+
+    def test_more_than_the_ring(self):
+        datagrams = self.send(SLOTS + 3)
+        self.ring.fill(1.0)
+        self.assertEqual(len(self.ring), SLOTS)
+        received = [bytes(self.ring.recv(1.0)) for _ in range(SLOTS)]
+        self.assertEqual(len(self.ring), 0)
+        received += [bytes(self.ring.recv(1.0)) for _ in range(3)]  # the next fill() gets the rest
+        self.assertEqual(received, datagrams)
+
+    def test_timeout(self):
+        with self.assertRaises(TimeoutError):
+            self.ring.recv(0.01)
+        self.assertEqual(len(self.ring), 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
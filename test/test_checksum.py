@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+"""
+Checks the checksum engine against a straightforward sum of 16-bit words, over random buffers of every length parity
+split at every offset, and the incremental update of RFC 1624 against a full recompute.
+
+Usage: python3 test/test_checksum.py, or python3 -m pytest test
+"""
+import os
+import random
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from utils import calculate_checksum, checksum_sum, update_checksum  # noqa: E402
+
+# an IPv4 header with its checksum field zeroed, and that checksum (the example of RFC 1071 implementations)
+IP_HEADER = bytes.fromhex("450000730000400040110000c0a80001c0a800c7")
+IP_HEADER_CHECKSUM = 0xB861
+
+
+def reference_sum(data: bytes) -> int:
+    """
+    Sums the data as 16-bit big-endian words with end-around carry, padding an odd length with a zero byte.
+
+    :param data: the data
+    :return: the 16-bit one's complement sum
+    """
+
+    if len(data) % 2:
+        data += b"\x00"
+    total = 0
+    for i in range(0, len(data), 2):
+        total += data[i] << 8 | data[i + 1]
+        total = (total & 0xffff) + (total >> 16)
+    return total
+
+
+class ChecksumTest(unittest.TestCase):
+    def setUp(self):
+        self.rng = random.Random(1624)
+
+    def random_bytes(self, length: int) -> bytes:
+        return bytes(self.rng.randrange(256) for _ in range(length))
+
+    def test_known_header(self):
+        self.assertEqual(calculate_checksum(IP_HEADER), IP_HEADER_CHECKSUM)
+        header = IP_HEADER[:10] + IP_HEADER_CHECKSUM.to_bytes(2, "big") + IP_HEADER[12:]
+        self.assertEqual(calculate_checksum(header), 0)  # a packet with its checksum sums to 0xffff
+
+    def test_random_buffers(self):
+        for length in list(range(0, 64)) + [1499, 1500, 65535]:
+            data = self.random_bytes(length)
+            self.assertEqual(checksum_sum(data), reference_sum(data), "length %d" % length)
+
+    def test_split_at_every_offset(self):
+        for length in (40, 41, 57, 58):
+            data = self.random_bytes(length)
+            for i in range(length + 1):
+                for j in range(i, length + 1, 3):
+                    pieces = data[:i], memoryview(data)[i:j], bytearray(data[j:])
+                    message = "length %d split at %d and %d" % (length, i, j)
+                    self.assertEqual(checksum_sum(*pieces), reference_sum(data), message)
+
+    def test_odd_pieces(self):
+        for lengths in ((1, 1), (1, 2, 1), (3, 3, 3), (1, 1, 1, 1, 1), (0, 1, 0, 1)):
+            pieces = [self.random_bytes(length) for length in lengths]
+            self.assertEqual(checksum_sum(*pieces), reference_sum(b"".join(pieces)), lengths)
+
+    def test_zero_and_negative_zero(self):
+        self.assertEqual(checksum_sum(b""), 0)
+        self.assertEqual(checksum_sum(b"\x00" * 9), 0)  # all-zero data sums to +0
+        self.assertEqual(checksum_sum(b"\xff\xff"), 0xffff)  # non-zero data never does
+        self.assertEqual(checksum_sum(b"\x12\x34", b"\xed\xcb"), 0xffff)
+        self.assertEqual(reference_sum(b"\x12\x34\xed\xcb"), 0xffff)
+        self.assertEqual(calculate_checksum(b"\x12\x34\xed\xcb"), 0)
+
+    def test_update_matches_recompute(self):
+        for _ in range(2000):
+            data = bytearray(self.random_bytes(self.rng.choice((20, 40, 60, 61))))
+            checksum = calculate_checksum(data)
+            width = self.rng.choice((2, 4))
+            offset = self.rng.randrange(0, len(data) - width + 1, 2)
+            old = int.from_bytes(data[offset:offset + width], "big")
+            new = self.rng.randrange(1 << 8 * width)
+            data[offset:offset + width] = new.to_bytes(width, "big")
+            self.assertEqual(update_checksum(checksum, old, new), calculate_checksum(data))
+
+    def test_update_to_and_from_zero_sum(self):
+        data = bytearray(b"\x12\x34\x00\x00")
+        checksum = calculate_checksum(data)
+        data[2:4] = b"\xed\xcb"  # the sum becomes 0xffff, the checksum 0
+        self.assertEqual(update_checksum(checksum, 0, 0xEDCB), calculate_checksum(data))
+        self.assertEqual(update_checksum(calculate_checksum(data), 0xEDCB, 0), checksum)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+"""
+Feeds the chunked transfer-encoding decoder its input split at every offset, and at every pair of offsets for the
+short bodies, and checks the decoded body and where it stops.
+
+Usage: python3 test/test_chunked.py, or python3 -m pytest test
+"""
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from data import ChunkedDecoder  # noqa: E402
+
+BINARY = bytes(range(256)) * 3  # every byte value, CR and LF included
+
+# (encoded body, decoded body)
+BODIES = {
+    "simple": (b"4\r\nWiki\r\n5\r\npedia\r\n0\r\n\r\n", b"Wikipedia"),
+    "single chunk": (b"b\r\nhello world\r\n0\r\n\r\n", b"hello world"),
+    "empty": (b"0\r\n\r\n", b""),
+    "upper case size": (b"A\r\n0123456789\r\n0\r\n\r\n", b"0123456789"),
+    "padded size": (b"004\r\nWiki\r\n0000\r\n\r\n", b"Wiki"),
+    "extensions": (
+        b"4;name=value\r\nWiki\r\n5 ; quoted=\"a;b\"\r\npedia\r\n0;last\r\n\r\n",
+        b"Wikipedia",
+    ),
+    "trailers": (b"4\r\nWiki\r\n0\r\nExpires: never\r\nX-Checksum: 1234\r\n\r\n", b"Wiki"),
+    "extensions and trailers": (b"3;a=1\r\nabc\r\n0;b=2\r\nX-Trailer: yes\r\n\r\n", b"abc"),
+    "bare LF": (b"4\nWiki\n5\npedia\n0\nX-Trailer: yes\n\n", b"Wikipedia"),
+    "CRLF in the data": (b"6\r\n\r\n\r\n\r\n\r\n0\r\n\r\n", b"\r\n\r\n\r\n"),
+    "binary": (b"%x\r\n" % len(BINARY) + BINARY + b"\r\n0\r\n\r\n", BINARY),
+}
+NEXT_RESPONSE = b"HTTP/1.1 200 OK\r\n\r\n"  # pipelined bytes that follow the body
+
+
+def decode(pieces) -> tuple:
+    """
+    Runs a decoder over the given pieces, in order, until it's done.
+
+    :param pieces: the bytes-like pieces of the input
+    :return: the decoded body, the number of input bytes consumed and whether the decoder is done
+    """
+
+    body = bytearray()
+    decoder = ChunkedDecoder(body.extend)
+    consumed = 0
+    for piece in pieces:
+        if decoder.done:
+            break
+        consumed += decoder.feed(piece)
+    return bytes(body), consumed, decoder.done
+
+
+class ChunkedDecoderTest(unittest.TestCase):
+    def check(self, name: str, encoded: bytes, decoded: bytes, pieces: list):
+        """
+        Asserts that the pieces decode to the body and that the decoder stops at its end.
+
+        :param name: the body's name, for the failure message
+        :param encoded: the whole input
+        :param decoded: the expected body
+        :param pieces: the input split into pieces
+        """
+
+        body, consumed, done = decode(pieces)
+        splits = [len(piece) for piece in pieces]
+        self.assertTrue(done, "%s not done, split %s" % (name, splits))
+        self.assertEqual(body, decoded, "%s split %s" % (name, splits))
+        self.assertEqual(consumed, len(encoded), "%s split %s" % (name, splits))
+
+    def test_whole(self):
+        for name, (encoded, decoded) in BODIES.items():
+            self.check(name, encoded, decoded, [encoded])
+
+    def test_every_offset(self):
+        for name, (encoded, decoded) in BODIES.items():
+            for i in range(len(encoded) + 1):
+                self.check(name, encoded, decoded, [encoded[:i], encoded[i:]])
+
+    def test_every_pair_of_offsets(self):
+        for name, (encoded, decoded) in BODIES.items():
+            if len(encoded) > 64:
+                continue
+            for i in range(len(encoded) + 1):
+                for j in range(i, len(encoded) + 1):
+                    self.check(name, encoded, decoded, [encoded[:i], encoded[i:j], encoded[j:]])
+
+    def test_byte_at_a_time(self):
+        for name, (encoded, decoded) in BODIES.items():
+            self.check(name, encoded, decoded, [encoded[i:i + 1] for i in range(len(encoded))])
+
+    def test_memoryview_pieces(self):
+        for name, (encoded, decoded) in BODIES.items():
+            view = memoryview(encoded)
+            for i in range(len(encoded) + 1):
+                self.check(name, encoded, decoded, [view[:i], view[i:]])
+
+    def test_stops_at_the_end(self):
+        for name, (encoded, decoded) in BODIES.items():
+            stream = encoded + NEXT_RESPONSE
+            for i in range(len(stream) + 1):
+                body, consumed, done = decode([stream[:i], stream[i:]])
+                self.assertTrue(done, "%s split at %d" % (name, i))
+                self.assertEqual(body, decoded, "%s split at %d" % (name, i))
+                self.assertEqual(consumed, len(encoded), "%s split at %d" % (name, i))
+                self.assertEqual(stream[consumed:], NEXT_RESPONSE)
+
+    def test_truncated(self):
+        for name, (encoded, decoded) in BODIES.items():
+            for i in range(len(encoded)):
+                body, consumed, done = decode([encoded[:i]])
+                self.assertFalse(done, "%s cut at %d" % (name, i))
+                self.assertEqual(consumed, i)
+                self.assertTrue(decoded.startswith(body), "%s cut at %d" % (name, i))
+
+    def test_invalid_size(self):
+        for encoded in (b"zz\r\nWiki\r\n0\r\n\r\n", b"\r\nWiki\r\n0\r\n\r\n", b"-4\r\nWiki\r\n0\r\n\r\n"):
+            for i in range(len(encoded) + 1):
+                with self.assertRaises(ValueError):
+                    decode([encoded[:i], encoded[i:]])
+
+    def test_data_longer_than_size(self):
+        encoded = b"3\r\nWiki\r\n0\r\n\r\n"
+        for i in range(len(encoded) + 1):
+            with self.assertRaises(ValueError):
+                decode([encoded[:i], encoded[i:]])
+
+    def test_line_too_long(self):
+        with self.assertRaises(ValueError):
+            decode([b"4;" + b"x" * 10000 + b"\r\nWiki\r\n0\r\n\r\n"])
+
+
+if __name__ == "__main__":
+    unittest.main()
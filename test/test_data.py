@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+"""
+Checks the streaming response parser: the framing the headers announce, where a response ends on a persistent
+connection, header values that aren't UTF-8, and the responses it refuses.
+
+Usage: python3 test/test_data.py, or python3 -m pytest test
+"""
+import io
+import os
+import sys
+import tempfile
+import unittest
+from contextlib import redirect_stderr
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from data import Data  # noqa: E402
+
+BODY = b"0123456789" * 30
+CHUNKED_BODY = b"%x\r\n" % len(BODY) + BODY + b"\r\n0\r\n\r\n"
+NEXT_RESPONSE = b"HTTP/1.1 200 OK\r\nContent-Length: 2\r\n\r\nok"
+
+
+def response(*headers: str, body: bytes = BODY) -> bytes:
+    """
+    Builds an HTTP response.
+
+    :param headers: the header lines
+    :param body: the encoded body
+    :return: the response
+    """
+
+    return ("HTTP/1.1 200 OK\r\n" + "".join(header + "\r\n" for header in headers) + "\r\n").encode() + body
+
+
+class DataTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.file_name = os.path.join(self.directory.name, "body")
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def feed(self, stream: bytes, piece_size: int = 7) -> tuple:
+        """
+        Streams a response to a file, in pieces, until it is complete.
+
+        :param stream: the response and whatever follows it on the connection
+        :param piece_size: the size of the pieces
+        :return: the Data, the saved body and the bytes past the end of the response
+        """
+
+        data = Data("example.com", "/body", self.file_name)
+        rest = b""
+        for offset in range(0, len(stream), piece_size):
+            rest = data.feed(stream[offset:offset + piece_size])
+            if data.framed and data.complete:
+                rest += stream[offset + piece_size:]
+                break
+        data.file.close()
+        with open(self.file_name, "rb") as fd:
+            return data, fd.read(), rest
+
+    def test_content_length(self):
+        data, body, rest = self.feed(response("Content-Length: %d" % len(BODY)) + NEXT_RESPONSE)
+        self.assertFalse(data.chunked)
+        self.assertEqual(body, BODY)
+        self.assertEqual(rest, NEXT_RESPONSE)
+
+    def test_transfer_codings(self):
+        for value in ("chunked", "Chunked", "chunked ", "gzip, chunked", "gzip,chunked", "deflate , gzip ,  chunked"):
+            data, body, rest = self.feed(response("Transfer-Encoding: " + value, body=CHUNKED_BODY) + NEXT_RESPONSE)
+            self.assertTrue(data.chunked, value)
+            self.assertEqual(body, BODY, value)
+            self.assertEqual(rest, NEXT_RESPONSE, value)
+
+    def test_chunked_not_last(self):
+        data, body, _ = self.feed(response("Transfer-Encoding: chunked, gzip"))  # read until the server closes
+        self.assertFalse(data.chunked)
+        self.assertFalse(data.framed)
+        self.assertEqual(body, BODY)
+
+    def test_persistent(self):
+        for version, connection, persistent in (
+            ("HTTP/1.1", "", True),
+            ("HTTP/1.1", "Connection: close", False),
+            ("HTTP/1.0", "", False),
+            ("HTTP/1.0", "Connection: keep-alive", True),
+        ):
+            headers = ["Content-Length: %d" % len(BODY)] + ([connection] if connection else [])
+            data, _, _ = self.feed(response(*headers).replace(b"HTTP/1.1", version.encode(), 1))
+            self.assertEqual(data.persistent, persistent, (version, connection))
+
+    def test_latin1_header(self):
+        headers = ["Content-Length: %d" % len(BODY), "Content-Disposition: attachment; filename=caf\xe9.txt"]
+        stream = response(*headers).replace(b"caf\xc3\xa9", b"caf\xe9")  # one byte, not UTF-8
+        data, body, _ = self.feed(stream)
+        self.assertEqual(data.headers["content-disposition"], "attachment; filename=caf\xe9.txt")
+        self.assertEqual(body, BODY)
+
+    def test_headers_too_long(self):
+        data = Data("example.com", "/body", self.file_name)
+        data.feed(b"HTTP/1.1 200 OK\r\n")
+        with self.assertRaises(SystemExit):
+            for _ in range(100):
+                data.feed(b"X-Padding: " + b"x" * 1000 + b"\r\n")  # never a blank line
+        self.assertLess(len(data.head), 70000)
+
+    def test_invalid_content_length(self):
+        for value in ("-1", "abc", "+300", "1_000", "0x12c", "300, 300", ""):
+            data = Data("example.com", "/body", self.file_name)
+            with self.assertRaises(SystemExit, msg=value), redirect_stderr(io.StringIO()) as stderr:
+                data.feed(response("Content-Length: " + value))
+            self.assertEqual(stderr.getvalue(), "Invalid Content-Length received: %s\n" % value)
+            self.assertIsNone(data.file)  # refused before anything is written
+        data, body, _ = self.feed(response("Content-Length: oops", "Transfer-Encoding: chunked", body=CHUNKED_BODY))
+        self.assertEqual(body, BODY)  # ignored with the chunked encoding
+
+    def test_malformed_chunked_body(self):
+        data = Data("example.com", "/body", self.file_name)
+        with self.assertRaises(SystemExit), redirect_stderr(io.StringIO()) as stderr:
+            data.feed(response("Transfer-Encoding: chunked", body=b"2\r\nok\r\n-1\r\n"))
+        data.file.close()
+        self.assertTrue(stderr.getvalue().startswith("Invalid chunked body received: Invalid chunk size line"))
+        self.assertTrue(data.malformed)  # download() doesn't offer to resume it
+
+    def test_long_headers_within_limit(self):
+        headers = ["X-Padding-%d: %s" % (i, "x" * 1000) for i in range(60)] + ["Content-Length: %d" % len(BODY)]
+        _, body, _ = self.feed(response(*headers), piece_size=1000)
+        self.assertEqual(body, BODY)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+"""
+Checks the received IP pkt parser on crafted pkts: header fields, an IHL above 5, a total length shorter than the
+buffer (Ethernet padding), and the pkts it drops: truncated ones, an IHL below 5 and a corrupt header checksum.
+
+Usage: python3 test/test_ip_pkt.py, or python3 -m pytest test
+"""
+import os
+import socket
+import struct
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from ip_pkt import IPPacket  # noqa: E402
+from tcp_pkt import HeaderTemplate  # noqa: E402
+from utils import calculate_checksum  # noqa: E402
+
+SERVER, US = "93.184.216.34", "10.0.0.2"
+PAYLOAD = b"payload"
+IP_OPTIONS = bytes((1, 1, 1, 1, 1, 1, 1, 0))  # NOPs then end of options
+
+
+def pkt() -> bytes:
+    """
+    Builds a TCP pkt from the server, with a payload.
+
+    :return: the raw IP pkt
+    """
+
+    return bytes(HeaderTemplate(SERVER, 80, US, 40000).stamp(1, 1, 65535, payload=PAYLOAD)) + PAYLOAD
+
+
+def with_header(raw_pkt: bytes, header: bytes) -> bytes:
+    """
+    Replaces the IP header of a pkt, updating its total length and checksum.
+
+    :param raw_pkt: the raw IP pkt, without options
+    :param header: the new header, options included
+    :return: the raw IP pkt
+    """
+
+    header = bytearray(header)
+    header[0] = 0x40 | len(header) // 4
+    header[2:4] = (len(header) + len(raw_pkt) - 20).to_bytes(2, "big")
+    header[10:12] = b"\x00\x00"
+    header[10:12] = calculate_checksum(header).to_bytes(2, "big")
+    return bytes(header) + raw_pkt[20:]
+
+
+class IPPacketViewTest(unittest.TestCase):
+    def test_fields(self):
+        raw_pkt = pkt()
+        ip_pkt = IPPacket.unpack(raw_pkt)
+        self.assertEqual((ip_pkt.src, ip_pkt.dst), (SERVER, US))
+        self.assertEqual(ip_pkt.protocol, socket.IPPROTO_TCP)
+        self.assertEqual(ip_pkt.ttl, 255)
+        self.assertEqual(ip_pkt.header_length, 20)
+        self.assertEqual(ip_pkt.total_length, len(raw_pkt))
+        self.assertEqual(ip_pkt.checksum, struct.unpack_from("!H", raw_pkt, 10)[0])
+        self.assertEqual(bytes(ip_pkt.addrs), socket.inet_aton(SERVER) + socket.inet_aton(US))
+        self.assertEqual(bytes(ip_pkt.data), raw_pkt[20:])
+
+    def test_options(self):
+        raw_pkt = pkt()
+        with_options = with_header(raw_pkt, raw_pkt[:20] + IP_OPTIONS)
+        ip_pkt = IPPacket.unpack(with_options)
+        self.assertEqual(ip_pkt.header_length, 28)
+        self.assertEqual(ip_pkt.total_length, len(raw_pkt) + len(IP_OPTIONS))
+        self.assertEqual(bytes(ip_pkt.data), raw_pkt[20:])  # the options aren't part of the data
+        self.assertEqual((ip_pkt.src, ip_pkt.dst), (SERVER, US))
+
+    def test_ethernet_padding(self):
+        raw_pkt = pkt()
+        ip_pkt = IPPacket.unpack(raw_pkt + bytes(6))  # short frames are padded to 60 bytes
+        self.assertEqual(ip_pkt.total_length, len(raw_pkt))
+        self.assertEqual(bytes(ip_pkt.data), raw_pkt[20:])
+
+    def test_truncated(self):
+        raw_pkt = pkt()
+        for length in (0, 1, 19):
+            self.assertIsNone(IPPacket.unpack(raw_pkt[:length]), length)
+        with_options = with_header(raw_pkt, raw_pkt[:20] + IP_OPTIONS)
+        self.assertIsNone(IPPacket.unpack(with_options[:24]))  # ends within the options
+        ip_pkt = IPPacket.unpack(raw_pkt[:-2])  # ends within the data: the view holds what arrived
+        self.assertEqual(ip_pkt.total_length, len(raw_pkt) - 2)
+
+    def test_header_length_below_5(self):
+        raw_pkt = bytearray(pkt())
+        for ihl in (0, 4):
+            raw_pkt[0] = 0x40 | ihl
+            self.assertIsNone(IPPacket.unpack(bytes(raw_pkt)), ihl)
+
+    def test_corrupt_checksum(self):
+        raw_pkt = pkt()
+        for offset in (2, 8, 10, 15, 19):  # the length, TTL, checksum and addresses
+            corrupt = bytearray(raw_pkt)
+            corrupt[offset] ^= 0x10
+            self.assertIsNone(IPPacket.unpack(bytes(corrupt)), offset)
+        corrupt = bytearray(raw_pkt)
+        corrupt[-1] ^= 0x10  # the data isn't covered by the IP checksum
+        self.assertIsNotNone(IPPacket.unpack(bytes(corrupt)))
+
+
+if __name__ == "__main__":
+    unittest.main()
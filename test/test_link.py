@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+"""
+Checks the local port pool (FIFO order, reuse after release, reserving another block once one is used up) and the
+DNS cache of resolve_host, whose answers expire after DNS_TTL seconds of a simulated clock.
+
+Usage: python3 test/test_link.py, or python3 -m pytest test
+"""
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from link import PortPool, PORT_BLOCK  # noqa: E402
+from sim_link import SimClock  # noqa: E402
+from utils import resolve_host, DNS_TTL, HOST_CACHE  # noqa: E402
+
+HOST = "127.0.0.1"  # resolves to itself, without asking a DNS server
+
+
+class PortPoolTest(unittest.TestCase):
+    def setUp(self):
+        self.pool = PortPool()
+
+    def tearDown(self):
+        for sock in self.pool.held.values():  # the pool keeps its ports for as long as the program runs
+            sock.close()
+
+    def test_fifo(self):
+        ports = [self.pool.take() for _ in range(3)]
+        self.assertEqual(len(set(ports)), 3)
+        self.assertEqual(ports, list(self.pool.held)[:3])  # in the order they were reserved
+        self.assertEqual(self.pool.taken, set(ports))
+
+    def test_reuse_after_release(self):
+        first, second = self.pool.take(), self.pool.take()
+        self.pool.release(second)
+        self.pool.release(first)
+        self.assertNotIn(first, self.pool.taken)
+        self.assertEqual(list(self.pool.free)[-2:], [second, first])  # reused last, oldest release first
+        for _ in range(PORT_BLOCK - 2):  # the rest of the block
+            self.assertNotIn(self.pool.take(), (first, second))
+        self.assertEqual((self.pool.take(), self.pool.take()), (second, first))
+        self.assertEqual(len(self.pool.held), PORT_BLOCK)  # no other block was needed
+
+    def test_release_foreign_port(self):
+        port = self.pool.take()
+        self.pool.release(port)
+        self.pool.release(port)  # twice
+        self.pool.release(1)  # not from the pool
+        self.assertEqual(list(self.pool.free).count(port), 1)
+        self.assertNotIn(1, self.pool.free)
+
+    def test_refill(self):
+        ports = [self.pool.take() for _ in range(PORT_BLOCK)]
+        self.assertEqual(len(self.pool.held), PORT_BLOCK)
+        self.assertEqual(len(self.pool.free), 0)
+        port = self.pool.take()  # reserves another block
+        self.assertEqual(len(self.pool.held), 2 * PORT_BLOCK)
+        self.assertEqual(len(self.pool.free), PORT_BLOCK - 1)
+        self.assertNotIn(port, ports)
+        self.assertEqual(len(set(self.pool.held)), 2 * PORT_BLOCK)  # each held by its own socket
+
+
+class ResolveHostTest(unittest.TestCase):
+    def setUp(self):
+        self.clock = SimClock()
+        installed = self.clock.installed()
+        installed.__enter__()
+        self.addCleanup(installed.__exit__, None, None, None)
+        self.addCleanup(HOST_CACHE.pop, HOST, None)
+        HOST_CACHE.pop(HOST, None)
+
+    def test_expiry(self):
+        self.assertEqual(resolve_host(HOST), HOST)
+        self.assertEqual(HOST_CACHE[HOST], (HOST, self.clock.now + DNS_TTL))
+        HOST_CACHE[HOST] = ("192.0.2.1", HOST_CACHE[HOST][1])  # tells a cached answer from a fresh one
+        self.clock.sleep(DNS_TTL - 1)
+        self.assertEqual(resolve_host(HOST), "192.0.2.1")  # still cached
+        self.clock.sleep(1)
+        self.assertEqual(resolve_host(HOST), HOST)  # expired: resolved again
+        self.assertEqual(HOST_CACHE[HOST], (HOST, self.clock.now + DNS_TTL))
+
+
+if __name__ == "__main__":
+    unittest.main()
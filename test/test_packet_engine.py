@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+"""
+Checks PacketEngine's demultiplexing on the shared endpoint of a SimLink: interleaved pkts of two registered flows
+and an unknown one each reach their own connection only, an unregistered connection gets nothing more, and whole
+downloads share one engine.
+
+Usage: python3 test/test_packet_engine.py, or python3 -m pytest test
+"""
+import asyncio
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from download import download_async  # noqa: E402
+from packet_engine import PacketEngine  # noqa: E402
+from sim_link import SimLink, CLIENT_HOST, SERVER_HOST  # noqa: E402
+from sim_peer import ScriptedServer  # noqa: E402
+from socket_filter import FlowFilter  # noqa: E402
+from tcp_pkt import HeaderTemplate  # noqa: E402
+from temp_dir import TempDirTest  # noqa: E402
+
+FILES = {"/a.bin": os.urandom(200000), "/b.bin": os.urandom(150000), "/c.bin": os.urandom(3000)}
+
+
+class Recorder:
+    """
+    A connection that records the pkts the engine hands it.
+    """
+
+    def __init__(self, port: int):
+        self.flow = FlowFilter(CLIENT_HOST, port, SERVER_HOST, 80)
+        self.pkts = []
+        self.events = 0
+
+    def on_raw_pkt(self, raw_pkt):
+        self.pkts.append(bytes(raw_pkt))
+
+    def after_event(self):
+        self.events += 1
+
+
+def server_pkt(port: int, seq_num: int) -> bytes:
+    """
+    Builds a pkt from the server to one of our ports.
+
+    :param port: our port
+    :param seq_num: the sequence number, telling the pkts apart
+    :return: the raw IP pkt
+    """
+
+    return bytes(HeaderTemplate(SERVER_HOST, 80, CLIENT_HOST, port).stamp(seq_num, 0, 65535))
+
+
+class PacketEngineTest(unittest.TestCase):
+    def setUp(self):
+        self.link = SimLink(ScriptedServer(FILES))
+        self.engine = PacketEngine(self.link)
+        self.first, self.second = Recorder(40100), Recorder(40200)
+        self.engine.register(self.first)
+        self.engine.register(self.second)
+
+    def tearDown(self):
+        self.engine.close()
+
+    def deliver(self, *pkts: bytes):
+        """
+        Puts pkts on the engine's endpoint and has it dispatch them, as the event loop would.
+
+        :param pkts: the raw IP pkts
+        """
+
+        self.engine.recv_ring.inbox.extend(pkts)
+        self.engine.on_readable()
+
+    def test_demultiplex(self):
+        pkts = [server_pkt(port, seq_num) for seq_num in range(3) for port in (40100, 40300, 40200)]
+        self.deliver(*pkts)
+        self.assertEqual(self.first.pkts, pkts[0::3])
+        self.assertEqual(self.second.pkts, pkts[2::3])
+        self.assertEqual((self.first.events, self.second.events), (1, 1))  # once for the whole batch
+        self.assertEqual(len(self.engine.recv_ring), 0)  # the unknown flow's pkts are dropped
+
+    def test_unregister(self):
+        self.deliver(server_pkt(40100, 0), server_pkt(40200, 0))
+        self.engine.unregister(self.first)
+        self.assertNotIn(self.first.flow.key, self.engine)
+        self.deliver(server_pkt(40100, 1), server_pkt(40200, 1))
+        self.assertEqual(self.first.pkts, [server_pkt(40100, 0)])
+        self.assertEqual(self.second.pkts, [server_pkt(40200, 0), server_pkt(40200, 1)])
+
+
+class SharedDownloadTest(TempDirTest, unittest.IsolatedAsyncioTestCase):
+    async def test_downloads(self):
+        link = SimLink(ScriptedServer(FILES), bandwidth=50e6, rtt=0.01, loss=0.01, seed=16)
+        engine = PacketEngine(link)
+        try:
+            await asyncio.gather(*(download_async("http://sim" + path, engine=engine) for path in FILES))
+        finally:
+            engine.close()
+        for path, body in FILES.items():
+            with open(path[1:], "rb") as fd:
+                self.assertTrue(fd.read() == body, path)  # not assertEqual, which would print the body
+        self.assertEqual(engine.connections, {})
+        self.assertEqual(link.endpoints, {})  # no connection opened its own endpoint
+
+
+if __name__ == "__main__":
+    unittest.main()
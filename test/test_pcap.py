@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+"""
+Checks the pcap capture and replay: a download over a lossy SimLink is captured through a CaptureLink, then replayed
+through a ReplayLink, and both save the same file byte for byte. Also checks that replayed SYN-ACKs lose their
+timestamps option, wherever it sits, with a valid checksum.
+
+Usage: python3 test/test_pcap.py, or python3 -m pytest test
+"""
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from download import download  # noqa: E402
+from ip_pkt import IPPacket  # noqa: E402
+from pcap import CaptureLink, ReplayLink, read_pcap, strip_timestamps  # noqa: E402
+from sim_link import SimLink, CLIENT_HOST, SERVER_HOST  # noqa: E402
+from sim_peer import ScriptedServer  # noqa: E402
+from tcp_pkt import HeaderTemplate, TCPOptions, TCPPacket, SYN, ACK, NOP  # noqa: E402
+from temp_dir import TempDirTest  # noqa: E402
+
+BODY = os.urandom(300000)
+FILES = {"/body": BODY}
+LOSSY_LINK = dict(bandwidth=50e6, rtt=0.01, loss=0.02, reorder=0.02, duplicate=0.01, seed=24)
+
+
+def syn_ack(options: bytes) -> bytes:
+    """
+    Builds a SYN-ACK from the server.
+
+    :param options: the encoded options
+    :return: the raw IP pkt
+    """
+
+    header = HeaderTemplate(SERVER_HOST, 80, CLIENT_HOST, 40000).stamp(7, 1001, 65535, SYN | ACK, options=options)
+    return bytes(header) + options
+
+
+def parse(raw_pkt: bytes):
+    """
+    Parses a pkt, checksums included.
+
+    :param raw_pkt: the raw IP pkt
+    :return: the TCP pkt, None if it is invalid
+    """
+
+    ip_pkt = IPPacket.unpack(raw_pkt=memoryview(raw_pkt))
+    return TCPPacket.unpack(ip_pkt=ip_pkt, raw_tcp_pkt=ip_pkt.data)
+
+
+class PcapTest(TempDirTest, unittest.TestCase):
+    def test_capture_replay(self):
+        capture = CaptureLink(SimLink(ScriptedServer(FILES), **LOSSY_LINK), "body.pcap")
+        download("http://sim/body", link=capture)
+        capture.writer.close()
+        os.rename("body", "captured")
+        self.assertGreater(len(list(read_pcap("body.pcap"))), len(BODY) // 1460)
+        download("http://sim/body", link=ReplayLink("body.pcap"))
+        for file_name in ("captured", "body"):
+            with open(file_name, "rb") as fd:
+                self.assertTrue(fd.read() == BODY, file_name)  # not assertEqual, which would print the body
+
+    def test_strip_timestamps(self):
+        timestamps = TCPOptions(timestamps=(123456, 654321)).pack()
+        for options in (
+            TCPOptions(mss=1460, sack_permitted=True, timestamps=(123456, 654321), window_scale=7).pack(),
+            TCPOptions(mss=1460).pack() + bytes((NOP,)) + timestamps[timestamps.index(8):] + bytes((NOP,)),  # odd
+        ):
+            stripped = parse(strip_timestamps(syn_ack(options)))
+            self.assertIsNotNone(stripped)  # the checksum still holds
+            decoded = TCPOptions.unpack(stripped.options)
+            self.assertIsNone(decoded.timestamps)
+            self.assertEqual(decoded.mss, 1460)
+
+    def test_strip_timestamps_other_pkts(self):
+        raw_pkt = syn_ack(TCPOptions(mss=1460).pack())
+        self.assertEqual(strip_timestamps(raw_pkt), raw_pkt)  # no timestamps
+        header = HeaderTemplate(SERVER_HOST, 80, CLIENT_HOST, 40000).stamp(8, 1001, 65535, ACK, b"data")
+        self.assertEqual(strip_timestamps(bytes(header) + b"data"), bytes(header) + b"data")  # not a SYN
+
+
+if __name__ == "__main__":
+    unittest.main()
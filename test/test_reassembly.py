@@ -0,0 +1,176 @@
+#!/usr/bin/env python3
+"""
+Checks the reassembly queue: in-order, duplicate and overlapping segments, gaps being filled, seq_nums wrapping
+around 2^32, bytes past the receive window, the SACK blocks and their order, and random shuffles of re-segmented
+streams.
+
+Usage: python3 test/test_reassembly.py, or python3 -m pytest test
+"""
+import os
+import random
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from reassembly import ReassemblyQueue  # noqa: E402
+from tcp_pkt import SEQ_SPACE  # noqa: E402
+
+STREAM = bytes(range(256)) * 40
+
+
+class Receiver:
+    """
+    A reassembly queue starting at a given seq_num, that collects the delivered bytes.
+    """
+
+    def __init__(self, isn: int = 1000, window: int = None):
+        self.isn = isn
+        self.data = bytearray()
+        self.queue = ReassemblyQueue(isn, self.data.extend, window)
+
+    def add(self, start: int, end: int) -> int:
+        """
+        Adds STREAM[start:end] as a segment, passed as a view of a buffer that is clobbered right after, like a
+        receive ring slot.
+
+        :param start: the segment's stream offset
+        :param end: the segment's end stream offset
+        :return: the number of bytes delivered
+        """
+
+        buffer = bytearray(STREAM[start:end])
+        delivered = self.queue.add((self.isn + start) % SEQ_SPACE, memoryview(buffer))
+        buffer[:] = b"\xee" * len(buffer)
+        return delivered
+
+    def sack(self, max_blocks: int = 4) -> list:
+        """
+        Returns the SACK blocks as stream offsets.
+
+        :param max_blocks: the maximum number of blocks
+        :return: the (start, end) tuples
+        """
+
+        return [
+            ((left - self.isn) % SEQ_SPACE, (right - self.isn) % SEQ_SPACE)
+            for left, right in self.queue.sack_blocks(max_blocks)
+        ]
+
+
+class ReassemblyQueueTest(unittest.TestCase):
+    def test_in_order(self):
+        receiver = Receiver()
+        self.assertEqual(receiver.add(0, 100), 100)
+        self.assertEqual(receiver.add(100, 250), 150)
+        self.assertEqual(receiver.data, STREAM[:250])
+        self.assertEqual(receiver.queue.next_seq, receiver.isn + 250)
+        self.assertEqual(len(receiver.queue), 0)
+
+    def test_duplicate(self):
+        receiver = Receiver()
+        receiver.add(0, 100)
+        self.assertEqual(receiver.add(0, 100), 0)
+        self.assertEqual(receiver.add(20, 60), 0)
+        self.assertEqual(receiver.data, STREAM[:100])
+
+    def test_overlapping_retransmission(self):
+        receiver = Receiver()
+        receiver.add(0, 100)
+        self.assertEqual(receiver.add(50, 180), 80)  # only the new tail is delivered
+        self.assertEqual(receiver.data, STREAM[:180])
+
+    def test_fill_gap(self):
+        receiver = Receiver()
+        self.assertEqual(receiver.add(100, 200), 0)
+        self.assertEqual(receiver.add(300, 400), 0)
+        self.assertEqual(len(receiver.queue), 2)
+        self.assertEqual(receiver.add(0, 100), 200)  # delivers up to the next gap
+        self.assertEqual(len(receiver.queue), 1)
+        self.assertEqual(receiver.add(200, 300), 200)
+        self.assertEqual(receiver.data, STREAM[:400])
+        self.assertEqual(len(receiver.queue), 0)
+
+    def test_fill_several_gaps_at_once(self):
+        receiver = Receiver()
+        receiver.add(100, 200)
+        receiver.add(250, 300)
+        receiver.add(300, 350)  # touches the previous block, merged
+        self.assertEqual(len(receiver.queue), 2)
+        receiver.add(180, 260)  # overlaps both blocks, merged into one
+        self.assertEqual(len(receiver.queue), 1)
+        self.assertEqual(receiver.add(0, 120), 350)
+        self.assertEqual(receiver.data, STREAM[:350])
+
+    def test_overlapping_out_of_order(self):
+        receiver = Receiver()
+        receiver.add(100, 200)
+        receiver.add(150, 250)
+        receiver.add(90, 110)
+        receiver.add(400, 500)
+        receiver.add(380, 520)  # covers a whole block
+        self.assertEqual(receiver.sack(), [(380, 520), (90, 250)])
+        receiver.add(0, 90)
+        receiver.add(250, 380)
+        self.assertEqual(receiver.data, STREAM[:520])
+
+    def test_window(self):
+        receiver = Receiver(window=500)
+        self.assertEqual(receiver.add(500, 600), 0)  # entirely past the window
+        self.assertEqual(len(receiver.queue), 0)
+        receiver.add(300, 700)  # trimmed to the window
+        self.assertEqual(receiver.sack(), [(300, 500)])
+        self.assertEqual(receiver.add(0, 300), 500)
+        self.assertEqual(receiver.add(500, 1200), 500)  # in order, the window moved with the next expected byte
+        self.assertEqual(receiver.data, STREAM[:1000])
+
+    def test_wraparound(self):
+        receiver = Receiver(SEQ_SPACE - 150)
+        receiver.add(0, 100)
+        self.assertEqual(receiver.add(200, 300), 0)  # buffered past 2^32
+        self.assertEqual(receiver.sack(), [(200, 300)])
+        self.assertEqual(receiver.queue.sack_blocks(1), [(50, 150)])
+        self.assertEqual(receiver.add(100, 200), 200)  # fills the gap across 2^32
+        self.assertEqual(receiver.data, STREAM[:300])
+        self.assertEqual(receiver.queue.next_seq, 150)
+        self.assertEqual(receiver.add(50, 120), 0)  # an old duplicate from before 2^32
+
+    def test_sack_order(self):
+        receiver = Receiver()
+        receiver.add(100, 150)
+        receiver.add(300, 350)
+        receiver.add(500, 550)
+        self.assertEqual(receiver.sack(), [(500, 550), (100, 150), (300, 350)])  # the latest first, then in order
+        receiver.add(150, 200)  # extends the first block, which becomes the latest
+        self.assertEqual(receiver.sack(), [(100, 200), (300, 350), (500, 550)])
+        self.assertEqual(receiver.sack(2), [(100, 200), (300, 350)])
+        receiver.add(0, 100)  # delivers the latest block, the others keep their order
+        self.assertEqual(receiver.sack(), [(300, 350), (500, 550)])
+        receiver.add(200, 600)
+        self.assertEqual(receiver.sack(), [])
+
+    def test_random_shuffles(self):
+        rng = random.Random(6)
+        for isn in (0, 1000, SEQ_SPACE - 3000, SEQ_SPACE - 1):
+            for _ in range(50):
+                receiver = Receiver(isn)
+                segments = []
+                offset = 0
+                while offset < len(STREAM):
+                    end = min(offset + rng.randint(1, 700), len(STREAM))
+                    segments.append((offset, end))
+                    if rng.random() < 0.3:  # re-segmented retransmission overlapping its neighbours
+                        first = max(offset - rng.randint(0, 300), 0)
+                        segments.append((first, min(end + rng.randint(0, 300), len(STREAM))))
+                    offset = end
+                segments += rng.sample(segments, len(segments) // 5)  # duplicates
+                rng.shuffle(segments)
+                delivered = sum(receiver.add(start, end) for start, end in segments)
+                self.assertEqual(receiver.data, STREAM)
+                self.assertEqual(delivered, len(STREAM))
+                self.assertEqual(len(receiver.queue), 0)
+                self.assertEqual(receiver.queue.next_seq, (isn + len(STREAM)) % SEQ_SPACE)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+"""
+Runs segmented downloads through download_segmented() over a SimLink: a file fetched whole over several connections,
+then servers whose answers to the later ranges don't fit: a 206 shorter than the range, a 200 ignoring the range, and
+a file size that changed since the first response. Those fail the download, and every connection is released.
+
+Usage: python3 test/test_segmented.py, or python3 -m pytest test
+"""
+import contextlib
+import io
+import os
+import re
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from download import download_segmented, FIRST_SEGMENT_SIZE  # noqa: E402
+from packet_engine import PacketEngine  # noqa: E402
+from sim_link import SimLink  # noqa: E402
+from sim_peer import ScriptedServer  # noqa: E402
+from temp_dir import TempDirTest  # noqa: E402
+
+BODY = os.urandom(3 * FIRST_SEGMENT_SIZE + 1000)
+FILES = {"/body": BODY}
+LATER_RANGE = re.compile(rb"\r\nRange: bytes=([1-9]\d*)-(\d*)")  # a range past the first response's
+
+
+class ShortServer(ScriptedServer):
+    """
+    A ScriptedServer that answers the later ranges with 1000 bytes less than asked for.
+    """
+
+    def respond(self, request: bytes) -> tuple:
+        match = LATER_RANGE.search(request)
+        if match and match[2]:
+            request = request.replace(match[0], b"\r\nRange: bytes=%s-%d" % (match[1], int(match[2]) - 1000))
+        return super().respond(request)
+
+
+class IgnoringServer(ScriptedServer):
+    """
+    A ScriptedServer that answers the later ranges with the whole file.
+    """
+
+    def respond(self, request: bytes) -> tuple:
+        return super().respond(LATER_RANGE.sub(b"", request))
+
+
+class ChangingServer(ScriptedServer):
+    """
+    A ScriptedServer whose file grows right after the first response.
+    """
+
+    def respond(self, request: bytes) -> tuple:
+        response = super().respond(request)
+        self.files = {"/body": BODY + b"more"}
+        return response
+
+
+class SegmentedTest(TempDirTest, unittest.IsolatedAsyncioTestCase):
+    async def download(self, server: ScriptedServer) -> int:
+        """
+        Downloads the body over 4 connections sharing a PacketEngine, then checks they are all released.
+
+        :param server: the ScriptedServer
+        :return: the number of bytes received
+        """
+
+        link = SimLink(server, rtt=0.005)
+        engine = PacketEngine(link)
+        try:
+            return await download_segmented("http://sim/body", 4, engine)
+        finally:
+            self.assertEqual(engine.connections, {})
+            engine.close()
+
+    async def test_segments(self):
+        received = await self.download(ScriptedServer(FILES))
+        with open("body", "rb") as fd:
+            self.assertTrue(fd.read() == BODY)  # not assertEqual, which would print megabytes
+        self.assertGreater(received, len(BODY))
+
+    async def test_short_range(self):
+        with self.assertRaises(ConnectionError), contextlib.redirect_stderr(io.StringIO()) as stderr:
+            await self.download(ShortServer(FILES))
+        self.assertIn("Invalid Content-Range", stderr.getvalue())
+
+    async def test_range_ignored(self):
+        with self.assertRaises(ConnectionError), contextlib.redirect_stderr(io.StringIO()) as stderr:
+            await self.download(IgnoringServer(FILES))
+        self.assertIn("Invalid HTTP status code received: 200", stderr.getvalue())
+
+    async def test_size_changed(self):
+        with self.assertRaisesRegex(ConnectionError, "file size changed"):
+            await self.download(ChangingServer(FILES))
+
+
+if __name__ == "__main__":
+    unittest.main()
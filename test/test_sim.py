@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+"""
+Runs whole downloads through the stack over a SimLink, against the ScriptedServer: clean and lossy links, chunked
+responses, persistent connections with and without pipelining, and a download interrupted then resumed with a
+Range request. Each one checks the saved files byte for byte. They run on a simulated clock, so how far a download
+gets before it is interrupted doesn't depend on the machine's speed.
+
+Usage: python3 test/test_sim.py, or python3 -m pytest test
+"""
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from download import download, download_persistent  # noqa: E402
+from journal import PARTIAL_SUFFIX, JOURNAL_SUFFIX  # noqa: E402
+from sim_link import SimLink, SimClock, FIRST_PORT  # noqa: E402
+from sim_peer import ScriptedServer  # noqa: E402
+from temp_dir import TempDirTest  # noqa: E402
+
+BODY = os.urandom(1 << 20)
+FILES = {"/body": BODY, "/a.bin": os.urandom(100000), "/b.bin": os.urandom(3000), "/c.bin": os.urandom(250000)}
+LOSSY_LINK = dict(bandwidth=50e6, rtt=0.01, loss=0.02, reorder=0.02, duplicate=0.01, seed=21)
+SLOW_LINK = dict(bandwidth=20e6, rtt=0.005)  # the body trickles in, rather than in a single burst
+INTERRUPT_AFTER = 300  # pkts delivered to the client before the first attempt is interrupted
+
+
+class InterruptedLink(SimLink):
+    """
+    A SimLink that stops the program, as Ctrl-C would, once it delivered a given number of pkts to the client.
+    """
+
+    def __init__(self, server, pkts: int, **link_settings):
+        super().__init__(server, **link_settings)
+        self.pkts = pkts
+
+    def run(self, now: float):
+        """
+        Delivers the pkts due by now, then raises KeyboardInterrupt if enough of them reached the client.
+
+        :param now: the current time
+        """
+
+        super().run(now)
+        if self.down.stats["delivered"] >= self.pkts:
+            raise KeyboardInterrupt
+
+
+class SimDownloadTest(TempDirTest, unittest.TestCase):
+    def setUp(self):
+        super().setUp()
+        clock = SimClock().installed()
+        clock.__enter__()
+        self.addCleanup(clock.__exit__, None, None, None)
+
+    def assertSaved(self, file_name: str, body: bytes):
+        """
+        Checks that a download is complete: the file holds the body, and no partial file or journal is left.
+
+        :param file_name: the file name
+        :param body: the expected body
+        """
+
+        with open(file_name, "rb") as fd:
+            self.assertTrue(fd.read() == body, file_name)  # not assertEqual, which would print megabytes
+        self.assertFalse(os.path.exists(file_name + PARTIAL_SUFFIX))
+        self.assertFalse(os.path.exists(file_name + PARTIAL_SUFFIX + JOURNAL_SUFFIX))
+
+    def test_clean(self):
+        link = SimLink(ScriptedServer(FILES), rtt=0.005)
+        download("http://sim/body", link=link)
+        self.assertSaved("body", BODY)
+        self.assertEqual(link.down.stats["lost"], 0)
+
+    def test_lossy(self):
+        link = SimLink(ScriptedServer(FILES), **LOSSY_LINK)
+        download("http://sim/body", link=link)
+        self.assertSaved("body", BODY)
+        self.assertGreater(link.down.stats["lost"], 0)
+        self.assertGreater(link.down.stats["reordered"], 0)
+
+    def test_chunked(self):
+        download("http://sim/body", link=SimLink(ScriptedServer(FILES, chunked=True), rtt=0.005))
+        self.assertSaved("body", BODY)
+
+    def test_chunked_lossy(self):
+        download("http://sim/body", link=SimLink(ScriptedServer(FILES, chunked=True), **LOSSY_LINK))
+        self.assertSaved("body", BODY)
+
+    def test_persistent(self):
+        paths = ["/a.bin", "/b.bin", "/c.bin", "/b.bin"]
+        for pipeline in (False, True):
+            link = SimLink(ScriptedServer(FILES), rtt=0.005)
+            download_persistent(["http://sim" + path for path in paths], pipeline=pipeline, link=link)
+            self.assertEqual(link.next_port, FIRST_PORT + 1)  # a single connection
+            for file_name, path in zip(["a.bin", "b.bin", "c.bin", "b.bin.1"], paths):
+                self.assertSaved(file_name, FILES[path])
+
+    def test_pipelined_lossy(self):
+        paths = ["/a.bin", "/b.bin", "/c.bin"]
+        link = SimLink(ScriptedServer(FILES), **LOSSY_LINK)
+        download_persistent(["http://sim" + path for path in paths], pipeline=True, link=link)
+        for path in paths:
+            self.assertSaved(path[1:], FILES[path])
+
+    def test_interrupted_then_resumed(self):
+        with self.assertRaises(KeyboardInterrupt):
+            download("http://sim/body", link=InterruptedLink(ScriptedServer(FILES), INTERRUPT_AFTER, **SLOW_LINK))
+        partial_size = os.path.getsize("body" + PARTIAL_SUFFIX)
+        self.assertGreater(partial_size, 0)
+        self.assertLess(partial_size, len(BODY))
+        self.assertFalse(os.path.exists("body"))
+        self.assertTrue(os.path.exists("body" + PARTIAL_SUFFIX + JOURNAL_SUFFIX))
+
+        link = SimLink(ScriptedServer(FILES), rtt=0.005)
+        download("http://sim/body", resume=True, link=link)
+        self.assertSaved("body", BODY)
+        self.assertLess(link.down.stats["delivered"], len(BODY) // 1460)  # only the rest was sent again
+
+    def test_resume_after_change(self):
+        with self.assertRaises(KeyboardInterrupt):
+            download("http://sim/body", link=InterruptedLink(ScriptedServer(FILES), INTERRUPT_AFTER, **SLOW_LINK))
+        changed = dict(FILES, **{"/body": os.urandom(len(BODY))})  # a new ETag: the server sends it all
+        download("http://sim/body", resume=True, link=SimLink(ScriptedServer(changed), rtt=0.005))
+        self.assertSaved("body", changed["/body"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+"""
+Checks the flow filters on crafted pkts: the kernel program of flow_program(), run by a small classic BPF
+interpreter, and the user-space FlowFilter must agree on the connection's own pkts, another port, another address,
+another protocol and an IP header with options.
+
+Usage: python3 test/test_socket_filter.py, or python3 -m pytest test
+"""
+import os
+import socket
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from socket_filter import (  # noqa: E402
+    flow_program, FlowFilter, BPF_LD, BPF_LDX, BPF_JMP, BPF_RET, BPF_W, BPF_H, BPF_B, BPF_IND, BPF_JEQ
+)
+from tcp_pkt import HeaderTemplate  # noqa: E402
+
+US, SERVER = "10.0.0.2", "93.184.216.34"
+US_PORT, SERVER_PORT = 40000, 80
+SIZES = {BPF_W: 4, BPF_H: 2, BPF_B: 1}
+
+
+def run_bpf(program: list, pkt: bytes) -> int:
+    """
+    Runs a classic BPF program on a pkt, for the instructions flow_program() uses.
+
+    :param program: the (code, jt, jf, k) instructions
+    :param pkt: the raw IP pkt
+    :return: the bytes of the pkt to accept, 0 to drop it
+    """
+
+    a = x = pc = 0
+    while True:
+        code, jt, jf, k = program[pc]
+        pc += 1
+        if code & 0x07 == BPF_RET:
+            return k
+        if code & 0x07 == BPF_LD:
+            size = SIZES[code & 0x18]
+            offset = k + (x if code & 0xE0 == BPF_IND else 0)
+            if offset + size > len(pkt):  # the kernel drops the pkt
+                return 0
+            a = int.from_bytes(pkt[offset:offset + size], "big")
+        elif code & 0x07 == BPF_LDX:  # BPF_MSH, the only one used
+            x = (pkt[k] & 0x0F) * 4
+        elif code & 0x07 == BPF_JMP:
+            taken = a == k if code & 0xF0 == BPF_JEQ else a & k != 0
+            pc += jt if taken else jf
+
+
+def pkt(src_host: str = SERVER, src_port: int = SERVER_PORT, dst_host: str = US, dst_port: int = US_PORT) -> bytes:
+    """
+    Builds a TCP pkt with a payload.
+
+    :param src_host: the source address
+    :param src_port: the source port
+    :param dst_host: the destination address
+    :param dst_port: the destination port
+    :return: the raw IP pkt
+    """
+
+    return bytes(HeaderTemplate(src_host, src_port, dst_host, dst_port).stamp(1, 1, 65535, payload=b"data")) + b"data"
+
+
+def with_ip_options(raw_pkt: bytes) -> bytes:
+    """
+    Returns a pkt with 8 bytes of IP options (NOPs then end of options), i.e. an IHL of 7.
+
+    :param raw_pkt: the raw IP pkt, without options
+    :return: the raw IP pkt
+    """
+
+    options = bytes((1, 1, 1, 1, 1, 1, 1, 0))
+    header = bytearray(raw_pkt[:20])
+    header[0] = 0x47
+    header[2:4] = (len(raw_pkt) + len(options)).to_bytes(2, "big")
+    return bytes(header) + options + raw_pkt[20:]
+
+
+def with_protocol(raw_pkt: bytes, protocol: int) -> bytes:
+    """
+    Returns a pkt with another IP protocol.
+
+    :param raw_pkt: the raw IP pkt
+    :param protocol: the protocol number
+    :return: the raw IP pkt
+    """
+
+    return raw_pkt[:9] + bytes((protocol,)) + raw_pkt[10:]
+
+
+class SocketFilterTest(unittest.TestCase):
+    def setUp(self):
+        self.program = flow_program(US, US_PORT, SERVER, SERVER_PORT)
+        self.flow = FlowFilter(US, US_PORT, SERVER, SERVER_PORT)
+
+    def assertAccepted(self, raw_pkt: bytes, accepted: bool):
+        """
+        Checks that both filters accept a pkt, or that both drop it.
+
+        :param raw_pkt: the raw IP pkt
+        :param accepted: whether the pkt belongs to the connection
+        """
+
+        self.assertEqual(run_bpf(self.program, raw_pkt) > 0, accepted)
+        self.assertEqual(self.flow.matches(raw_pkt), accepted)
+
+    def test_matching_flow(self):
+        self.assertAccepted(pkt(), True)
+        self.assertEqual(run_bpf(self.program, pkt()), 65535)  # the whole pkt
+
+    def test_wrong_port(self):
+        self.assertAccepted(pkt(src_port=8080), False)
+        self.assertAccepted(pkt(dst_port=US_PORT + 1), False)
+        self.assertAccepted(pkt(SERVER, US_PORT, US, SERVER_PORT), False)  # the ports swapped
+
+    def test_wrong_address(self):
+        self.assertAccepted(pkt(src_host="93.184.216.35"), False)
+        self.assertAccepted(pkt(dst_host="10.0.0.3"), False)
+        self.assertAccepted(pkt(US, US_PORT, SERVER, SERVER_PORT), False)  # our own pkt, looped back
+
+    def test_other_protocol(self):
+        for protocol in (socket.IPPROTO_UDP, socket.IPPROTO_ICMP):
+            self.assertAccepted(with_protocol(pkt(), protocol), False)
+
+    def test_ip_options(self):
+        self.assertAccepted(with_ip_options(pkt()), True)  # the ports are found past the options
+        self.assertAccepted(with_ip_options(pkt(src_port=8080)), False)
+
+    def test_later_fragment(self):
+        raw_pkt = bytearray(pkt())
+        raw_pkt[6:8] = (185).to_bytes(2, "big")  # at byte 1480 of the datagram: no TCP header
+        self.assertEqual(run_bpf(self.program, bytes(raw_pkt)), 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
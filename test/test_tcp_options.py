@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+"""
+Checks the TCP options codec: round trips of every combination the stack sends, alignment, and malformed input
+such as truncated options, zero or oversized length bytes, EOL padding and unknown kinds.
+
+Usage: python3 test/test_tcp_options.py, or python3 -m pytest test
+"""
+import itertools
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from tcp_pkt import TCPOptions, iter_options  # noqa: E402
+
+MSS = bytes((2, 4, 0x05, 0xB4))  # 1460
+WSCALE = bytes((3, 3, 7))
+SACK_OK = bytes((4, 2))
+TIMESTAMPS = bytes((8, 10)) + (123456).to_bytes(4, "big") + (0).to_bytes(4, "big")
+
+
+def fields(options: TCPOptions) -> tuple:
+    """
+    Returns the option values in a comparable form.
+
+    :param options: the options
+    :return: the values, in the order of the TCPOptions arguments
+    """
+
+    return (
+        options.mss,
+        options.window_scale,
+        options.sack_permitted,
+        [tuple(block) for block in options.sack_blocks],
+        tuple(options.timestamps) if options.timestamps is not None else None,
+    )
+
+
+class TCPOptionsTest(unittest.TestCase):
+    def test_round_trip(self):
+        values = itertools.product(
+            (None, 536, 1460, 65535),
+            (None, 0, 7, 14),
+            (False, True),
+            ([], [(1, 2)], [(0, 2**32 - 1), (100, 200), (2**32 - 10, 5)]),
+            (None, (0, 0), (2**32 - 1, 12345)),
+        )
+        for mss, window_scale, sack_permitted, sack_blocks, timestamps in values:
+            options = TCPOptions(mss, window_scale, sack_permitted, sack_blocks, timestamps)
+            encoded = options.pack()
+            self.assertEqual(len(encoded) % 4, 0, fields(options))
+            self.assertLessEqual(len(encoded), 40 + 4 * len(sack_blocks))
+            self.assertEqual(fields(TCPOptions.unpack(memoryview(encoded))), fields(options))
+
+    def test_empty(self):
+        self.assertEqual(TCPOptions().pack(), b"")
+        self.assertEqual(fields(TCPOptions.unpack(memoryview(b""))), (None, None, False, [], None))
+
+    def test_zero_timestamp_echo(self):
+        self.assertEqual(TCPOptions.unpack(memoryview(TIMESTAMPS)).timestamps, (123456, 0))
+
+    def test_eol_padding(self):
+        options = TCPOptions.unpack(memoryview(MSS + bytes((0, 0, 0, 0))))
+        self.assertEqual(options.mss, 1460)
+        options = TCPOptions.unpack(memoryview(MSS + bytes((0,)) + WSCALE))  # nothing is read after EOL
+        self.assertIsNone(options.window_scale)
+
+    def test_nop_padding(self):
+        options = TCPOptions.unpack(memoryview(bytes((1, 1, 1)) + WSCALE + bytes((1,)) + MSS))
+        self.assertEqual((options.mss, options.window_scale), (1460, 7))
+
+    def test_unknown_kind(self):
+        options = TCPOptions.unpack(memoryview(bytes((30, 6, 1, 2, 3, 4)) + MSS))
+        self.assertEqual(options.mss, 1460)
+
+    def test_zero_length(self):
+        self.assertEqual(list(iter_options(memoryview(bytes((30, 0)) + MSS))), [])
+        self.assertEqual(list(iter_options(memoryview(bytes((30, 1)) + MSS))), [])
+
+    def test_truncated(self):
+        parts = [MSS, WSCALE, SACK_OK, TIMESTAMPS]
+        encoded = b"".join(parts)
+        for i in range(len(encoded) + 1):
+            options = [(kind, bytes(value)) for kind, value in iter_options(memoryview(encoded[:i]))]
+            complete = []
+            end = 0
+            for part in parts:
+                end += len(part)
+                if end <= i:  # the options cut short are left out, and nothing after them is read
+                    complete.append((part[0], part[2:]))
+            self.assertEqual(options, complete, "cut at %d" % i)
+            TCPOptions.unpack(memoryview(encoded[:i]))  # never raises
+
+    def test_length_past_the_end(self):
+        self.assertEqual(list(iter_options(memoryview(bytes((2, 40, 5, 180))))), [])
+        self.assertIsNone(TCPOptions.unpack(memoryview(bytes((8, 10, 0, 0, 0, 1)))).timestamps)
+
+    def test_wrong_lengths(self):
+        encoded = bytes((2, 3, 5, 3, 2, 4, 3, 0, 5, 5, 1, 2, 3, 8, 6, 0, 0, 0, 1))
+        self.assertEqual([kind for kind, _ in iter_options(memoryview(encoded))], [2, 3, 4, 5, 8])
+        options = TCPOptions.unpack(memoryview(encoded))
+        self.assertEqual(fields(options), (None, None, False, [], None))
+
+    def test_window_scale_capped(self):
+        self.assertEqual(TCPOptions.unpack(memoryview(bytes((3, 3, 20)))).window_scale, 14)
+
+    def test_sack_blocks(self):
+        blocks = [(10, 20), (30, 40), (50, 60), (70, 80)]
+        encoded = bytes((5, 2 + 8 * len(blocks))) + b"".join(
+            left.to_bytes(4, "big") + right.to_bytes(4, "big") for left, right in blocks
+        )
+        self.assertEqual([tuple(block) for block in TCPOptions.unpack(memoryview(encoded)).sack_blocks], blocks)
+        self.assertEqual(TCPOptions.unpack(memoryview(bytes((5, 7)) + encoded[2:7])).sack_blocks, ())
+
+
+if __name__ == "__main__":
+    unittest.main()
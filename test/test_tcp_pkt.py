@@ -0,0 +1,200 @@
+#!/usr/bin/env python3
+"""
+Checks HeaderTemplate.stamp: the stamped headers decode to the given fields, with and without options, their IP and
+TCP checksums hold, and the TCP header matches the one TCPPacket.pack builds field by field. Also checks the received
+TCP pkt parser: header fields, options, Ethernet padding, and the truncated and corrupt pkts it drops.
+
+Usage: python3 test/test_tcp_pkt.py, or python3 -m pytest test
+"""
+import os
+import random
+import socket
+import struct
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from ip_pkt import IPPacket  # noqa: E402
+from tcp_pkt import HeaderTemplate, TCPOptions, TCPPacket, SEQ_SPACE, FIN, SYN, RST, PSH, ACK  # noqa: E402
+from utils import calculate_checksum, checksum_sum  # noqa: E402
+
+US, SERVER = "10.0.0.2", "93.184.216.34"
+US_PORT, SERVER_PORT = 40000, 80
+OPTIONS = TCPOptions(mss=1460, sack_permitted=True, timestamps=(123456, 654321), window_scale=7).pack()
+
+
+def pseudo_header(tcp_length: int) -> bytes:
+    """
+    Builds the pseudo header of a pkt from us to the server.
+
+    :param tcp_length: the TCP header and payload length
+    :return: the pseudo header
+    """
+
+    return socket.inet_aton(US) + socket.inet_aton(SERVER) + struct.pack("!BBH", 0, socket.IPPROTO_TCP, tcp_length)
+
+
+def server_pkt(payload: bytes = b"", options: bytes = b"", flags: int = ACK) -> bytes:
+    """
+    Builds a pkt from the server.
+
+    :param payload: the payload
+    :param options: the encoded options
+    :param flags: the TCP flags
+    :return: the raw IP pkt
+    """
+
+    header = HeaderTemplate(SERVER, SERVER_PORT, US, US_PORT).stamp(5000, 6000, 4096, flags, payload, options=options)
+    return bytes(header) + options + payload
+
+
+def parse(raw_pkt: bytes):
+    """
+    Parses a pkt, checksums included.
+
+    :param raw_pkt: the raw IP pkt
+    :return: the TCP pkt, None if it is invalid
+    """
+
+    ip_pkt = IPPacket.unpack(memoryview(raw_pkt))
+    return TCPPacket.unpack(ip_pkt=ip_pkt, raw_tcp_pkt=ip_pkt.data)
+
+
+class HeaderTemplateTest(unittest.TestCase):
+    def setUp(self):
+        self.template = HeaderTemplate(US, US_PORT, SERVER, SERVER_PORT)
+        self.rng = random.Random(793)
+
+    def check(self, seq_num: int, ack_num: int, adv_wnd: int, flags: int, payload: bytes, options: bytes):
+        """
+        Stamps a header, then checks its fields and checksums.
+
+        :param seq_num: the sequence number
+        :param ack_num: the acknowledgment number
+        :param adv_wnd: the window
+        :param flags: the TCP flags
+        :param payload: the payload
+        :param options: the encoded options
+        """
+
+        fields = (seq_num, ack_num, adv_wnd, flags, len(payload), len(options))
+        header = bytes(self.template.stamp(seq_num, ack_num, adv_wnd, flags, payload, options=options))
+        ip_header, tcp_header = header[:20], header[20:]
+        version_ihl, _, total_length, _, _, ttl, protocol = struct.unpack_from("!BBHHHBB", ip_header)
+        self.assertEqual(version_ihl, 0x45, fields)
+        self.assertEqual(total_length, 40 + len(options) + len(payload), fields)
+        self.assertEqual((ttl, protocol), (255, socket.IPPROTO_TCP), fields)
+        self.assertEqual(ip_header[12:20], socket.inet_aton(US) + socket.inet_aton(SERVER), fields)
+        self.assertEqual(calculate_checksum(ip_header), 0, fields)  # the sum over a valid header is -0
+
+        ports, seq_ack, offset_flags_wnd = struct.unpack_from("!4s8s4s", tcp_header)
+        self.assertEqual(ports, struct.pack("!HH", US_PORT, SERVER_PORT), fields)
+        self.assertEqual(seq_ack, struct.pack("!II", seq_num, ack_num), fields)
+        self.assertEqual(offset_flags_wnd, struct.pack("!BBH", (5 + len(options) // 4) << 4, flags, adv_wnd), fields)
+        tcp_length = len(tcp_header) + len(options) + len(payload)
+        self.assertEqual(calculate_checksum(pseudo_header(tcp_length), tcp_header, options, payload), 0, fields)
+
+        tcp_pkt = TCPPacket(US, US_PORT, SERVER, SERVER_PORT)  # the same pkt, built field by field
+        tcp_pkt.seq_num, tcp_pkt.ack_num, tcp_pkt.adv_wnd = seq_num, ack_num, adv_wnd
+        tcp_pkt.fin, tcp_pkt.syn, tcp_pkt.rst = bool(flags & FIN), bool(flags & SYN), bool(flags & RST)
+        tcp_pkt.psh, tcp_pkt.ack = bool(flags & PSH), bool(flags & ACK)
+        tcp_pkt.payload, tcp_pkt.options = payload, options
+        self.assertEqual(tcp_header + options + payload, bytes(tcp_pkt.pack()), fields)
+
+    def test_without_options(self):
+        self.check(1, 2, 65535, ACK, b"", b"")
+        self.check(SEQ_SPACE - 1, SEQ_SPACE - 1, 0, ACK | PSH, b"data", b"")
+        self.check(0, 0, 1, FIN | ACK, b"", b"")
+
+    def test_with_options(self):
+        sack = TCPOptions(sack_blocks=[(100, 200), (300, 400)]).pack()
+        self.check(1000, 0, 65535, SYN, b"", OPTIONS)
+        self.check(1000, 2000, 512, ACK, b"odd", sack)
+        self.check(1000, 2000, 512, ACK, b"", TCPOptions(timestamps=(1, 2)).pack())
+
+    def test_random_fields(self):
+        for _ in range(300):
+            self.check(
+                self.rng.randrange(SEQ_SPACE),
+                self.rng.randrange(SEQ_SPACE),
+                self.rng.randrange(1 << 16),
+                self.rng.choice((ACK, ACK | PSH, ACK | FIN, SYN, SYN | ACK, RST, RST | ACK)),
+                bytes(self.rng.randrange(256) for _ in range(self.rng.randrange(64))),
+                self.rng.choice((b"", OPTIONS, TCPOptions(timestamps=(self.rng.randrange(SEQ_SPACE), 0)).pack())),
+            )
+
+    def test_ip_id(self):
+        ids = [struct.unpack_from("!H", self.template.stamp(1, 1, 65535), 4)[0] for _ in range(3)]
+        self.assertEqual(ids, [ids[0], ids[0] + 1, ids[0] + 2])  # each pkt gets its own
+        self.template.ip_id = 0xffff
+        header = self.template.stamp(1, 1, 65535)
+        self.assertEqual(struct.unpack_from("!H", header, 4)[0], 0)  # wraps around
+        self.assertEqual(calculate_checksum(header[:20]), 0)
+
+    def test_payload_sum(self):
+        payload = b"retransmitted payload"
+        stamped = bytes(self.template.stamp(7, 8, 1024, ACK, payload))
+        self.template.ip_id -= 1  # the same IP ID, so the headers can be compared
+        given = bytes(self.template.stamp(7, 8, 1024, ACK, b"x" * len(payload), checksum_sum(payload)))
+        self.assertEqual(given, stamped)  # the given sum is used, not the bytes
+
+
+class TCPPacketViewTest(unittest.TestCase):
+    def test_fields(self):
+        tcp_pkt = parse(server_pkt(b"data", flags=ACK | PSH))
+        self.assertEqual((tcp_pkt.src_host, tcp_pkt.src_port), (SERVER, SERVER_PORT))
+        self.assertEqual((tcp_pkt.dst_host, tcp_pkt.dst_port), (US, US_PORT))
+        self.assertEqual((tcp_pkt.seq_num, tcp_pkt.ack_num, tcp_pkt.adv_wnd), (5000, 6000, 4096))
+        self.assertEqual(tcp_pkt.flags, ACK | PSH)
+        self.assertEqual(
+            (tcp_pkt.fin, tcp_pkt.syn, tcp_pkt.rst, tcp_pkt.psh, tcp_pkt.ack, tcp_pkt.urg),
+            (False, False, False, True, True, False),
+        )
+        self.assertEqual(tcp_pkt.header_length, 20)
+        self.assertEqual(bytes(tcp_pkt.options), b"")
+        self.assertEqual(bytes(tcp_pkt.payload), b"data")
+
+    def test_options(self):
+        for payload in (b"", b"data"):
+            tcp_pkt = parse(server_pkt(payload, OPTIONS, SYN | ACK))
+            self.assertEqual(tcp_pkt.header_length, 20 + len(OPTIONS))
+            self.assertEqual(bytes(tcp_pkt.options), OPTIONS)
+            self.assertEqual(bytes(tcp_pkt.payload), payload)  # starts past the options
+            self.assertEqual(TCPOptions.unpack(tcp_pkt.options).mss, 1460)
+
+    def test_ethernet_padding(self):
+        tcp_pkt = parse(server_pkt(b"ab") + bytes(4))  # 42 bytes, padded to the 46 of a minimal Ethernet payload
+        self.assertIsNotNone(tcp_pkt)  # the padding isn't summed
+        self.assertEqual(bytes(tcp_pkt.payload), b"ab")
+
+    def test_truncated(self):
+        raw_pkt = server_pkt(b"data", OPTIONS)
+        for length in (20, 39, 40 + len(OPTIONS) - 1, len(raw_pkt) - 1):  # within the header, options or payload
+            truncated = bytearray(raw_pkt[:length])
+            truncated[2:4] = length.to_bytes(2, "big")  # the IP header agrees, and keeps a valid checksum
+            truncated[10:12] = b"\x00\x00"
+            truncated[10:12] = calculate_checksum(truncated[:20]).to_bytes(2, "big")
+            self.assertIsNone(parse(bytes(truncated)), length)
+
+    def test_data_offset_out_of_range(self):
+        for data_offset in (0, 4, 15):  # below the header size, or past the end of the pkt
+            raw_pkt = bytearray(server_pkt(b"data"))
+            raw_pkt[32] = data_offset << 4
+            self.assertIsNone(parse(bytes(raw_pkt)), data_offset)
+
+    def test_corrupt_checksum(self):
+        raw_pkt = server_pkt(b"data", OPTIONS)
+        for offset in (20, 24, 33, 36, 40, len(raw_pkt) - 1):  # ports, seq_num, flags, checksum, options, payload
+            corrupt = bytearray(raw_pkt)
+            corrupt[offset] ^= 0x01
+            self.assertIsNone(parse(bytes(corrupt)), offset)
+        wrong_host = bytearray(HeaderTemplate(SERVER, SERVER_PORT, "10.0.0.3", US_PORT).stamp(5000, 6000, 4096))
+        wrong_host[16:20] = socket.inet_aton(US)  # a valid IP header, but the pseudo header no longer sums
+        wrong_host[10:12] = b"\x00\x00"
+        wrong_host[10:12] = calculate_checksum(wrong_host[:20]).to_bytes(2, "big")
+        self.assertIsNone(parse(bytes(wrong_host)))
+
+
+if __name__ == "__main__":
+    unittest.main()
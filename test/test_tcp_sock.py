@@ -0,0 +1,354 @@
+#!/usr/bin/env python3
+"""
+Checks the sender side of TCPSocket over a SimLink: which pkt is timed for the RTT across retransmissions (Karn's
+algorithm), the RTO backoff, who retransmits while going back after a timeout, how long uploads take on a lossy
+link with each congestion controller, and how long it takes to give up on a silent server. On the receiver side, it
+counts the ACKs the delayed-ACK policy sends for in-order and out-of-order data. Last, the connection's stats are
+checked against what went over the link. Everything runs on a simulated clock, so the results don't depend on the
+machine's speed.
+
+Usage: python3 test/test_tcp_sock.py, or python3 -m pytest test
+"""
+import io
+import os
+import sys
+import unittest
+from contextlib import redirect_stderr
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from congestion import NewReno, Cubic  # noqa: E402
+from rtt import INITIAL_RTO, MAX_RTO  # noqa: E402
+from sim_link import SimLink, SimClock  # noqa: E402
+from sim_peer import ScriptedServer  # noqa: E402
+from tcp_pkt import TCPPacket, SEQ_SPACE  # noqa: E402
+import tcp_sock  # noqa: E402
+from tcp_sock import TCPSocket, MAX_IDLE_TIME, DELAYED_ACK_TIMEOUT, DELAYED_ACK_SEGMENTS  # noqa: E402
+
+DATA = memoryview(os.urandom(20000))
+UPLOAD = os.urandom(200000)
+LOSSY_LINK = dict(rtt=0.02, loss=0.05)
+UPLOAD_TIME = 2.5  # simulated seconds, the runs below take 1.0 to 1.7 s
+MAX_TIMEOUTS = 5  # per upload, the runs below have 2 to 4
+
+
+class CountingSocket(TCPSocket):
+    """
+    A TCPSocket that records its retransmission timeouts, and the cwnd each one leaves, with its time.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.timeout_cwnds = []  # (seconds since the stats started, cwnd)
+
+    def on_timeout(self):
+        super().on_timeout()
+        now = tcp_sock.monotonic()  # the clock the stats read, simulated or not
+        self.timeout_cwnds.append((round(now - self.stats.start, 6), self.cc.cwnd))
+
+
+class WireRecorder:
+    """
+    A connection's sender that records the data segments it sends, as (seq_num, payload length).
+    """
+
+    def __init__(self, sender):
+        self.sender = sender
+        self.segments = []
+
+    def send(self, bufs: list):
+        header = bufs[0]
+        length = int.from_bytes(header[2:4], "big") - 20 - (header[32] >> 4) * 4  # less the IP and TCP headers
+        if length:
+            self.segments.append((int.from_bytes(header[24:28], "big"), length))
+        self.sender.send(bufs)
+
+
+class AckRecorder:
+    """
+    A connection's sender that records the ack_num of the pkts it sends.
+    """
+
+    def __init__(self, sender):
+        self.sender = sender
+        self.acks = []
+
+    def send(self, bufs: list):
+        self.acks.append(int.from_bytes(bufs[0][28:32], "big"))  # in the TCP header, after the IP one
+        self.sender.send(bufs)
+
+
+class SenderTest(unittest.TestCase):
+    def setUp(self):
+        clock = SimClock().installed()
+        clock.__enter__()
+        self.addCleanup(clock.__exit__, None, None, None)  # after tearDown
+        self.sock = TCPSocket("example.com", link=SimLink(ScriptedServer({}), rtt=0.01), timestamps=False, stats=True)
+        self.assertTrue(self.sock.connect())
+        self.sock.cc.cwnd = 1 << 20  # never in the way of the pkts the tests send
+        self.offset = 0
+
+    def tearDown(self):
+        self.sock.release()
+
+    def send(self, pkts: int):
+        """
+        Sends new data pkts, without waiting for their ACKs.
+
+        :param pkts: the number of pkts
+        """
+
+        self.offset = self.sock.fill_window(DATA[:self.offset + pkts * self.sock.mss], self.offset)
+
+    def end(self, i: int) -> int:
+        """
+        Returns the seq_num after a queued pkt.
+
+        :param i: the index of the pkt in the retransmission queue
+        :return: the seq_num
+        """
+
+        queued_pkt = self.sock.retransmission_queue[i]
+        return (queued_pkt.seq_num + len(queued_pkt.payload)) % SEQ_SPACE
+
+    def ack(self, ack_num: int):
+        """
+        Hands the connection an ACK from the server.
+
+        :param ack_num: the acknowledgment number
+        """
+
+        ack_pkt = TCPPacket(self.sock.dst_host, self.sock.dst_port, self.sock.src_host, self.sock.src_port)
+        ack_pkt.ack = True
+        ack_pkt.ack_num = ack_num
+        ack_pkt.adv_wnd = self.sock.dst_adv_wnd >> self.sock.snd_wscale
+        self.sock.on_ack(ack_pkt)
+
+    def test_first_new_pkt_timed(self):
+        self.send(3)
+        self.assertEqual(self.sock.rtt_seq, self.end(0))
+
+    def test_retransmitting_another_pkt_keeps_timing(self):
+        self.send(3)
+        self.sock.retransmit(self.sock.retransmission_queue[1])
+        self.sock.retransmit(self.sock.retransmission_queue[2])
+        self.assertEqual(self.sock.rtt_seq, self.end(0))
+
+    def test_retransmitting_the_timed_pkt(self):
+        self.send(3)
+        self.sock.retransmit(self.sock.retransmission_queue[0])
+        self.assertIsNone(self.sock.rtt_seq)
+        self.sock.retransmit(self.sock.retransmission_queue[1])  # doesn't start a measurement either
+        self.assertIsNone(self.sock.rtt_seq)
+        self.send(1)  # the next new pkt is timed
+        self.assertEqual(self.sock.rtt_seq, self.end(3))
+        self.sock.retransmit(self.sock.retransmission_queue[0])
+        self.assertEqual(self.sock.rtt_seq, self.end(3))
+
+    def test_sample_after_retransmission(self):
+        self.send(3)
+        self.sock.retransmit(self.sock.retransmission_queue[0])
+        self.send(1)
+        samples = self.sock.stats.rtt.count
+        self.ack(self.end(2))  # covers the retransmitted pkt only: no sample
+        self.assertEqual(self.sock.stats.rtt.count, samples)
+        self.ack(self.end(0))  # covers the pkt timed after it
+        self.assertEqual(self.sock.stats.rtt.count, samples + 1)
+        self.assertIsNone(self.sock.rtt_seq)
+
+    def test_sample_undoes_backoff(self):
+        rto = self.sock.rtt.rto
+        self.send(3)
+        self.sock.on_timeout()
+        self.sock.on_timeout()
+        self.assertEqual(self.sock.rtt.rto, min(4 * rto, MAX_RTO))
+        self.assertIsNone(self.sock.rtt_seq)  # the timed pkt was resent
+        self.sock.cc.cwnd = 1 << 20
+        self.send(1)
+        self.assertEqual(self.sock.rtt_seq, self.end(3))
+        self.ack(self.end(3))
+        self.assertLess(self.sock.rtt.rto, 2 * rto)
+        self.assertLess(self.sock.rtt.rto, INITIAL_RTO)
+
+    def test_go_back_owns_retransmissions(self):
+        self.send(6)
+        self.sock.on_timeout()  # resends the first pkt only, the window is down to one
+        retransmits = self.sock.stats.retransmits
+        self.sock.cc.in_recovery = True  # a partial ACK would ask for a retransmission
+        self.sock.cc.recover = (self.end(5) + 1) % SEQ_SPACE
+        self.ack(self.end(0))
+        self.assertEqual(self.sock.stats.retransmits - retransmits, 1)  # go_back resends the second pkt, only once
+        self.assertEqual(self.sock.rtx_next, self.end(0))
+
+
+class LossyUploadTest(unittest.TestCase):
+    def upload(self, congestion_control, seed: int) -> tuple:
+        """
+        Uploads UPLOAD over a lossy SimLink on a simulated clock, without timestamps, so the RTO relies on Karn's
+        algorithm.
+
+        :param congestion_control: the congestion controller class
+        :param seed: the seed of the link's random generator
+        :return: the transfer time in simulated seconds and the connection's counters
+        """
+
+        clock = SimClock()
+        with clock.installed():
+            sock = TCPSocket(
+                "example.com",
+                link=SimLink(ScriptedServer({}), seed=seed, **LOSSY_LINK),
+                congestion_control=congestion_control,
+                timestamps=False,
+                stats=True,
+            )
+            self.assertTrue(sock.connect())
+            start = clock.now
+            sock.send(UPLOAD)
+            elapsed = clock.now - start
+            sock.release()
+        return elapsed, sock.stats
+
+    def check_upload(self, congestion_control, seeds: tuple):
+        """
+        Checks that uploads finish in time, with few timeouts, and that the same seed gives the same run.
+
+        :param congestion_control: the congestion controller class
+        :param seeds: the seeds of the link's random generator
+        """
+
+        for seed in seeds:
+            elapsed, stats = self.upload(congestion_control, seed)
+            self.assertLess(elapsed, UPLOAD_TIME, "seed %d" % seed)
+            self.assertLessEqual(stats.timeouts, MAX_TIMEOUTS, "seed %d" % seed)
+            self.assertGreater(stats.retransmits, 0, "seed %d" % seed)  # the link did lose pkts
+            again, stats_again = self.upload(congestion_control, seed)
+            self.assertEqual(again, elapsed, "seed %d" % seed)
+            self.assertEqual(
+                (stats_again.segments_out, stats_again.retransmits, stats_again.timeouts),
+                (stats.segments_out, stats.retransmits, stats.timeouts),
+                "seed %d" % seed,
+            )
+
+    def test_newreno(self):
+        self.check_upload(NewReno, (3, 7))
+
+    def test_cubic(self):
+        self.check_upload(Cubic, (3, 6))
+
+
+class DelayedAckTest(unittest.TestCase):
+    def setUp(self):
+        self.clock = SimClock()
+        installed = self.clock.installed()
+        installed.__enter__()
+        self.addCleanup(installed.__exit__, None, None, None)  # after tearDown
+        self.sock = TCPSocket("example.com", link=SimLink(ScriptedServer({}), rtt=0.01), timestamps=False)
+        self.assertTrue(self.sock.connect())
+        self.start = self.sock.ack_num  # the first byte of the server's data
+        self.sock.sender = AckRecorder(self.sock.sender)
+        self.acks = self.sock.sender.acks
+
+    def tearDown(self):
+        self.sock.release()
+
+    def segment(self, i: int):
+        """
+        Hands the connection a full-sized data segment from the server.
+
+        :param i: the index of the segment in the server's data
+        """
+
+        self.sock.recv_segment((self.start + i * self.sock.mss) % SEQ_SPACE, DATA[:self.sock.mss])
+
+    def end(self, i: int) -> int:
+        """
+        Returns the seq_num after a segment.
+
+        :param i: the index of the segment in the server's data
+        :return: the seq_num
+        """
+
+        return (self.start + (i + 1) * self.sock.mss) % SEQ_SPACE
+
+    def test_in_order(self):
+        for i in range(10):
+            self.segment(i)
+        self.assertEqual(self.acks, [self.end(i) for i in range(DELAYED_ACK_SEGMENTS - 1, 10, DELAYED_ACK_SEGMENTS)])
+        self.assertIsNone(self.sock.ack_deadline)
+
+    def test_timer(self):
+        self.segment(0)
+        self.assertEqual(self.acks, [])  # delayed
+        self.assertEqual(self.sock.ack_deadline, self.clock.now + DELAYED_ACK_TIMEOUT)
+        self.clock.sleep(DELAYED_ACK_TIMEOUT)
+        self.sock.fire_timers()
+        self.assertEqual(self.acks, [self.end(0)])
+        self.assertIsNone(self.sock.ack_deadline)
+
+    def test_out_of_order(self):
+        for i in (0, 2, 3, 1, 4, 5):  # 1 is late
+            self.segment(i)
+        self.assertEqual(self.acks, [
+            self.end(0),  # 2 is ahead of a gap: at once, covering 0 too
+            self.end(0),  # 3 as well
+            self.end(3),  # 1 fills the gap: at once
+            self.end(5),  # 4 and 5 are in order again: one ACK for both
+        ])
+
+    def test_duplicate(self):
+        self.segment(0)
+        self.segment(1)
+        self.segment(0)  # retransmitted by the server, maybe because our ACK was lost
+        self.assertEqual(self.acks, [self.end(1), self.end(1)])
+
+
+class StatsTest(unittest.TestCase):
+    def test_lossy_upload(self):
+        clock = SimClock()
+        with clock.installed():
+            link = SimLink(ScriptedServer({}), seed=3, **LOSSY_LINK)
+            sock = CountingSocket("example.com", link=link, congestion_control=NewReno, timestamps=False, stats=True)
+            self.assertTrue(sock.connect())
+            sock.sender = wire = WireRecorder(sock.sender)
+            sent_before = link.up.stats["sent"] - sock.stats.segments_out
+            sock.send(UPLOAD)
+            stats = sock.stats
+            self.assertEqual(stats.segments_out, link.up.stats["sent"] - sent_before)  # every pkt, ACKs included
+            self.assertEqual(stats.segments_in, link.down.stats["delivered"])  # the server's pkts are all ours
+            sock.release()
+        first_sends = set(wire.segments)
+        self.assertEqual(stats.retransmits, len(wire.segments) - len(first_sends))
+        self.assertEqual(stats.bytes_out, sum(length for _, length in wire.segments))
+        self.assertEqual(sum(length for _, length in first_sends), len(UPLOAD))
+        self.assertGreater(stats.retransmits, 0)
+
+        self.assertEqual(stats.timeouts, len(sock.timeout_cwnds))
+        self.assertGreater(stats.timeouts, 0)
+        for sample in sock.timeout_cwnds:  # a timeout shrinks the cwnd, which is always recorded
+            self.assertIn(sample, stats.cwnd)
+        times = [time for time, _ in stats.cwnd]
+        self.assertEqual(times, sorted(times))
+        self.assertLessEqual(times[-1], clock.now - stats.start)
+
+
+class SilentServerTest(unittest.TestCase):
+    def test_give_up(self):
+        clock = SimClock()
+        with clock.installed():
+            link = SimLink(ScriptedServer({}), rtt=0.02)
+            sock = TCPSocket("example.com", link=link, timestamps=False, stats=True)
+            self.assertTrue(sock.connect())
+            rto = sock.rtt.rto
+            link.down.loss = 1.0  # the server goes silent, while nothing of ours is outstanding
+            start = clock.now
+            with self.assertRaises(SystemExit), redirect_stderr(io.StringIO()) as stderr:
+                sock.recv_pkt()
+        self.assertEqual(stderr.getvalue(), "Connection failed\n")
+        self.assertGreaterEqual(clock.now - start, MAX_IDLE_TIME)
+        self.assertLess(clock.now - start, MAX_IDLE_TIME + MAX_RTO)
+        self.assertEqual(sock.rtt.rto, rto)  # idle timeouts don't back off the RTO of later data
+        self.assertLess(sock.stats.timeouts, 12)  # each one re-sends an ACK, at growing intervals
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,5 +1,9 @@
 import socket
-import struct
+from time import monotonic
+
+DNS_TTL = 60.0  # seconds a resolved address is reused; the system resolver doesn't tell the record's own TTL
+HOST_CACHE = {}  # host -> (address, expiry time)
+SOURCE_ADDRS = {}  # destination address -> source address
 
 
 def get_nw_interface_name() -> str:
@@ -11,32 +15,100 @@ def get_nw_interface_name() -> str:
     raise ValueError("Cannot find a valid network interface")
 
 
-def get_local_ip_addr():
+def get_local_ip_addr(dst_host: str) -> str:
     """
-    Returns the source's IP address.
+    Returns the source's IP address towards a destination, i.e. the address of the interface the kernel routes to
+    it through. A UDP socket connected to the destination is bound to that address, and connecting it sends nothing.
+    The answer is cached per destination.
 
+    :param dst_host: the destination address (dotted quad)
     :return: the source's IP address
+    :raise OSError: if there is no route to the destination
+    """
+
+    src_host = SOURCE_ADDRS.get(dst_host)
+    if src_host is None:
+        probe = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        try:
+            probe.connect((dst_host, 80))  # the port doesn't matter, only the route
+            src_host = SOURCE_ADDRS[dst_host] = probe.getsockname()[0]
+        finally:
+            probe.close()
+    return src_host
+
+
+def resolve_host(host: str) -> str:
     """
+    Returns the IPv4 address of a host. Answers are cached for DNS_TTL seconds, so connections to the same host
+    don't each wait for the resolver.
 
-    from subprocess import check_output
+    :param host: the host name or address
+    :return: the address (dotted quad)
+    :raise OSError: if the host can't be resolved
+    """
 
-    return check_output(["hostname", "-I"]).decode().strip()
+    now = monotonic()
+    entry = HOST_CACHE.get(host)
+    if entry is not None and entry[1] > now:
+        return entry[0]
+    addr = socket.gethostbyname(host)
+    HOST_CACHE[host] = addr, now + DNS_TTL
+    return addr
 
 
-def calculate_checksum(pkt):
+def checksum_sum(*bufs) -> int:
     """
-    Calculates the checksum of a packet.
+    Returns the one's complement sum of the given buffers as if they were concatenated, without concatenating them.
+
+    Since 2^16 = 1 (mod 0xffff), the one's complement sum of a run of 16-bit words equals the buffer read as one big
+    integer modulo 0xffff, which int.from_bytes computes in C. Appending a buffer multiplies the sum so far by 256 to
+    the power of its length, i.e. by 1 for an even length and by 256 for an odd one: the sum so far is shifted by one
+    byte before a buffer of odd length is added. An odd total length is padded with a zero byte at the end.
+
+    :param bufs: the buffers (bytes, bytearray or memoryview)
+    :return: the 16-bit one's complement sum (0xffff for a non-zero sum that folds to zero)
+    """
+
+    total = 0
+    length = 0
+    nonzero = False
+    for buf in bufs:
+        value = int.from_bytes(buf, "big")
+        if len(buf) % 2 != 0:  # the running sum shifts by one byte
+            total <<= 8
+        total = (total + value) % 0xffff
+        nonzero = nonzero or value != 0
+        length += len(buf)
+    if length % 2 != 0:  # pad the last word with a zero byte
+        total = (total << 8) % 0xffff
+    if total == 0 and nonzero:  # one's complement sum of non-zero data is never +0
+        total = 0xffff
+    return total
 
-    :param pkt: the packet
+
+def calculate_checksum(*bufs) -> int:
+    """
+    Calculates the checksum of a packet, which may be given as several buffers (e.g. pseudo header, header, payload).
+
+    :param bufs: the packet buffers
     :return: the checksum
     """
 
-    checksum = 0  # initialize checksum to zero
-    words = len(pkt) // 2  # calculate number of 16-bit chunks
-    for chunk in struct.unpack("!%sH" % words, pkt[:words * 2]):
-        checksum += chunk  # add up 16-bit chunks
-    if len(pkt) % 2 != 0:  # if pkt length is odd
-        checksum += pkt[-1] << 8
-    checksum = (checksum >> 16) + (checksum & 0xffff)
-    checksum += checksum >> 16
-    return ~checksum & 0xffff
+    return ~checksum_sum(*bufs) & 0xffff
+
+
+def update_checksum(checksum: int, old: int, new: int) -> int:
+    """
+    Incrementally updates a checksum after a header field changed from old to new (RFC 1624, eqn. 3), without
+    re-summing the rest of the packet. Works for 16 and 32-bit fields that are aligned on a 16-bit boundary.
+
+    :param checksum: the current checksum
+    :param old: the old field value
+    :param new: the new field value
+    :return: the updated checksum
+    """
+
+    total = ((~checksum & 0xffff) - old + new) % 0xffff  # HC' = ~(~HC + ~m + m')
+    if total == 0:
+        total = 0xffff
+    return ~total & 0xffff